@@ -2,18 +2,59 @@
 """
 Script for creating a .wotmod (compatible with Python 2.7)
 Compiles all .py files from ../src/ to .pyc in ../output/
+
+Incremental: a content-hash manifest in the output directory records what
+each .pyc was built from, so only changed sources are recompiled (in
+parallel). The archive is reproducible: entries are sorted and carry fixed
+timestamps and attributes, so the same sources give the same bytes.
+
+Must be run with Python 2.7 (the game's bytecode version).
+
+Usage:
+  python build_with_pyc27.py [--jobs N] [--clean] [--strip-docstrings]
+                             [--install-dir DIR] [--no-install]
+                             [--python-log FILE] [--pause]
+
+Install paths can also be set via WOT_MODS_DIR / WOT_PYTHON_LOG. On
+non-Windows hosts nothing is installed unless a directory is given.
 """
-import zipfile
+import argparse
+import ast
+import hashlib
+import imp
+import json
+import marshal
+import multiprocessing
 import os
-import py_compile
 import shutil
+import struct
+import sys
+import zipfile
 
 # Configuration
-SRC_DIR = "../src"
-OUTPUT_DIR = "../output"
-GAME_MODS_DIR = "e:\\Wargaming.net\\WorldOfTanks\\mods\\2.1.0.1"
+BUILD_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BUILD_DIR, "..", "src")
+OUTPUT_DIR = os.path.join(BUILD_DIR, "..", "output")
 MOD_NAME = "mod_winchance.wotmod"
 BASE_INTERNAL_PATH = "res/scripts/client/gui/mods"
+MANIFEST_NAME = "build_manifest.json"
+MANIFEST_VERSION = 1
+
+if sys.platform == "win32":
+    GAME_MODS_DIR = "e:\\Wargaming.net\\WorldOfTanks\\mods\\2.1.0.1"
+    GAME_PYTHON_LOG = "e:\\Wargaming.net\\WorldOfTanks\\python.log"
+else:
+    GAME_MODS_DIR = None
+    GAME_PYTHON_LOG = None
+
+PY27_MAGIC = b"\x03\xf3\r\n"
+
+# Fixed metadata for reproducible archives (the earliest date ZIP supports)
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_FILE_MODE = 0o644 << 16
+# Fixed mtime in the .pyc header: the game loads .pyc without sources
+PYC_MTIME = 0
+
 
 def ensure_dir(path):
     """Create directory if it doesn't exist"""
@@ -21,175 +62,336 @@ def ensure_dir(path):
         os.makedirs(path)
         print("Created directory: %s" % path)
 
-def compile_all_py_files():
-    """Compile all .py files from src to output directory"""
-    
+
+def find_sources(src_dir):
+    """Return sorted relative paths of all .py files under src_dir"""
+    sources = []
+    for root, dirs, files in os.walk(src_dir):
+        dirs.sort()
+        for filename in files:
+            if filename.endswith('.py'):
+                rel_path = os.path.relpath(os.path.join(root, filename), src_dir)
+                sources.append(rel_path.replace('\\', '/'))
+    return sorted(sources)
+
+
+def source_hash(data, strip_docstrings):
+    """Hash of the source and the options that affect the .pyc"""
+    digest = hashlib.sha1(data)
+    digest.update(b"strip" if strip_docstrings else b"keep")
+    return digest.hexdigest()
+
+
+def _is_docstring(node):
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Str)
+
+
+def strip_docstrings(tree):
+    """Remove module, class and function docstrings from an AST"""
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef)):
+            if node.body and _is_docstring(node.body[0]):
+                docstring = node.body.pop(0)
+                if not node.body:
+                    node.body.append(ast.copy_location(ast.Pass(), docstring))
+    return tree
+
+
+def compile_one(task):
+    """
+    Compile one source into .pyc (runs in a worker process)
+
+    Returns (rel_path, error) - error is None on success
+    """
+    src_path, out_path, rel_path, strip = task
+    try:
+        with open(src_path, 'rb') as f:
+            source = f.read()
+
+        if strip:
+            tree = strip_docstrings(ast.parse(source, rel_path))
+            code = compile(tree, rel_path, 'exec')
+        else:
+            code = compile(source, rel_path, 'exec')
+
+        data = imp.get_magic() + struct.pack('<I', PYC_MTIME) + marshal.dumps(code)
+
+        out_dir = os.path.dirname(out_path)
+        if not os.path.isdir(out_dir):
+            try:
+                os.makedirs(out_dir)
+            except OSError:
+                if not os.path.isdir(out_dir):
+                    raise
+
+        tmp_path = out_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        os.rename(tmp_path, out_path)
+        return rel_path, None
+    except Exception as e:
+        return rel_path, "%s: %s" % (type(e).__name__, e)
+
+
+def load_manifest(path):
+    """Load the build manifest, or an empty one if it is missing or stale"""
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION and manifest.get('magic') == imp.get_magic().encode('hex'):
+            return manifest
+    except (IOError, ValueError):
+        pass
+    return {'version': MANIFEST_VERSION, 'magic': imp.get_magic().encode('hex'), 'files': {}}
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def compile_all_py_files(src_dir, output_dir, jobs, strip, clean):
+    """
+    Compile changed .py files from src to output directory
+
+    Returns a sorted list of (out_path, rel_pyc) or None on failure
+    """
     print("=" * 70)
     print("Step 1: Compiling Python sources to .pyc")
     print("=" * 70)
-    
-    if not os.path.exists(SRC_DIR):
-        print("\nERROR: Source directory %s not found!" % SRC_DIR)
-        return False
-    
-    # Clean output directory
-    if os.path.exists(OUTPUT_DIR):
+
+    if not os.path.exists(src_dir):
+        print("\nERROR: Source directory %s not found!" % src_dir)
+        return None
+
+    if clean and os.path.exists(output_dir):
         print("\nCleaning output directory...")
-        shutil.rmtree(OUTPUT_DIR)
-    
-    ensure_dir(OUTPUT_DIR)
-    
+        shutil.rmtree(output_dir)
+    ensure_dir(output_dir)
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    old_files = manifest['files']
+    new_files = {}
+
+    sources = find_sources(src_dir)
+    if not sources:
+        print("\nERROR: No .py files found in %s" % src_dir)
+        return None
+
+    tasks = []
     compiled_files = []
+    for rel_path in sources:
+        src_path = os.path.join(src_dir, rel_path)
+        rel_pyc = rel_path[:-3] + '.pyc'
+        out_path = os.path.join(output_dir, rel_pyc)
+        with open(src_path, 'rb') as f:
+            digest = source_hash(f.read(), strip)
+
+        new_files[rel_path] = {'sha1': digest, 'pyc': rel_pyc}
+        compiled_files.append((out_path, rel_pyc))
+
+        entry = old_files.get(rel_path)
+        if entry and entry.get('sha1') == digest and os.path.exists(out_path):
+            continue
+        tasks.append((src_path, out_path, rel_path, strip))
+
+    # .pyc files of deleted sources must not end up in the archive
+    for rel_path, entry in sorted(old_files.items()):
+        if rel_path not in new_files:
+            stale = os.path.join(output_dir, entry['pyc'])
+            if os.path.exists(stale):
+                os.remove(stale)
+                print("Removed stale: %s" % entry['pyc'])
+
     errors = []
-    
-    # Walk through all subdirectories
-    for root, dirs, files in os.walk(SRC_DIR):
-        for filename in files:
-            if not filename.endswith('.py'):
-                continue
-            
-            src_path = os.path.join(root, filename)
-            
-            # Calculate relative path
-            rel_path = os.path.relpath(src_path, SRC_DIR)
-            rel_dir = os.path.dirname(rel_path)
-            
-            # Create corresponding output directory
-            out_dir = os.path.join(OUTPUT_DIR, rel_dir) if rel_dir else OUTPUT_DIR
-            ensure_dir(out_dir)
-            
-            # Output .pyc file path
-            pyc_filename = filename[:-3] + '.pyc'  # .py -> .pyc
-            out_path = os.path.join(out_dir, pyc_filename)
-            
-            print("\nCompiling: %s" % rel_path)
-            
+    if tasks:
+        print("\nCompiling %d of %d files (%d jobs)%s" % (
+            len(tasks), len(sources), jobs, ", stripping docstrings" if strip else ""))
+        if jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(tasks)))
             try:
-                py_compile.compile(src_path, cfile=out_path, doraise=True)
-                
-                # Verify
-                if os.path.exists(out_path):
-                    size = os.path.getsize(out_path)
-                    
-                    # Check magic number
-                    with open(out_path, 'rb') as f:
-                        magic = f.read(4)
-                        magic_hex = ''.join(['%02x' % ord(b) for b in magic])
-                    
-                    if magic_hex.startswith('03f3'):
-                        print("  -> %s [%d bytes] [Python 2.7 OK]" % (out_path, size))
-                        compiled_files.append((out_path, rel_dir, pyc_filename))
-                    else:
-                        print("  -> ERROR: Wrong Python version (magic: 0x%s)" % magic_hex)
-                        errors.append(rel_path)
-                else:
-                    print("  -> ERROR: .pyc not created")
-                    errors.append(rel_path)
-                    
-            except Exception as e:
-                print("  -> ERROR: %s" % str(e))
+                results = pool.map(compile_one, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [compile_one(task) for task in tasks]
+
+        for rel_path, error in results:
+            if error:
+                print("  %s -> ERROR: %s" % (rel_path, error))
                 errors.append(rel_path)
-    
+                new_files.pop(rel_path, None)
+            else:
+                print("  %s -> OK" % rel_path)
+    else:
+        print("\nAll %d files are up to date" % len(sources))
+
+    manifest['files'] = new_files
+    save_manifest(manifest_path, manifest)
+
     print("\n" + "=" * 70)
     print("Compilation Summary:")
-    print("  Success: %d files" % len(compiled_files))
-    print("  Errors:  %d files" % len(errors))
+    print("  Compiled:   %d files" % (len(tasks) - len(errors)))
+    print("  Up to date: %d files" % (len(sources) - len(tasks)))
+    print("  Errors:     %d files" % len(errors))
     print("=" * 70)
-    
+
     if errors:
         print("\nFailed files:")
         for err in errors:
             print("  - %s" % err)
-        return False
-    
-    if not compiled_files:
-        print("\nERROR: No .py files found in %s" % SRC_DIR)
-        return False
-    
+        return None
+
     return compiled_files
 
-def build_wotmod(compiled_files):
-    """Create .wotmod from compiled .pyc files"""
-    
+
+def build_wotmod(compiled_files, output_dir):
+    """Create a reproducible .wotmod from compiled .pyc files"""
+
     print("\n" + "=" * 70)
     print("Step 2: Building .wotmod package")
     print("=" * 70)
-    
-    mod_path = os.path.join(OUTPUT_DIR, MOD_NAME)
-    
+
+    mod_path = os.path.join(output_dir, MOD_NAME)
+    tmp_path = mod_path + '.tmp'
+
     print("\nCreating %s..." % mod_path)
     print("Base path in archive: %s\n" % BASE_INTERNAL_PATH)
-    
-    with zipfile.ZipFile(mod_path, 'w', zipfile.ZIP_STORED) as zipf:
-        for out_path, rel_dir, filename in compiled_files:
-            # Build internal path for .wotmod
-            if rel_dir:
-                internal_path = "%s/%s/%s" % (BASE_INTERNAL_PATH, rel_dir.replace('\\', '/'), filename)
-            else:
-                internal_path = "%s/%s" % (BASE_INTERNAL_PATH, filename)
-            
-            zipf.write(out_path, internal_path)
+
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as zipf:
+        for out_path, rel_pyc in sorted(compiled_files, key=lambda item: item[1]):
+            internal_path = "%s/%s" % (BASE_INTERNAL_PATH, rel_pyc)
+            info = zipfile.ZipInfo(internal_path, ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_STORED
+            info.create_system = 0
+            info.external_attr = ZIP_FILE_MODE
+            with open(out_path, 'rb') as f:
+                zipf.writestr(info, f.read())
             print("  Added: %s" % internal_path)
-    
+
+    if os.path.exists(mod_path):
+        os.remove(mod_path)
+    os.rename(tmp_path, mod_path)
     print("\nCreated: %s" % mod_path)
-    
-    # Verification
+
+    return verify_wotmod(mod_path, compiled_files)
+
+
+def verify_wotmod(mod_path, compiled_files):
+    """Check that the archive holds exactly the expected Python 2.7 .pyc files"""
     print("\nVerifying archive structure...")
+    expected = sorted("%s/%s" % (BASE_INTERNAL_PATH, rel_pyc) for _, rel_pyc in compiled_files)
+    ok = True
     with zipfile.ZipFile(mod_path, 'r') as zipf:
         files = zipf.namelist()
         print("  Total files: %d" % len(files))
         for f in files:
             info = zipf.getinfo(f)
-            print("    %s (%d bytes)" % (f, info.file_size))
-    
+            magic = zipf.read(f)[:4]
+            status = "Python 2.7 OK" if magic == PY27_MAGIC else "WRONG MAGIC"
+            if magic != PY27_MAGIC:
+                ok = False
+            print("    %s (%d bytes) [%s]" % (f, info.file_size, status))
+    if sorted(files) != expected:
+        print("  ERROR: archive contents do not match the compiled files")
+        ok = False
+
+    digest = hashlib.sha1()
+    with open(mod_path, 'rb') as f:
+        digest.update(f.read())
+    print("  SHA1: %s" % digest.hexdigest())
+    return ok
+
+
+def install(mod_path, mods_dir, python_log):
+    """Copy the package into the game and remove the old python.log"""
+    if mods_dir:
+        try:
+            dest_path = os.path.join(mods_dir, MOD_NAME)
+            shutil.copy(mod_path, dest_path)
+            print("\nInstalled to: %s" % dest_path)
+        except Exception as e:
+            print("\nWarning: Could not copy to game directory: %s" % str(e))
+
+    if python_log:
+        try:
+            if os.path.exists(python_log):
+                os.remove(python_log)
+                print("Deleted old python.log")
+        except Exception as e:
+            print("Warning: Could not delete python.log: %s" % str(e))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Build %s" % MOD_NAME)
+    parser.add_argument('--src', default=SRC_DIR, help="source directory (default: %(default)s)")
+    parser.add_argument('--output', default=OUTPUT_DIR, help="output directory (default: %(default)s)")
+    parser.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count(),
+                        help="parallel compile processes (default: %(default)s)")
+    parser.add_argument('--clean', action='store_true', help="wipe the output directory and rebuild everything")
+    parser.add_argument('--strip-docstrings', action='store_true', help="drop docstrings from the .pyc files")
+    parser.add_argument('--install-dir', default=os.environ.get('WOT_MODS_DIR', GAME_MODS_DIR),
+                        help="game mods directory to copy the package into")
+    parser.add_argument('--python-log', default=os.environ.get('WOT_PYTHON_LOG', GAME_PYTHON_LOG),
+                        help="game python.log to delete after install")
+    parser.add_argument('--no-install', action='store_true', help="only build, do not touch the game directory")
+    parser.add_argument('--pause', action='store_true', help="wait for Enter before exiting")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    src_dir = os.path.abspath(args.src)
+    output_dir = os.path.abspath(args.output)
+
+    print("WoT Mod Builder")
+    print("Source: %s" % src_dir)
+    print("Output: %s" % output_dir)
+    print("")
+
+    if imp.get_magic() != PY27_MAGIC:
+        print("ERROR: Python 2.7 is required to build the mod (running %s)" % sys.version.split()[0])
+        return 1
+
+    # Step 1: Compile changed .py to .pyc
+    compiled_files = compile_all_py_files(src_dir, output_dir, max(1, args.jobs),
+                                          args.strip_docstrings, args.clean)
+    if not compiled_files:
+        print("\nCompilation failed. Cannot proceed to build .wotmod")
+        return 1
+
+    # Step 2: Build .wotmod
+    if not build_wotmod(compiled_files, output_dir):
+        print("\nERROR: Archive verification failed")
+        return 1
+
     print("\n" + "=" * 70)
     print("MOD READY FOR WOT!")
     print("=" * 70)
-    print("\nFile: %s" % mod_path)
-    print("\nInstallation:")
-    print("  1. Copy to: mods\\<WOT_VERSION>\\")
-    print("  2. Launch WoT")
-    print("  3. Check python.log for errors")
-    print("=" * 70)
-    
-    # Auto-copy to game mods directory
-    try:
-        dest_path = os.path.join(GAME_MODS_DIR, MOD_NAME)
-        shutil.copy(mod_path, dest_path)
-        print("\nAuto-copied to: %s" % dest_path)
-    except Exception as e:
-        print("\nWarning: Could not copy to game directory: %s" % str(e))
-    
-    # Delete old python.log
-    try:
-        log_path = "e:\\Wargaming.net\\WorldOfTanks\\python.log"
-        if os.path.exists(log_path):
-            os.remove(log_path)
-            print("Deleted old python.log")
-    except Exception as e:
-        print("Warning: Could not delete python.log: %s" % str(e))
-    
-    return True
+
+    if not args.no_install:
+        install(os.path.join(output_dir, MOD_NAME), args.install_dir, args.python_log)
+    return 0
+
 
 if __name__ == "__main__":
+    args_pause = '--pause' in sys.argv[1:]
     try:
-        print("WoT Mod Builder")
-        print("Source: %s" % os.path.abspath(SRC_DIR))
-        print("Output: %s" % os.path.abspath(OUTPUT_DIR))
-        print("")
-        
-        # Step 1: Compile all .py to .pyc
-        compiled_files = compile_all_py_files()
-        
-        if compiled_files:
-            # Step 2: Build .wotmod
-            build_wotmod(compiled_files)
-        else:
-            print("\nCompilation failed. Cannot proceed to build .wotmod")
-            
+        code = main()
     except Exception as e:
         print("\nERROR: %s" % str(e))
         import traceback
         traceback.print_exc()
-    
-    raw_input("\nPress Enter to exit...")
+        code = 1
+
+    if args_pause:
+        raw_input("\nPress Enter to exit...")
+    sys.exit(code)
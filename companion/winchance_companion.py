@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Companion process for the Win Chance mod.
+
+A plain Python process (2.7 or 3.x) started next to the game client.
+The mod connects to it over a local TCP socket and hands over work that
+should not run inside the game process. The protocol (length-prefixed
+JSON frames) lives in src/winchance/ipc.py and is shared with the mod.
+
+Operations:
+  ping            {"version": 1}                     -> {"version": 1, "pid": ..., "budget": ...}
+  battles.create  {"api_url", "token", "data"}       -> {"status": 201}
+  battles.update  {"api_url", "token", "arena_id", "data"} -> {"status": 200}
+  stats.summary   {}                                 -> prediction quality from battle_results.csv
+
+Uploads are retried with exponential backoff; the mod falls back to
+sending on its own if the companion goes away before answering. The
+ping answer reports the worst-case time of one upload ("budget",
+seconds) so the mod waits at least that long before falling back.
+
+Usage:
+  python winchance_companion.py [--port 5015] [--logs <game>/mods/configs/mod_winchance/logs]
+
+then set in mods/configs/mod_winchance_api.json:
+  "companion": {"enabled": true, "port": 5015}
+"""
+import argparse
+import csv
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+    import SocketServer as socketserver
+    from urllib2 import HTTPError, Request, urlopen
+except ImportError:
+    import socketserver
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from winchance.ipc import PROTOCOL_VERSION, FrameDecoder, ProtocolError, encode_frame  # noqa: E402
+
+
+class Companion(object):
+    """Operation handlers and counters shared by all connections"""
+
+    def __init__(self, logs_dir=None, retries=3, backoff=1.0, http_timeout=10):
+        self.logs_dir = logs_dir
+        self.retries = retries
+        self.backoff = backoff
+        self.http_timeout = http_timeout
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.handlers = {
+            'ping': self.op_ping,
+            'battles.create': self.op_battles_create,
+            'battles.update': self.op_battles_update,
+            'stats.summary': self.op_stats_summary,
+        }
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def handle(self, message):
+        """Run one request and build its response"""
+        request_id = message.get('id')
+        handler = self.handlers.get(message.get('op'))
+        if handler is None:
+            return {'id': request_id, 'ok': False, 'error': 'unknown op: {}'.format(message.get('op'))}
+        try:
+            result = handler(message.get('args') or {})
+            self.count('{}.ok'.format(message['op']))
+            return {'id': request_id, 'ok': True, 'result': result}
+        except Exception as e:
+            self.count('{}.failed'.format(message['op']))
+            return {'id': request_id, 'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+    def op_ping(self, args):
+        if args.get('version') != PROTOCOL_VERSION:
+            raise ValueError('protocol version {} is not supported'.format(args.get('version')))
+        return {'version': PROTOCOL_VERSION, 'pid': os.getpid(), 'budget': self.retry_budget()}
+
+    def retry_budget(self):
+        """Worst-case seconds of http_json: every attempt times out, plus all backoff delays"""
+        return (self.retries + 1) * self.http_timeout + self.backoff * (2 ** self.retries - 1)
+
+    def op_battles_create(self, args):
+        url = '{}/api/battles'.format(args['api_url'])
+        return {'status': self.http_json('POST', url, args.get('token'), args['data'])}
+
+    def op_battles_update(self, args):
+        url = '{}/api/battles/{}'.format(args['api_url'], args['arena_id'])
+        return {'status': self.http_json('PUT', url, args.get('token'), args['data'])}
+
+    def http_json(self, method, url, token, payload):
+        """Send JSON with retries; 4xx answers are final, other errors are retried"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            request = Request(url, body)
+            request.get_method = lambda: method
+            request.add_header('Content-Type', 'application/json; charset=utf-8')
+            if token:
+                request.add_header('Authorization', 'Bearer {}'.format(token))
+            try:
+                response = urlopen(request, timeout=self.http_timeout)
+                response.read()
+                return response.getcode()
+            except HTTPError as e:
+                if 400 <= e.code < 500:
+                    raise RuntimeError('HTTP {}: {}'.format(e.code, e.read()[:200]))
+                error = e
+            except (IOError, socket.error) as e:
+                error = e
+            if attempt < self.retries:
+                self.count('http.retries')
+                time.sleep(delay)
+                delay *= 2
+        raise RuntimeError('{} {} failed after {} attempts: {}'.format(method, url, self.retries + 1, error))
+
+    def op_stats_summary(self, args):
+        """Prediction quality over battle_results.csv written by the mod"""
+        summary = {'counters': dict(self.counters), 'battles': 0}
+        path = os.path.join(self.logs_dir or '', 'battle_results.csv')
+        if not self.logs_dir or not os.path.exists(path):
+            return summary
+
+        battles = wins = correct = 0
+        brier = error = 0.0
+        with open(path, 'r') as f:
+            for row in csv.DictReader(f):
+                try:
+                    chance = float(row['Win_Chance']) / 100.0
+                    prediction_error = float(row['Prediction_Error'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                won = row.get('Victory') == 'Win'
+                battles += 1
+                wins += won
+                correct += row.get('Prediction_Correct') == 'Yes'
+                brier += (chance - (1.0 if won else 0.0)) ** 2
+                error += prediction_error
+
+        summary['battles'] = battles
+        if battles:
+            summary.update({
+                'win_rate': wins * 100.0 / battles,
+                'accuracy': correct * 100.0 / battles,
+                'brier': brier / battles,
+                'mean_error': error / battles,
+            })
+        return summary
+
+
+class ConnectionHandler(socketserver.BaseRequestHandler):
+    """Reads frames from one mod connection; each request runs in its own thread"""
+
+    def handle(self):
+        companion = self.server.companion
+        decoder = FrameDecoder()
+        send_lock = threading.Lock()
+
+        def run(message):
+            response = companion.handle(message)
+            with send_lock:
+                try:
+                    self.request.sendall(encode_frame(response))
+                except socket.error:
+                    pass
+
+        while True:
+            try:
+                data = self.request.recv(65536)
+            except socket.error:
+                return
+            if not data:
+                return
+            try:
+                messages = decoder.feed(data)
+            except (ProtocolError, ValueError) as e:
+                sys.stderr.write('dropping connection: {}\n'.format(e))
+                return
+            for message in messages:
+                worker = threading.Thread(target=run, args=(message,))
+                worker.daemon = True
+                worker.start()
+
+
+class CompanionServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Win Chance companion process')
+    parser.add_argument('--host', default='127.0.0.1', help='interface to listen on (keep it local)')
+    parser.add_argument('--port', type=int, default=5015)
+    parser.add_argument('--logs', help='mod logs directory for stats.summary')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--backoff', type=float, default=1.0, help='first retry delay, seconds')
+    parser.add_argument('--http-timeout', type=float, default=10, help='timeout of one HTTP attempt, seconds')
+    args = parser.parse_args(argv)
+
+    server = CompanionServer((args.host, args.port), ConnectionHandler)
+    server.companion = Companion(args.logs, args.retries, args.backoff, args.http_timeout)
+    print('Win Chance companion listening on {}:{}'.format(*server.server_address))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Пакет мода Win Chance
+
+Точка входа - gui/mods/mod_winchance.py. Модули пакета:
+  core       - логирование, метрики, watchdog, фоновые потоки, конфиги
+  calculator - ростер боя и расчет шанса на победу
+  model      - коэффициенты модели шанса из внешнего файла
+  priors     - априорные шансы по карте, режиму и стороне спавна
+  stats      - источники статистики игроков (XVM, кеши)
+  remote     - сервис рейтингов (импортируется, только если включен)
+  ratingdb   - офлайн-дамп рейтингов (импортируется, только если файл есть)
+  tankstats  - накопительная статистика игрока по танкам
+  collector  - статистика боя игрока для API
+  storage    - логи предсказаний и результатов
+  api        - REST API (импортируется при первом сетевом запросе)
+  encounters - история встреч с игроками (индекс в mmap)
+  companion  - связь с процессом-компаньоном (импортируется, только если включен)
+  ipc        - протокол обмена с компаньоном (общий с companion/)
+  ui         - окно с шансом на победу
+  display    - связка всего перечисленного на время боя
+"""
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Клиент REST API Win Chance (регистрация, проверка, отправка боев)
+
+Импортируется при первом сетевом запросе, чтобы urllib2 и socket не
+загружались при старте клиента.
+
+Эндпоинты: POST /api/auth/register, GET /health, POST /api/battles и
+необязательный PUT /api/battles/{ArenaUniqueId} - обновление уже
+отправленного боя полями личного результата из ангара. Если сервер
+отвечает на PUT 404/405, обновления до конца сессии не отправляются:
+результат из ангара остается только в локальных логах.
+"""
+
+import BigWorld
+import json
+import socket
+import urllib2
+
+from .core import (API_CONFIG, LazyJson, _logger, _metrics, _tasks, _watchdog, err, log,
+                   perf_clock, save_api_config, timed)
+
+def get_player_info():
+    """Получает информацию об игроке"""
+    try:
+        player = BigWorld.player()
+        if player and hasattr(player, 'databaseID'):
+            account_id = player.databaseID
+            nickname = getattr(player, 'name', 'Unknown')
+            
+            # Определяем регион по серверу
+            from constants import AUTH_REALM
+            region_map = {
+                'RU': 'RU',
+                'EU': 'EU',
+                'NA': 'NA',
+                'ASIA': 'ASIA'
+            }
+            region = region_map.get(AUTH_REALM, 'RU')
+            
+            return {
+                'account_id': account_id,
+                'nickname': nickname,
+                'region': region
+            }
+    except Exception as e:
+        _logger.debug("[WinChance] Error getting player info: {}", e)
+    
+    return None
+
+def _urlopen_measured(endpoint, request, data=None, timeout=5):
+    """
+    Выполняет urllib2.urlopen и учитывает задержку и ошибки в метриках
+    
+    Args:
+        endpoint: Короткое имя endpoint для метрик (battles, register, health)
+        request: URL или urllib2.Request
+        data: Тело запроса
+        timeout: Таймаут (сек)
+    """
+    _metrics.incr('api.requests.' + endpoint)
+    start = perf_clock()
+    try:
+        return urllib2.urlopen(request, data, timeout=timeout)
+    except Exception:
+        _metrics.incr('api.failures.' + endpoint)
+        raise
+    finally:
+        _metrics.observe('api.latency.' + endpoint, (perf_clock() - start) * 1000.0)
+
+# Регистрация выполняется в фоновом потоке (не больше одной одновременно)
+_registering = False
+
+
+# Без функции watchdog: запрос идет в фоновом потоке и в бюджет игрового не входит
+@timed('api.register')
+def _request_token(player_info):
+    """
+    HTTP-запрос регистрации мода в API (в фоновом потоке, состояние мода не меняет)
+    
+    Args:
+        player_info: Данные игрока (get_player_info)
+        
+    Returns:
+        str: Токен или None при ошибке
+    """
+    try:
+        url = "{}/api/auth/register".format(API_CONFIG['api_url'])
+        
+        # Данные для регистрации
+        register_data = {
+            'accountId': player_info['account_id'],
+            'nickname': player_info['nickname'],
+            'region': player_info['region']
+        }
+        
+        log("[WinChance] Registering in API: {}@{}".format(
+            player_info['nickname'], player_info['region']))
+        
+        # Отправляем запрос
+        request = urllib2.Request(url)
+        request.add_header('Content-Type', 'application/json; charset=utf-8')
+        data = json.dumps(register_data, ensure_ascii=False).encode('utf-8')
+        
+        response = _urlopen_measured('register', request, data, timeout=10)
+        response_data = json.loads(response.read())
+        
+        token = response_data.get('token')
+        if not token:
+            err("[WinChance] Registration failed: no token in response")
+        return token
+            
+    except urllib2.HTTPError as e:
+        err("[WinChance] HTTP Error during registration: {} - {}".format(e.code, e.read()))
+        return None
+    except urllib2.URLError as e:
+        err("[WinChance] URL Error during registration: {}".format(e.reason))
+        return None
+    except Exception as e:
+        err("[WinChance] Error during registration: {}".format(e))
+        import traceback
+        err(traceback.format_exc())
+        return None
+
+def _registration_player_info():
+    """
+    Данные игрока для регистрации, если она нужна и еще не идет (в основном потоке)
+    
+    Returns:
+        dict: get_player_info() или None
+    """
+    global _registering
+    
+    if not API_CONFIG['enabled'] or API_CONFIG.get('token') or _registering:
+        return None
+    player_info = get_player_info()
+    if not player_info:
+        log("[WinChance] Player info not yet available (normal in hangar)")
+        return None
+    _registering = True
+    return player_info
+
+def _register_task(player_info):
+    """Регистрация в фоновом потоке; токен применяется в основном"""
+    _tasks.call_in_main(_finish_registration, player_info, _request_token(player_info))
+
+def _finish_registration(player_info, token):
+    """Сохраняет полученный токен в конфиг (в основном потоке)"""
+    global _registering
+    
+    _registering = False
+    if not token:
+        log("[WinChance] Registration postponed (will retry when entering battle)")
+        return
+    
+    log("[WinChance] Registration successful! Token received.")
+    API_CONFIG['token'] = token
+    API_CONFIG['account_id'] = player_info['account_id']
+    API_CONFIG['nickname'] = player_info['nickname']
+    API_CONFIG['region'] = player_info['region']
+    save_api_config()
+
+def check_and_register_if_needed():
+    """
+    Проверяет наличие токена и при необходимости запускает регистрацию в фоне
+    
+    Returns:
+        bool: True если токен уже есть (иначе результат регистрации
+              применится позже, в основном потоке)
+    """
+    try:
+        # Если интеграция отключена - не регистрируемся
+        if not API_CONFIG['enabled']:
+            log("[WinChance] API integration is disabled in config")
+            return False
+        
+        # Проверяем наличие токена
+        if API_CONFIG.get('token'):
+            log("[WinChance] Token found in config")
+            return True
+        
+        player_info = _registration_player_info()
+        if player_info is not None:
+            log("[WinChance] No token found, starting automatic registration...")
+            _tasks.submit(_register_task, player_info)
+        return False
+            
+    except Exception as e:
+        err("[WinChance] Error in check_and_register_if_needed: {}".format(e))
+        return False
+
+def check_api_on_start():
+    """
+    Проверяет подключение к API и регистрацию, не блокируя игровой поток
+    
+    Запросы идут в фоновом потоке, токен применяется в основном.
+    """
+    _tasks.submit(_check_api_task, _registration_player_info())
+
+def _check_api_task(player_info):
+    """Проверка подключения и регистрация (в фоновом потоке)"""
+    if not test_api_connection():
+        log("[WinChance] API is not available, will try later")
+        if player_info is not None:
+            _tasks.call_in_main(_finish_registration, player_info, None)
+        return
+    if player_info is not None:
+        _register_task(player_info)
+
+@timed('api.health')
+def test_api_connection():
+    """Тестирует подключение к API (блокирующий запрос - только в фоновом потоке)"""
+    try:
+        url = "{}/health".format(API_CONFIG['api_url'])
+        response = _urlopen_measured('health', url, timeout=5)
+        
+        if response.code == 200:
+            log("[WinChance] API connection test successful")
+            return True
+        else:
+            err("[WinChance] API returned status: {}".format(response.code))
+            return False
+            
+    except Exception as e:
+        err("[WinChance] API connection test failed: {}".format(e))
+        return False
+
+def send_battle_to_api(battle_data):
+    """
+    Отправляет результат боя в API
+    
+    Args:
+        battle_data: Словарь с данными боя
+    """
+    if not API_CONFIG['enabled']:
+        log("[WinChance] API integration disabled")
+        return False
+    
+    if not API_CONFIG['token']:
+        log("[WinChance] API token not configured")
+        return False
+    
+    dispatch_request('send_battle', _send_battle_request, battle_data)
+    return True
+
+@timed('api.dispatch', 'api')
+def dispatch_request(offload, request_func, *args):
+    """
+    Передает HTTP-запрос компаньону или фоновому потоку (игровой поток сети не ждет)
+    
+    В экономном режиме компаньон пропускается: кадр для него кодируется в
+    игровом потоке, а запрос сразу уходит в фоновый поток.
+    
+    Args:
+        offload: Имя функции модуля companion для передачи запроса компаньону
+        request_func: HTTP-запрос для фонового потока
+    """
+    if (API_CONFIG.get('companion') or {}).get('enabled') and not _watchdog.is_degraded('api'):
+        from . import companion
+        fallback = lambda: _tasks.submit(request_func, *args)
+        if getattr(companion, offload)(*args, fallback=fallback):
+            return
+    _tasks.submit(request_func, *args)
+
+def _send_battle_request(battle_data):
+    """
+    HTTP-запрос отправки боя в API (можно вызывать из фонового потока)
+    
+    Args:
+        battle_data: Словарь с данными боя
+    """
+    try:
+        url = "{}/api/battles".format(API_CONFIG['api_url'])
+        
+        # Формируем данные для API (без обертки, контроллер ожидает прямой объект)
+        api_data = json.dumps(battle_data, ensure_ascii=False).encode('utf-8')
+        
+        # Полный JSON выводится только на уровне debug (сериализуется лениво)
+        _logger.debug("[WinChance] Sending JSON to API: {}", LazyJson(battle_data))
+        
+        # Создаем request
+        request = urllib2.Request(url)
+        request.add_header('Content-Type', 'application/json; charset=utf-8')
+        request.add_header('Authorization', 'Bearer {}'.format(API_CONFIG['token']))
+        
+        # Отправляем с таймаутом
+        response = _urlopen_measured('battles', request, api_data, timeout=5)
+        response_data = response.read()
+        
+        _logger.info("[WinChance] Battle sent to API successfully: {}", response_data)
+        return True
+        
+    except urllib2.HTTPError as e:
+        error_body = e.read()
+        _logger.error("[WinChance] HTTP Error sending to API: {} - {}", e.code, error_body)
+        # Логируем детали для диагностики
+        if e.code == 409:
+            _logger.error("[WinChance] Conflict: ArenaUniqueId already exists. This battle was already recorded.")
+        return False
+    except urllib2.URLError as e:
+        _logger.error("[WinChance] URL Error sending to API: {}", e.reason)
+        return False
+    except socket.timeout:
+        _logger.error("[WinChance] Timeout sending to API")
+        return False
+    except Exception as e:
+        _logger.error("[WinChance] Error sending to API: {}", e)
+        import traceback
+        _logger.error("{}", traceback.format_exc())
+        return False
+
+# HTTP-коды, которыми сервер без PUT /api/battles/{id} отвечает на обновление
+UPDATE_UNSUPPORTED_CODES = (404, 405)
+
+# False после ответа 404/405 на обновление (меняется в основном потоке)
+_updates_supported = True
+
+
+def battle_updates_supported():
+    """Принимает ли сервер обновления боев (PUT /api/battles/{id})"""
+    return _updates_supported
+
+def disable_battle_updates(code):
+    """Отключает отправку обновлений боев до конца сессии (в основном потоке)"""
+    global _updates_supported
+    if _updates_supported:
+        _updates_supported = False
+        log("[WinChance] API does not support battle updates (HTTP {}), hangar results stay local".format(code))
+
+def _send_battle_update_request(arena_id, changes):
+    """
+    HTTP-запрос обновления уже отправленного боя (PUT /api/battles/{id})
+    
+    Args:
+        arena_id: ID боя
+        changes: Измененные поля боя
+    """
+    try:
+        url = "{}/api/battles/{}".format(API_CONFIG['api_url'], arena_id)
+        
+        request = urllib2.Request(url)
+        request.get_method = lambda: 'PUT'
+        request.add_header('Content-Type', 'application/json; charset=utf-8')
+        request.add_header('Authorization', 'Bearer {}'.format(API_CONFIG['token']))
+        
+        data = json.dumps(changes, ensure_ascii=False).encode('utf-8')
+        response = _urlopen_measured('battles.update', request, data, timeout=5)
+        response.read()
+        
+        _logger.info("[WinChance] Battle {} updated in API ({} fields)", arena_id, len(changes))
+        return True
+        
+    except urllib2.HTTPError as e:
+        if e.code in UPDATE_UNSUPPORTED_CODES:
+            _tasks.call_in_main(disable_battle_updates, e.code)
+            return False
+        _logger.error("[WinChance] HTTP Error updating battle {}: {} - {}", arena_id, e.code, e.read())
+        return False
+    except Exception as e:
+        _logger.error("[WinChance] Error updating battle {} in API: {}", arena_id, e)
+        return False
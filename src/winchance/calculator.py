@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""
+Ростер игроков боя и калькулятор шанса на победу
+"""
+
+import math
+
+from .core import _logger
+from .model import WinChanceModel
+
+def _vehicle_field(vehicle_info, key, default):
+    """Поле записи arena.vehicles (dict или объект)"""
+    if isinstance(vehicle_info, dict):
+        return vehicle_info.get(key, default)
+    return getattr(vehicle_info, key, default)
+
+
+class PlayerRecord(object):
+    """Запись игрока текущего боя"""
+    
+    __slots__ = ('team', 'name', 'account_id', 'vehicle_cd', 'wgr', 'wins', 'battles',
+                 'vehicle_wins', 'vehicle_battles', 'source')
+    
+    def __init__(self, team, name, account_id, vehicle_cd):
+        self.team = team
+        self.name = name
+        self.account_id = account_id
+        self.vehicle_cd = vehicle_cd
+        # Без статистики (source=None) в расчет идет default_wgr модели,
+        # WGR 0 при известных боях оценивается по винрейту
+        self.wgr = 0
+        self.wins = 0
+        self.battles = 0
+        # Статистика на текущей технике (если источник ее знает)
+        self.vehicle_wins = 0
+        self.vehicle_battles = 0
+        # Имя источника статистики (StatsProvider.name), None - дефолтные значения
+        self.source = None
+    
+    def set_stats(self, stats, source):
+        """
+        Обновляет статистику из ответа источника
+        
+        Args:
+            stats: dict {'wgr', 'wins', 'battles', ['vehicle_wins', 'vehicle_battles'], ...}
+            source: Имя источника
+        """
+        self.wgr = stats.get('wgr') or 0
+        self.wins = stats.get('wins') or 0
+        self.battles = stats.get('battles') or 0
+        self.vehicle_wins = stats.get('vehicle_wins') or 0
+        self.vehicle_battles = stats.get('vehicle_battles') or 0
+        self.source = source
+    
+    def has_real_data(self):
+        """True если статистика не дефолтная"""
+        return self.source is not None and (self.wgr > 0 or self.battles > 0)
+
+
+class BattleRoster(object):
+    """
+    Игроки текущего боя (vehicle_id -> PlayerRecord)
+    
+    Состав строится один раз при подключении к арене, дальше патчится по
+    событиям onVehicleAdded/onVehicleUpdated. Каждое изменение записи
+    передается в агрегаты команд калькулятора как дельта.
+    """
+    
+    def __init__(self, aggregates, vehicle_info):
+        # Получатель дельт (WinChanceCalculator: add_record/remove_record/reset_aggregates)
+        self.aggregates = aggregates
+        # Кеш метаданных техники (VehicleInfoCache) - прогревается техникой арены
+        self.vehicle_info = vehicle_info
+        self.arena = None
+        self.arena_id = None
+        self.records = {}
+        # Игроки без статистики из живого источника (XVM/сервис)
+        self.unresolved = set()
+    
+    def attach(self, arena):
+        """
+        Строит состав по arena.vehicles и подписывается на события арены
+        
+        Args:
+            arena: Текущая арена
+        """
+        self.detach()
+        self.arena = arena
+        self.arena_id = getattr(arena, 'arenaUniqueID', None)
+        self.records = {}
+        self.unresolved = set()
+        self.aggregates.reset_aggregates()
+        
+        for vehicle_id, vehicle_info in arena.vehicles.items():
+            self.patch(vehicle_id, vehicle_info)
+        
+        try:
+            arena.onVehicleAdded += self._on_vehicle_changed
+            arena.onVehicleUpdated += self._on_vehicle_changed
+        except AttributeError:
+            # Нет событий - состав догоняется в sync()
+            pass
+    
+    def detach(self):
+        """Отписывается от событий арены"""
+        arena = self.arena
+        self.arena = None
+        if arena is None:
+            return
+        try:
+            arena.onVehicleAdded -= self._on_vehicle_changed
+            arena.onVehicleUpdated -= self._on_vehicle_changed
+        except Exception:
+            pass
+    
+    def sync(self, arena):
+        """
+        Подключается к новой арене; без событий арены догоняет состав
+        
+        Args:
+            arena: Текущая арена
+        """
+        if arena is not self.arena or getattr(arena, 'arenaUniqueID', None) != self.arena_id:
+            self.attach(arena)
+        elif len(arena.vehicles) != len(self.records):
+            for vehicle_id, vehicle_info in arena.vehicles.items():
+                if vehicle_id not in self.records:
+                    self.patch(vehicle_id, vehicle_info)
+    
+    def _on_vehicle_changed(self, vehicle_id, *args):
+        """Обработчик onVehicleAdded/onVehicleUpdated"""
+        arena = self.arena
+        if arena is None:
+            return
+        vehicle_info = arena.vehicles.get(vehicle_id)
+        if vehicle_info is not None:
+            self.patch(vehicle_id, vehicle_info)
+    
+    def patch(self, vehicle_id, vehicle_info):
+        """
+        Создает или обновляет запись игрока
+        
+        Args:
+            vehicle_id: ID техники
+            vehicle_info: Запись arena.vehicles
+        """
+        try:
+            vehicle_type = _vehicle_field(vehicle_info, 'vehicleType', None)
+            vehicle_cd = getattr(getattr(vehicle_type, 'type', None), 'compactDescr', 0)
+            if vehicle_cd and self.vehicle_info.get(vehicle_cd) is None:
+                self.vehicle_info.describe(vehicle_type)
+            team = _vehicle_field(vehicle_info, 'team', 0)
+            name = _vehicle_field(vehicle_info, 'name', '')
+            account_id = _vehicle_field(vehicle_info, 'accountDBID', 0)
+        except Exception as e:
+            _logger.debug("[WinChance] Error processing vehicle {}: {}", vehicle_id, e)
+            return
+        
+        record = self.records.get(vehicle_id)
+        if record is None:
+            record = self.records[vehicle_id] = PlayerRecord(team, name, account_id, vehicle_cd)
+            self.unresolved.add(vehicle_id)
+            self.aggregates.add_record(record)
+            return
+        
+        if (record.team, record.account_id, record.vehicle_cd) == (team, account_id, vehicle_cd):
+            record.name = name
+            return
+        
+        self.aggregates.remove_record(record)
+        if record.account_id != account_id or record.vehicle_cd != vehicle_cd:
+            # Другой игрок/танк - статистику нужно получить заново
+            record.wgr, record.wins, record.battles, record.source = 0, 0, 0, None
+            record.vehicle_wins = record.vehicle_battles = 0
+            self.unresolved.add(vehicle_id)
+        record.team = team
+        record.name = name
+        record.account_id = account_id
+        record.vehicle_cd = vehicle_cd
+        self.aggregates.add_record(record)
+    
+    def set_stats(self, vehicle_id, stats, source, live):
+        """
+        Обновляет статистику игрока
+        
+        Args:
+            vehicle_id: ID техники
+            stats: dict {'wgr', 'wins', 'battles', ...}
+            source: Имя источника
+            live: True для живого источника - игрок больше не опрашивается
+        """
+        record = self.records[vehicle_id]
+        self.aggregates.remove_record(record)
+        record.set_stats(stats, source)
+        self.aggregates.add_record(record)
+        if live:
+            self.unresolved.discard(vehicle_id)
+    
+    def real_data_count(self):
+        """Количество игроков с не дефолтной статистикой"""
+        count = 0
+        for record in self.records.values():
+            if record.has_real_data():
+                count += 1
+        return count
+
+
+class WinChanceCalculator(object):
+    """
+    Калькулятор шанса на победу
+    
+    Коэффициенты берутся из модели (WinChanceModel). Модель заменяется
+    только между боями: агрегаты команд собраны с ее весами.
+    """
+    
+    def __init__(self, vehicle_info=None, model=None):
+        # Кеш метаданных техники - нужен для весов уровня и класса
+        self.vehicle_info = vehicle_info
+        self.model = model or WinChanceModel()
+        self.ally_wgr = 0
+        self.enemy_wgr = 0
+        self.win_chance = 50.0
+        self.player_team = 1
+        # Поправка свободного члена по карте, режиму и стороне (PriorTable)
+        self.intercept = 0.0
+        # Агрегаты команд: team -> [сумма WGR * вес, сумма весов игроков с WGR]
+        self.team_totals = {}
+    
+    def reset_aggregates(self):
+        """Очищает агрегаты команд (новый бой)"""
+        self.team_totals = {}
+    
+    def _record_wgr(self, record):
+        """
+        Вклад игрока в средний WGR команды
+        
+        Returns:
+            float: WGR игрока или None если оценить нельзя
+        """
+        if record.source is None:
+            return self.model.default_wgr
+        
+        # WGR (Wargaming Rating) - комплексный рейтинг
+        wgr = record.wgr
+        if wgr <= 0:
+            # Если WGR недоступен, используем альтернативный расчет
+            # на основе винрейта и количества боев
+            battles = record.battles
+            if battles <= 0:
+                return None
+            winrate = (record.wins / float(battles)) * 100
+            # Простая оценка WGR на основе винрейта
+            wgr = self._estimate_wgr_from_winrate(winrate, battles)
+        
+        if record.vehicle_battles > 0 and record.battles > 0:
+            wgr = self._adjust_wgr_for_vehicle(wgr, record)
+        return wgr
+    
+    def _adjust_wgr_for_vehicle(self, wgr, record):
+        """
+        Сдвигает WGR игрока на разницу винрейта на текущей технике и общего
+        
+        Шкала та же, что у оценки WGR по винрейту (wgr_per_winrate за 1%),
+        при малом числе боев на танке сдвиг уменьшается (confidence_battles).
+        """
+        model = self.model
+        vehicle_battles = record.vehicle_battles
+        wr_delta = (record.vehicle_wins / float(vehicle_battles) -
+                    record.wins / float(record.battles)) * 100
+        if vehicle_battles < model.confidence_battles:
+            wr_delta *= vehicle_battles / model.confidence_battles
+        return max(model.wgr_min, min(model.wgr_max, wgr + wr_delta * model.wgr_per_winrate))
+    
+    def _record_weight(self, record):
+        """Вес игрока в среднем WGR команды по уровню и классу его техники"""
+        model = self.model
+        if not model.weighted or self.vehicle_info is None:
+            return 1.0
+        return model.vehicle_weight(self.vehicle_info.get(record.vehicle_cd))
+    
+    def add_record(self, record):
+        """Добавляет вклад игрока в агрегаты его команды"""
+        wgr = self._record_wgr(record)
+        if wgr is None:
+            return
+        weight = self._record_weight(record)
+        totals = self.team_totals.get(record.team)
+        if totals is None:
+            totals = self.team_totals[record.team] = [0.0, 0.0]
+        totals[0] += wgr * weight
+        totals[1] += weight
+    
+    def remove_record(self, record):
+        """Убирает вклад игрока из агрегатов его команды"""
+        wgr = self._record_wgr(record)
+        totals = self.team_totals.get(record.team)
+        if wgr is None or totals is None:
+            return
+        weight = self._record_weight(record)
+        totals[0] -= wgr * weight
+        totals[1] -= weight
+    
+    def calculate_team_wgr(self, team):
+        """
+        Рассчитывает средний WGR команды по агрегатам
+        
+        Args:
+            team: Номер команды (1 или 2)
+            
+        Returns:
+            float: Средний WGR команды
+        """
+        totals = self.team_totals.get(team)
+        # Сумма весов после вычитаний может остаться с погрешностью около нуля
+        if totals and totals[1] > 1e-6:
+            return totals[0] / totals[1]
+        return self.model.default_wgr  # Дефолтное значение (средний игрок)
+    
+    def _estimate_wgr_from_winrate(self, winrate, battles):
+        """
+        Оценивает WGR на основе винрейта
+        
+        Args:
+            winrate: Процент побед
+            battles: Количество боев
+            
+        Returns:
+            float: Оценочный WGR
+        """
+        # Базовый расчет: WGR примерно коррелирует с винрейтом
+        # WGR 5000 = ~50% WR, каждый 1% WR ≈ 150-200 WGR (по умолчанию 175)
+        model = self.model
+        base_wgr = model.base_wgr
+        wr_delta = winrate - 50.0
+        wgr = base_wgr + (wr_delta * model.wgr_per_winrate)
+        
+        # Корректировка на основе количества боев
+        # Игроки с малым количеством боев менее надежны
+        if battles < model.confidence_battles:
+            # Регрессия к среднему
+            confidence = battles / model.confidence_battles
+            wgr = base_wgr + (wgr - base_wgr) * confidence
+        
+        # Ограничиваем диапазон
+        wgr = max(model.wgr_min, min(model.wgr_max, wgr))
+        
+        return wgr
+    
+    def calculate_win_chance(self, ally_wgr, enemy_wgr, intercept=0.0):
+        """
+        Рассчитывает шанс на победу на основе разницы WGR
+        
+        Args:
+            ally_wgr: Средний WGR союзной команды
+            enemy_wgr: Средний WGR вражеской команды
+            intercept: Априорная поправка (log-odds) для карты и стороны
+            
+        Returns:
+            float: Шанс на победу (0-100%)
+        """
+        # Разница в рейтингах
+        wgr_diff = ally_wgr - enemy_wgr
+        
+        # Используем логистическую функцию для расчета вероятности
+        # Это дает плавную S-образную кривую
+        # Коэффициент k (по умолчанию 0.0005) подобран эмпирически
+        # При разнице в 1000 WGR даст примерно 62% шанса
+        model = self.model
+        win_probability = 1.0 / (1.0 + math.exp(-(model.k * wgr_diff + intercept)))
+        
+        # Конвертируем в проценты
+        win_chance = win_probability * 100.0
+        
+        # Ограничиваем диапазон (по умолчанию 5-95%, никогда не бывает 100% уверенности)
+        win_chance = max(model.min_chance, min(model.max_chance, win_chance))
+        
+        return win_chance
+    
+    def update(self, player_team):
+        """
+        Обновляет расчет шанса на победу по агрегатам команд
+        
+        Args:
+            player_team: Команда игрока (1 или 2)
+        """
+        self.player_team = player_team
+        
+        # Рассчитываем WGR для обеих команд
+        self.ally_wgr = self.calculate_team_wgr(player_team)
+        enemy_team = 2 if player_team == 1 else 1
+        self.enemy_wgr = self.calculate_team_wgr(enemy_team)
+        
+        # Рассчитываем шанс на победу
+        self.win_chance = self.calculate_win_chance(self.ally_wgr, self.enemy_wgr, self.intercept)
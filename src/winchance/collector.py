@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Сбор статистики боя игрока для отправки в API
+"""
+
+import BigWorld
+from gui.battle_control import avatar_getter
+
+from .core import err, get_current_time, log
+
+class BattleStatsCollector(object):
+    """Собирает детальную статистику боя"""
+    
+    def __init__(self, vehicle_info):
+        # Кеш метаданных техники (VehicleInfoCache)
+        self.vehicle_info = vehicle_info
+        self.arena_id = None
+        self.battle_start_time = None
+        self.player_vehicle = None
+        self.map_name = None
+        self.battle_type = None
+        self.player_team = None
+        
+        # Статистика
+        self.damage_dealt = 0
+        self.damage_assisted = 0
+        self.damage_blocked = 0
+        self.kills = 0
+        self.spotted = 0
+        self.shots = 0
+        self.hits = 0
+        self.penetrations = 0
+        
+    def on_battle_start(self):
+        """Инициализация при старте боя"""
+        try:
+            player = BigWorld.player()
+            arena = avatar_getter.getArena()
+            
+            if arena:
+                self.arena_id = getattr(arena, 'arenaUniqueID', 0)
+                self.battle_start_time = get_current_time()
+                
+                # Получаем информацию об арене
+                arena_type = getattr(arena, 'arenaType', None)
+                if arena_type:
+                    self.map_name = getattr(arena_type, 'name', 'Unknown')
+                    self.battle_type = getattr(arena_type, 'gameplayName', 'random')
+                
+                # Информация об игроке
+                if hasattr(player, 'team'):
+                    self.player_team = player.team
+                
+                # Информация о технике (из кеша метаданных по compactDescr)
+                if hasattr(player, 'vehicleTypeDescriptor'):
+                    vehicle_desc = player.vehicleTypeDescriptor
+                    vehicle_type = getattr(vehicle_desc, 'type', None)
+                    info = self.vehicle_info.describe(vehicle_desc) or {}
+                    
+                    self.player_vehicle = {
+                        'id': getattr(vehicle_type, 'compactDescr', 0) if vehicle_type else 0,
+                        'name': info.get('user_name', 'Unknown'),
+                        'tier': info.get('tier', 0),
+                        'type': info.get('type', 'unknown'),
+                        'nation': info.get('nation', 'unknown')
+                    }
+                    
+            log("[WinChance] Battle stats collector initialized for arena {}".format(self.arena_id))
+            
+        except Exception as e:
+            err("[WinChance] Error in BattleStatsCollector.on_battle_start: {}".format(e))
+    
+    def update_from_player_feedback(self, event_type, *args):
+        """Обновляет статистику на основе событий игры"""
+        try:
+            if event_type == 'DAMAGE_DEALT':
+                self.damage_dealt += args[0] if args else 0
+            elif event_type == 'DAMAGE_ASSISTED':
+                self.damage_assisted += args[0] if args else 0
+            elif event_type == 'BLOCKED_DAMAGE':
+                self.damage_blocked += args[0] if args else 0
+            elif event_type == 'VEHICLE_KILLED':
+                self.kills += 1
+            elif event_type == 'VEHICLE_SPOTTED':
+                self.spotted += 1
+            elif event_type == 'SHOT_FIRED':
+                self.shots += 1
+            elif event_type == 'SHOT_HIT':
+                self.hits += 1
+            elif event_type == 'SHOT_PENETRATED':
+                self.penetrations += 1
+                
+        except Exception as e:
+            err("[WinChance] Error updating battle stats: {}".format(e))
+    
+    def battle_info(self):
+        """
+        Поля боя, известные с его начала (карта, режим, команда, танк)
+        
+        Сохраняются вместе с предсказанием, чтобы результат из ангара
+        можно было отправить с теми же значениями, что и по арене.
+        
+        Returns:
+            dict: Поля BattleResultDto без результата и статистики или None
+        """
+        if not self.arena_id or not self.player_vehicle:
+            return None
+        
+        return {
+            'ArenaUniqueId': self.arena_id,
+            'BattleTime': self.battle_start_time or get_current_time(),
+            'MapName': self.map_name or 'Unknown',
+            'BattleType': self.battle_type or 'random',
+            'Team': self.player_team or 1,
+            
+            # TankInfoDto (PascalCase)
+            'Tank': {
+                'TankId': self.player_vehicle.get('id', 0),
+                'Name': self.player_vehicle.get('name', 'Unknown'),
+                'Tier': self.player_vehicle.get('tier', 0),
+                'Type': self.player_vehicle.get('type', 'unknown'),
+                'Nation': self.player_vehicle.get('nation', 'unknown')
+            }
+        }
+    
+    def prepare_api_data(self, battle_result, win_chance=0.0, ally_wgr=0, enemy_wgr=0):
+        """
+        Подготавливает данные для отправки в API
+        
+        Args:
+            battle_result: Результат боя ('win', 'lose', 'draw')
+            win_chance: Шанс на победу (0.0-100.0)
+            ally_wgr: Рейтинг союзников
+            enemy_wgr: Рейтинг противников
+            
+        Returns:
+            dict: Данные в формате API (PascalCase для .NET)
+        """
+        try:
+            if not self.arena_id:
+                err("[WinChance] Cannot prepare API data - arena_id is not set")
+                return None
+            
+            if not self.player_vehicle:
+                err("[WinChance] Cannot prepare API data - player_vehicle is not set")
+                return None
+            
+            log("[WinChance] Preparing API data: arena_id={}, result={}".format(
+                self.arena_id, battle_result))
+            
+            # Формат данных согласно C# BattleResultDto (PascalCase)
+            api_data = self.battle_info()
+            api_data.update({
+                'Result': battle_result,
+                'DamageDealt': self.damage_dealt,
+                'DamageAssisted': self.damage_assisted,
+                'DamageBlocked': self.damage_blocked,
+                'Kills': self.kills,
+                'Spotted': self.spotted,
+                'Experience': 0,  # Будет обновлено из результатов боя
+                'Credits': 0,  # Будет обновлено из результатов боя
+                'Shots': self.shots,
+                'Hits': self.hits,
+                'Penetrations': self.penetrations,
+                'WinChance': win_chance,
+                'AllyWgr': ally_wgr,
+                'EnemyWgr': enemy_wgr
+            })
+            return api_data
+        except Exception as e:
+            err("[WinChance] Error preparing API data: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+            return None
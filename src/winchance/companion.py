@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Связь с процессом-компаньоном (companion/winchance_companion.py)
+
+Компаньон выполняет HTTP-запросы к API вне процесса игры. Если он не
+запущен или соединение потеряно, работа выполняется в самом моде как
+раньше. Импортируется, только если компаньон включен в конфиге API.
+"""
+
+from .core import API_CONFIG, _logger, _metrics
+from .ipc import CompanionClient, PROTOCOL_VERSION
+
+# Запас сверх бюджета повторов компаньона до перехода на локальную отправку, с
+BUDGET_MARGIN = 5.0
+
+_client = None
+_handshake_done = False
+# Компаньон другой версии: не переподключаемся до конца сессии
+_disabled = False
+
+
+def _settings():
+    return API_CONFIG.get('companion') or {}
+
+
+def enabled():
+    """Включен ли компаньон в конфиге (и не отключен после неудачного рукопожатия)"""
+    return bool(_settings().get('enabled')) and not _disabled
+
+
+def pump():
+    """Обслуживает соединение с компаньоном (из игрового цикла)"""
+    global _client, _handshake_done
+
+    if not enabled():
+        if _client is not None:
+            close()
+        return
+
+    if _client is None:
+        settings = _settings()
+        _client = CompanionClient(settings.get('host', '127.0.0.1'), int(settings.get('port', 5015)),
+                                  float(settings.get('timeout', 30)))
+
+    # Колбэки ответов из pump() могут закрыть соединение (_client = None)
+    client = _client
+    was_connected = client.connected
+    client.pump()
+    if client is not _client:
+        return
+    if client.connected and not was_connected:
+        _handshake_done = False
+        client.send('ping', {'version': PROTOCOL_VERSION}, _on_pong)
+    elif was_connected and not client.connected:
+        _logger.info("[WinChance] Companion connection lost: {}", client.last_error or "closed")
+        _metrics.incr('companion.disconnects')
+
+
+def _on_pong(ok, result):
+    global _handshake_done, _disabled
+    if ok and isinstance(result, dict) and result.get('version') == PROTOCOL_VERSION:
+        # Ждем ответа не меньше, чем компаньон может повторять запрос,
+        # иначе локальная отправка пойдет параллельно с его повторами
+        budget = result.get('budget')
+        if isinstance(budget, (int, float)) and _client is not None:
+            _client.timeout = max(_client.timeout, budget + BUDGET_MARGIN)
+        _handshake_done = True
+        _logger.info("[WinChance] Companion connected (pid {}, timeout {}s)", result.get('pid'),
+                     _client.timeout if _client is not None else None)
+    else:
+        # Ответ пришел, но компаньон несовместим - повторное подключение
+        # на каждом тике ничего не изменит
+        _disabled = True
+        _metrics.incr('companion.rejected')
+        _logger.error("[WinChance] Companion handshake failed, companion disabled for this session: {}", result)
+        close()
+
+
+def close():
+    """Закрывает соединение; невыполненные запросы выполняются локально"""
+    global _client, _handshake_done
+    if _client is not None:
+        client, _client = _client, None
+        client.close()
+    _handshake_done = False
+
+
+def send(op, args, fallback=None, on_failed=None):
+    """
+    Передает операцию компаньону
+
+    Args:
+        op: Имя операции компаньона
+        args: Аргументы операции
+        fallback: Выполняется локально, если компаньон не ответит
+        on_failed: on_failed(error) при ответе компаньона с ошибкой
+
+    Returns:
+        bool: True, если операцию взял компаньон
+    """
+    if _client is None or not _handshake_done:
+        return False
+
+    def on_result(ok, result):
+        if ok:
+            _metrics.incr('companion.{}.ok'.format(op))
+        else:
+            _metrics.incr('companion.{}.failed'.format(op))
+            _logger.error("[WinChance] Companion {} failed: {}", op, result)
+            if on_failed is not None:
+                on_failed(result)
+
+    def on_lost():
+        _metrics.incr('companion.{}.fallback'.format(op))
+        if fallback is not None:
+            fallback()
+
+    if not _client.send(op, args, on_result, on_lost):
+        return False
+    _metrics.incr('companion.{}.sent'.format(op))
+    return True
+
+
+def send_battle(battle_data, fallback=None):
+    """Отправка боя в API через компаньон (POST /api/battles)"""
+    return send('battles.create', {
+        'api_url': API_CONFIG['api_url'],
+        'token': API_CONFIG['token'],
+        'data': battle_data,
+    }, fallback)
+
+
+def send_battle_update(arena_id, changes, fallback=None):
+    """Обновление боя в API через компаньон (PUT /api/battles/{id})"""
+    return send('battles.update', {
+        'api_url': API_CONFIG['api_url'],
+        'token': API_CONFIG['token'],
+        'arena_id': arena_id,
+        'data': changes,
+    }, fallback, _on_update_failed)
+
+
+def _on_update_failed(error):
+    """Ответ 404/405 на обновление: сервер не поддерживает PUT /api/battles/{id}"""
+    from . import api
+    for code in api.UPDATE_UNSUPPORTED_CODES:
+        # Компаньон передает ошибку 4xx как 'RuntimeError: HTTP <код>: <тело>'
+        if 'HTTP {}:'.format(code) in str(error):
+            api.disable_battle_updates(code)
@@ -0,0 +1,1263 @@
+# -*- coding: utf-8 -*-
+"""
+Ядро Win Chance: логирование, инструментирование, фоновые потоки и конфиги
+
+Модуль не тянет сеть и прочие тяжелые зависимости - остальные модули
+пакета подгружают их при первом использовании.
+"""
+
+import BigWorld
+import os
+import json
+import codecs
+import time
+import sys
+import bisect
+import functools
+import copy
+import collections
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# XVM imports
+try:
+    # XVM v13 uses openwg_libraries and openwg_packages structure
+    from xfw.logger import *
+    from xfw.events import registerEvent
+    try:
+        from xfw import as_event
+    except ImportError:
+        # as_event might not be available in all XFW versions
+        def as_event(event_name, data):
+            debug("[WinChance] as_event called but not available: {}".format(event_name))
+    
+    import xvm_battle.battle as battle
+    XVM_AVAILABLE = True
+    log("[WinChance] XVM modules loaded successfully")
+    
+    # Try to import statistics - may not be available in all XVM versions
+    try:
+        import xvm_statistics.statisticsengine as statisticsengine
+    except ImportError:
+        statisticsengine = None
+        debug("[WinChance] XVM statistics module not available")
+        
+except ImportError as e:
+    print("[WinChance] XVM import error: {}".format(e))
+    XVM_AVAILABLE = False
+    battle = None
+    statisticsengine = None
+    
+    # Fallback logging functions when XVM is not available
+    def log(msg):
+        print(msg)
+    
+    def err(msg):
+        print("ERROR: {}".format(msg))
+    
+    def debug(msg):
+        print("DEBUG: {}".format(msg))
+    
+    # Fallback for XVM event functions
+    def as_event(event_name, data):
+        debug("[WinChance] as_event called (XVM not available): {}".format(event_name))
+    
+    def registerEvent(module, event_type, callback):
+        debug("[WinChance] registerEvent called (XVM not available): {}.{}".format(module, event_type))
+
+
+
+
+# ---------------------------------------------------------------------
+# Инструментирование: замер времени колбэков игрового цикла
+# ---------------------------------------------------------------------
+
+# Таймер высокого разрешения (time.time в Windows под Python 2 имеет шаг ~15 мс)
+if hasattr(time, 'perf_counter'):
+    perf_clock = time.perf_counter
+elif sys.platform == 'win32':
+    perf_clock = time.clock
+else:
+    perf_clock = time.time
+
+# Верхние границы корзин гистограммы (мс), последняя корзина - всё что больше
+PERF_BUCKETS_MS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 33.0, 50.0, 100.0, 250.0, 500.0, 1000.0)
+# Бюджет одного кадра при 60 FPS (мс)
+PERF_FRAME_BUDGET_MS = 16.0
+# Интервал периодического вывода сводки (сек)
+PERF_SUMMARY_INTERVAL = 300.0
+
+
+class PerfHistogram(object):
+    """Гистограмма времени выполнения с фиксированными корзинами"""
+    
+    def __init__(self, bounds=PERF_BUCKETS_MS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.over_budget = 0
+    
+    def add(self, value_ms):
+        """Добавляет одно измерение (мс)"""
+        self.buckets[bisect.bisect_left(self.bounds, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+        if value_ms > PERF_FRAME_BUDGET_MS:
+            self.over_budget += 1
+    
+    def percentile(self, fraction):
+        """
+        Оценивает перцентиль по верхней границе корзины
+        
+        Args:
+            fraction: Доля (0.5 для p50, 0.95 для p95)
+            
+        Returns:
+            float: Оценка перцентиля (мс), не больше максимума
+        """
+        if not self.count:
+            return 0.0
+        
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+                break
+        return self.max
+    
+    def summary(self):
+        """Возвращает компактную сводку для лога и файла статистики"""
+        return {
+            'n': self.count,
+            'avg': round(self.total / self.count, 3) if self.count else 0.0,
+            'p50': round(self.percentile(0.5), 3),
+            'p95': round(self.percentile(0.95), 3),
+            'max': round(self.max, 3),
+            'over': self.over_budget,
+            'buckets': self.buckets
+        }
+
+
+class PerfMonitor(object):
+    """Собирает время выполнения точек входа из игрового цикла"""
+    
+    def __init__(self):
+        self.enabled = True
+        self.histograms = {}
+        self.stats_file = os.path.join('./mods/configs/mod_winchance/logs', 'perf_stats.json')
+        self.last_dump = perf_clock()
+    
+    def record(self, name, elapsed_ms):
+        """Записывает измерение в гистограмму name"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = PerfHistogram()
+        histogram.add(elapsed_ms)
+    
+    def maybe_dump(self):
+        """Выводит сводку, если прошло PERF_SUMMARY_INTERVAL секунд"""
+        if self.enabled and perf_clock() - self.last_dump >= PERF_SUMMARY_INTERVAL:
+            self.dump()
+    
+    def dump(self):
+        """Выводит сводку в лог и сохраняет её в файл статистики"""
+        self.last_dump = perf_clock()
+        if not self.histograms:
+            return
+        
+        try:
+            summaries = {}
+            for name in sorted(self.histograms):
+                summary = self.histograms[name].summary()
+                summaries[name] = summary
+                log("[WinChance] perf {}: n={} p50={:.2f}ms p95={:.2f}ms max={:.2f}ms over={}".format(
+                    name, summary['n'], summary['p50'], summary['p95'], summary['max'], summary['over']))
+            
+            _writer.submit_coalesced(self.stats_file, self._write_stats, {
+                'time': get_current_time(),
+                'budget_ms': PERF_FRAME_BUDGET_MS,
+                'bounds_ms': PERF_BUCKETS_MS,
+                'callbacks': summaries
+            })
+        except Exception as e:
+            err("[WinChance] Error dumping perf stats: {}".format(e))
+    
+    def _write_stats(self, stats):
+        """Записывает сводку в файл статистики (в потоке записи)"""
+        stats_dir = os.path.dirname(self.stats_file)
+        if not os.path.exists(stats_dir):
+            os.makedirs(stats_dir)
+        
+        with open(self.stats_file, 'w') as f:
+            json.dump(stats, f, separators=(',', ':'))
+
+
+_perf = PerfMonitor()
+
+
+class _MetricTimer(object):
+    """Контекстный менеджер: замеряет длительность блока в гистограмму"""
+    
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.start = 0.0
+    
+    def __enter__(self):
+        self.start = perf_clock()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self.registry.observe(self.name, (perf_clock() - self.start) * 1000.0)
+        return False
+
+
+class MetricsRegistry(object):
+    """Счетчики, значения и гистограммы мода с периодическим снимком в JSON"""
+    
+    def __init__(self):
+        self.enabled = True
+        self.interval = 60.0
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.log_dir = './mods/configs/mod_winchance/logs'
+        self.snapshot_file = os.path.join(self.log_dir, 'metrics.json')
+        self.history_file = os.path.join(self.log_dir, 'metrics_history.jsonl')
+        self.session_start = time.time()
+        self.last_snapshot = perf_clock()
+    
+    def configure(self, config):
+        """
+        Применяет настройки из DEBUG_CONFIG['metrics']
+        
+        Args:
+            config: Словарь с ключами enabled, interval
+        """
+        self.enabled = config.get('enabled', self.enabled)
+        self.interval = max(5.0, float(config.get('interval', self.interval)))
+    
+    def incr(self, name, value=1):
+        """Увеличивает счетчик name"""
+        self.counters[name] = self.counters.get(name, 0) + value
+    
+    def set_gauge(self, name, value):
+        """Устанавливает текущее значение name"""
+        self.gauges[name] = value
+    
+    def observe(self, name, value_ms):
+        """Добавляет измерение (мс) в гистограмму name"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = PerfHistogram()
+        histogram.add(value_ms)
+    
+    def timer(self, name):
+        """Возвращает контекстный менеджер, замеряющий блок в гистограмму name"""
+        return _MetricTimer(self, name)
+    
+    def maybe_snapshot(self):
+        """Сохраняет снимок, если прошло interval секунд"""
+        if self.enabled and perf_clock() - self.last_snapshot >= self.interval:
+            self.snapshot()
+    
+    def snapshot(self, final=False):
+        """
+        Сохраняет снимок метрик в metrics.json
+        
+        Args:
+            final: True при выгрузке мода - снимок также дописывается в историю сессий
+        """
+        self.last_snapshot = perf_clock()
+        if not self.enabled:
+            return
+        
+        try:
+            data = json.dumps({
+                'session_start': int(self.session_start),
+                'time': int(time.time()),
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': dict((name, histogram.summary())
+                                   for name, histogram in list(self.histograms.items()))
+            }, separators=(',', ':'))
+            
+            _writer.submit_coalesced(self.snapshot_file, self._write_snapshot, data, final)
+        except Exception as e:
+            err("[WinChance] Error saving metrics snapshot: {}".format(e))
+    
+    def _write_snapshot(self, data, final):
+        """Записывает снимок на диск (в потоке записи)"""
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        
+        with open(self.snapshot_file, 'w') as f:
+            f.write(data)
+        
+        if final:
+            with open(self.history_file, 'a') as f:
+                f.write(data + '\n')
+
+
+_metrics = MetricsRegistry()
+
+
+# Экономные режимы, в которые переключается функция при превышении бюджета
+WATCHDOG_DEGRADED_MODES = {
+    'storage': 'deferred logging',
+    'overlay': 'static overlay',
+    'api': 'uploads without companion',
+    'xvm': 'no XVM wait'
+}
+
+
+class FeatureWatchdog(object):
+    """Следит за стоимостью функций мода и переводит медленные в экономный режим"""
+    
+    def __init__(self):
+        self.enabled = True
+        self.strikes_limit = 3
+        self.budgets_ms = {}
+        self.strikes = {}
+        self.degraded = set()
+        # Функция -> perf_clock() перехода в экономный режим
+        self.degraded_at = {}
+        # Через сколько секунд экономный режим снимается (0 - не снимать)
+        self.recover_after = 300.0
+        self.deferred = []
+        # Колбэк уведомления пользователя: listener(message)
+        self.listener = None
+    
+    def configure(self, config):
+        """
+        Применяет настройки из DEBUG_CONFIG['watchdog']
+        
+        Args:
+            config: Словарь с ключами enabled, strikes, budgets_ms, recover_s
+        """
+        self.enabled = config.get('enabled', self.enabled)
+        self.strikes_limit = max(1, int(config.get('strikes', self.strikes_limit)))
+        self.recover_after = max(0.0, float(config.get('recover_s', self.recover_after)))
+        self.budgets_ms = dict(config.get('budgets_ms', {}))
+    
+    def is_degraded(self, feature):
+        """Возвращает True, если функция переведена в экономный режим"""
+        return feature in self.degraded
+    
+    def observe(self, feature, elapsed_ms):
+        """
+        Учитывает одно выполнение функции
+        
+        Функция переводится в экономный режим после strikes_limit
+        превышений бюджета подряд.
+        """
+        if not self.enabled or feature in self.degraded:
+            return
+        
+        budget = self.budgets_ms.get(feature)
+        if budget is None:
+            return
+        
+        if elapsed_ms <= budget:
+            self.strikes[feature] = 0
+            return
+        
+        strikes = self.strikes.get(feature, 0) + 1
+        self.strikes[feature] = strikes
+        if strikes >= self.strikes_limit:
+            self.degrade(feature, elapsed_ms, budget)
+    
+    def degrade(self, feature, elapsed_ms, budget):
+        """Переводит функцию в экономный режим и уведомляет пользователя"""
+        self.degraded.add(feature)
+        self.degraded_at[feature] = perf_clock()
+        mode = WATCHDOG_DEGRADED_MODES.get(feature, 'degraded mode')
+        message = "{} took {:.0f} ms (budget {:.0f} ms), switched to {}".format(
+            feature, elapsed_ms, budget, mode)
+        log("[WinChance] Watchdog: " + message)
+        
+        if self.listener is not None:
+            try:
+                self.listener("WinChance: " + message)
+            except Exception as e:
+                debug("[WinChance] Watchdog listener error: {}".format(e))
+    
+    def recover(self):
+        """
+        Снимает экономный режим с функций, пробывших в нем recover_after секунд
+        
+        Вызывается вне боя; если функция снова медленная, она вернется в
+        экономный режим после strikes_limit превышений.
+        
+        Returns:
+            list: Восстановленные функции
+        """
+        if not self.degraded or not self.recover_after:
+            return []
+        now = perf_clock()
+        recovered = [feature for feature in self.degraded
+                     if now - self.degraded_at.get(feature, now) >= self.recover_after]
+        for feature in recovered:
+            self.degraded.discard(feature)
+            self.degraded_at.pop(feature, None)
+            self.strikes[feature] = 0
+            log("[WinChance] Watchdog: {} restored after {:.0f} sec".format(feature, self.recover_after))
+        return recovered
+    
+    def defer(self, func, *args):
+        """Откладывает вызов func до выхода в ангар"""
+        self.deferred.append((func, args))
+    
+    def run_or_defer(self, feature, func, *args):
+        """
+        Выполняет func сразу или откладывает, если функция feature в экономном режиме
+        
+        Returns:
+            bool: True если вызов отложен
+        """
+        if feature in self.degraded:
+            self.defer(func, *args)
+            return True
+        func(*args)
+        return False
+    
+    def flush_deferred(self):
+        """Выполняет отложенные вызовы (вызывается вне боя)"""
+        if not self.deferred:
+            return
+        
+        pending, self.deferred = self.deferred, []
+        log("[WinChance] Watchdog: running {} deferred calls".format(len(pending)))
+        for func, args in pending:
+            try:
+                func(*args)
+            except Exception as e:
+                err("[WinChance] Error in deferred call: {}".format(e))
+
+
+_watchdog = FeatureWatchdog()
+
+
+class HotPathProfiler(object):
+    """Профилирует выбранные функции через cProfile в течение N боев"""
+    
+    def __init__(self):
+        self.enabled = False
+        self.targets = frozenset()
+        self.battles_left = 0
+        self.keep_files = 10
+        self.profile_dir = './mods/configs/mod_winchance/logs/profiles'
+        # Активный cProfile.Profile (None - профилирование не идет)
+        self.profile = None
+        self.label = None
+        self.depth = 0
+        # Последний примененный DEBUG_CONFIG['profile']
+        self.config = None
+    
+    def configure(self, config):
+        """
+        Применяет настройки из DEBUG_CONFIG['profile']
+        
+        Args:
+            config: Словарь с ключами enabled, battles, targets, keep_files
+        
+        Тот же конфиг повторно не применяется: перечитывание файла из-за
+        правки других секций не сбрасывает счетчик оставшихся боев.
+        """
+        if config == self.config:
+            return
+        self.config = copy.deepcopy(config)
+        self.enabled = config.get('enabled', False)
+        self.targets = frozenset(config.get('targets', []))
+        self.battles_left = int(config.get('battles', 0))
+        self.keep_files = max(1, int(config.get('keep_files', self.keep_files)))
+        if self.enabled:
+            log("[WinChance] Profiling enabled for {} battles: {}".format(
+                self.battles_left, ', '.join(sorted(self.targets))))
+    
+    def on_battle_start(self, arena_id):
+        """Сохраняет профиль предыдущего боя и начинает новый"""
+        self.finish()
+        if not self.enabled or self.battles_left <= 0:
+            return
+        
+        try:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.label = arena_id
+            self.battles_left -= 1
+        except Exception as e:
+            err("[WinChance] Error starting profiler: {}".format(e))
+            self.enabled = False
+    
+    def call(self, func, args, kwargs):
+        """Выполняет func под профайлером (вложенные вызовы не перезапускают его)"""
+        self.depth += 1
+        if self.depth == 1:
+            self.profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.profile.disable()
+    
+    def finish(self):
+        """Сохраняет текущий профиль в .pstats и удаляет старые файлы"""
+        if self.profile is None or self.depth:
+            return
+        
+        profile, self.profile = self.profile, None
+        try:
+            if not os.path.exists(self.profile_dir):
+                os.makedirs(self.profile_dir)
+            
+            path = os.path.join(self.profile_dir, 'winchance_{}_{}.pstats'.format(
+                time.strftime('%Y%m%d_%H%M%S', time.localtime()), self.label))
+            profile.dump_stats(path)
+            log("[WinChance] Profile saved: {}".format(path))
+            
+            # Ротация: оставляем keep_files последних профилей
+            files = sorted(name for name in os.listdir(self.profile_dir) if name.endswith('.pstats'))
+            for name in files[:-self.keep_files]:
+                os.remove(os.path.join(self.profile_dir, name))
+        except Exception as e:
+            err("[WinChance] Error saving profile: {}".format(e))
+
+
+_profiler = HotPathProfiler()
+
+
+def timed(name, feature=None):
+    """
+    Декоратор: замеряет время выполнения функции
+    
+    Args:
+        name: Имя гистограммы в PerfMonitor
+        feature: Функция мода для FeatureWatchdog (None - не отслеживать)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiling = _profiler.profile is not None and name in _profiler.targets
+            if not _perf.enabled and feature is None and not profiling:
+                return func(*args, **kwargs)
+            start = perf_clock()
+            try:
+                if profiling:
+                    return _profiler.call(func, args, kwargs)
+                return func(*args, **kwargs)
+            finally:
+                elapsed_ms = (perf_clock() - start) * 1000.0
+                if _perf.enabled:
+                    _perf.record(name, elapsed_ms)
+                if feature is not None:
+                    _watchdog.observe(feature, elapsed_ms)
+        return wrapper
+    return decorator
+
+
+# Глобальный конфиг API
+API_CONFIG = {
+    'enabled': True,
+    'api_url': 'http://localhost:5000',
+    'token': None,
+    'account_id': None,
+    'nickname': None,
+    'region': 'RU',
+    # Сервис рейтингов для игроков, которых нет в XVM
+    'stats_service': {
+        'enabled': False,
+        'url': 'http://localhost:5000/api/stats',
+        'batch_size': 100,
+        'workers': 4,
+        'timeout': 5
+    },
+    # Процесс-компаньон для HTTP-запросов вне игры (companion/winchance_companion.py)
+    'companion': {
+        'enabled': False,
+        'host': '127.0.0.1',
+        'port': 5015,
+        # Минимальное ожидание ответа, с; после рукопожатия не меньше
+        # бюджета повторов компаньона (budget в ответе ping) плюс запас
+        'timeout': 30
+    }
+}
+
+# Отладочный конфиг (бюджеты watchdog и т.п.)
+DEBUG_CONFIG = {
+    'watchdog': {
+        'enabled': True,
+        'strikes': 3,
+        # Экономный режим снимается через столько секунд (в ангаре)
+        'recover_s': 300,
+        'budgets_ms': {
+            'storage': 8.0,
+            'overlay': 2.0,
+            'api': 50.0,
+            'xvm': 16.0
+        }
+    },
+    'profile': {
+        'enabled': False,
+        'battles': 3,
+        'keep_files': 10,
+        'targets': [
+            'calc.calculate_once',
+            'calc.players_data',
+            'hangar.on_result',
+            'api.dispatch'
+        ]
+    },
+    'metrics': {
+        'enabled': True,
+        'interval': 60
+    },
+    'logging': {
+        'level': 'info',
+        'rate_limit': 20,
+        'rate_window': 60,
+        'ring_size': 200
+    }
+}
+
+# Уровни ModLogger
+LOG_LEVELS = {
+    'debug': 10,
+    'info': 20,
+    'error': 40
+}
+
+
+class LazyJson(object):
+    """Сериализует объект в компактный JSON только при выводе сообщения"""
+    
+    def __init__(self, value):
+        self.value = value
+    
+    def __str__(self):
+        text = json.dumps(self.value, ensure_ascii=False, separators=(',', ':'))
+        # В Python 2 json.dumps может вернуть unicode
+        if not isinstance(text, str):
+            text = text.encode('utf-8')
+        return text
+
+
+class ModLogger(object):
+    """
+    Логирование с уровнями, ленивым форматированием и ограничением частоты
+    
+    Сообщения задаются шаблоном str.format и аргументами; строка собирается
+    только если сообщение будет выведено. Debug-записи всегда попадают в
+    кольцевой буфер и сбрасываются на диск только при ошибке.
+    """
+    
+    def __init__(self):
+        self.level = LOG_LEVELS['info']
+        self.rate_limit = 20
+        self.rate_window = 60.0
+        self.ring = collections.deque(maxlen=200)
+        self.ring_file = os.path.join('./mods/configs/mod_winchance/logs', 'debug_ring.log')
+        # Шаблон -> [начало окна, число сообщений, подавлено]
+        self.rates = {}
+    
+    def configure(self, config):
+        """
+        Применяет настройки из DEBUG_CONFIG['logging']
+        
+        Args:
+            config: Словарь с ключами level, rate_limit, rate_window, ring_size
+        """
+        self.level = LOG_LEVELS.get(config.get('level'), self.level)
+        self.rate_limit = int(config.get('rate_limit', self.rate_limit))
+        self.rate_window = float(config.get('rate_window', self.rate_window))
+        ring_size = int(config.get('ring_size', self.ring.maxlen))
+        if ring_size != self.ring.maxlen:
+            self.ring = collections.deque(self.ring, maxlen=ring_size)
+    
+    def debug(self, template, *args):
+        """Debug-сообщение: в кольцевой буфер и, если уровень позволяет, в лог"""
+        self.ring.append((time.time(), template, args))
+        if self.level <= LOG_LEVELS['debug'] and self._allow(template):
+            debug(self._format(template, args))
+    
+    def info(self, template, *args):
+        """Информационное сообщение"""
+        if self.level <= LOG_LEVELS['info'] and self._allow(template):
+            log(self._format(template, args))
+    
+    def error(self, template, *args):
+        """Сообщение об ошибке; сбрасывает кольцевой буфер на диск"""
+        if self._allow(template):
+            err(self._format(template, args))
+        self.flush_ring()
+    
+    def _allow(self, template):
+        """Проверяет ограничение частоты для шаблона"""
+        now = time.time()
+        rate = self.rates.get(template)
+        if rate is None or now - rate[0] >= self.rate_window:
+            if rate is not None and rate[2]:
+                log("[WinChance] ({} similar messages suppressed: {})".format(rate[2], template))
+            self.rates[template] = [now, 1, 0]
+            return True
+        
+        if rate[1] < self.rate_limit:
+            rate[1] += 1
+            return True
+        
+        rate[2] += 1
+        return False
+    
+    def _format(self, template, args):
+        """Форматирует сообщение"""
+        try:
+            return template.format(*args) if args else template
+        except Exception as e:
+            return "{} (format error: {})".format(template, e)
+    
+    def flush_ring(self):
+        """Дописывает накопленные debug-записи в debug_ring.log и очищает буфер"""
+        if not self.ring:
+            return
+        
+        records, self.ring = list(self.ring), collections.deque(maxlen=self.ring.maxlen)
+        _writer.submit(self._write_ring, records)
+    
+    def _write_ring(self, records):
+        """Записывает debug-записи в debug_ring.log (в потоке записи)"""
+        try:
+            ring_dir = os.path.dirname(self.ring_file)
+            if not os.path.exists(ring_dir):
+                os.makedirs(ring_dir)
+            
+            with open(self.ring_file, 'a') as f:
+                for timestamp, template, args in records:
+                    line = "{} {}\n".format(
+                        time.strftime('%H:%M:%S', time.localtime(timestamp)), self._format(template, args))
+                    if not isinstance(line, str):
+                        line = line.encode('utf-8')
+                    f.write(line)
+        except Exception as e:
+            err("[WinChance] Error flushing debug ring buffer: {}".format(e))
+
+
+_logger = ModLogger()
+
+
+class AsyncFileWriter(object):
+    """
+    Фоновый поток для файловых операций
+    
+    Задания выполняются строго по очереди (порядок записи в каждый файл
+    сохраняется). Повторные перезаписи одного файла, ещё не дошедшие до
+    выполнения, схлопываются - записывается только последний снимок.
+    
+    Очередь ограничена (max_queue), постановка задания никогда не
+    блокирует игровой поток: при переполнении дописывание отбрасывается
+    (метрика writer.dropped), а перезапись остается последним снимком и
+    выполняется потоком записи после текущего задания. Задания,
+    поставленные из самого потока записи (например, сброс debug-буфера
+    при ошибке записи), выполняются сразу, без очереди.
+    """
+    
+    def __init__(self, max_queue=256):
+        self.jobs = queue.Queue(max_queue)
+        self.lock = threading.Lock()
+        # Ключ -> (func, args) для схлопываемых перезаписей
+        self.coalesced = {}
+        # Перезаписи, не поместившиеся в очередь (выполняет поток записи)
+        self.overflow = set()
+        self.thread = None
+    
+    def start(self):
+        """Запускает поток записи"""
+        if self.thread is not None:
+            return
+        try:
+            self.thread = threading.Thread(target=self._run, name='WinChanceWriter')
+            self.thread.daemon = True
+            self.thread.start()
+        except Exception as e:
+            err("[WinChance] Error starting writer thread: {}".format(e))
+            self.thread = None
+    
+    def submit(self, func, *args):
+        """
+        Ставит func(*args) в очередь записи
+        
+        Если поток не запущен или вызов пришел из потока записи,
+        выполняет его сразу.
+        """
+        if self.thread is None or self._in_writer_thread():
+            self._execute(func, args)
+            return
+        try:
+            self.jobs.put_nowait((func, args))
+        except queue.Full:
+            _metrics.incr('writer.dropped')
+            return
+        _metrics.set_gauge('writer.queue', self.jobs.qsize())
+    
+    def submit_coalesced(self, key, func, *args):
+        """
+        Ставит перезапись файла key в очередь
+        
+        Если перезапись key уже ждет в очереди, заменяет её аргументы,
+        не добавляя новое задание. Если очередь заполнена, перезапись
+        выполнит поток записи после текущего задания.
+        """
+        if self.thread is None:
+            self._execute(func, args)
+            return
+        
+        with self.lock:
+            queued = key in self.coalesced
+            if queued or not self._in_writer_thread():
+                self.coalesced[key] = (func, args)
+        if queued:
+            return
+        if self._in_writer_thread():
+            self._execute(func, args)
+            return
+        try:
+            self.jobs.put_nowait((self._run_coalesced, (key,)))
+        except queue.Full:
+            with self.lock:
+                self.overflow.add(key)
+            _metrics.incr('writer.overflow')
+            return
+        _metrics.set_gauge('writer.queue', self.jobs.qsize())
+    
+    def drain(self, timeout=5.0):
+        """
+        Блокирующе дожидается выполнения всех заданий и останавливает поток
+        
+        Returns:
+            bool: True если очередь выполнена полностью
+        """
+        thread = self.thread
+        if thread is None:
+            return True
+        
+        done = threading.Event()
+        try:
+            self.jobs.put((done.set, ()), True, timeout)
+            drained = done.wait(timeout)
+            if drained is None:
+                # Python 2.6: Event.wait возвращает None
+                drained = done.is_set()
+            self.jobs.put(None, True, timeout)
+        except queue.Full:
+            drained = False
+        thread.join(timeout)
+        self.thread = None
+        
+        if not drained:
+            err("[WinChance] Writer thread did not finish in {:.0f} sec".format(timeout))
+        return drained
+    
+    def _in_writer_thread(self):
+        """True если вызов пришел из потока записи"""
+        return threading.current_thread() is self.thread
+    
+    def _run_coalesced(self, key):
+        """Выполняет последнюю версию схлопнутой перезаписи"""
+        with self.lock:
+            func, args = self.coalesced.pop(key)
+        func(*args)
+    
+    def _run_overflow(self):
+        """Выполняет перезаписи, не поместившиеся в очередь (в потоке записи)"""
+        while True:
+            with self.lock:
+                if not self.overflow:
+                    return
+                key = self.overflow.pop()
+                func, args = self.coalesced.pop(key)
+            self._execute(func, args)
+    
+    def _execute(self, func, args):
+        """Выполняет одно задание"""
+        try:
+            func(*args)
+        except Exception as e:
+            err("[WinChance] Error in file writer job: {}".format(e))
+    
+    def _run(self):
+        """Цикл потока записи"""
+        while True:
+            job = self.jobs.get()
+            if self.overflow:
+                self._run_overflow()
+            if job is None:
+                break
+            self._execute(job[0], job[1])
+
+
+_writer = AsyncFileWriter()
+
+
+class BackgroundTaskRunner(object):
+    """
+    Фоновый поток для тяжелых задач (распаковка результатов, отправка в API)
+    
+    Изменения состояния мода из задач не выполняются в фоновом потоке:
+    задача передает их через call_in_main(), а pump() выполняет накопленные
+    вызовы в основном потоке (из _check_battle_state).
+    """
+    
+    def __init__(self):
+        self.tasks = queue.Queue()
+        self.main_calls = queue.Queue()
+        self.thread = None
+    
+    def submit(self, func, *args):
+        """Ставит func(*args) в очередь фонового потока (поток запускается при первой задаче)"""
+        if self.thread is None:
+            try:
+                self.thread = threading.Thread(target=self._run, name='WinChanceTasks')
+                self.thread.daemon = True
+                self.thread.start()
+            except Exception as e:
+                err("[WinChance] Error starting task thread: {}".format(e))
+                self.thread = None
+                self._execute(func, args)
+                return
+        self.tasks.put((func, args))
+    
+    def call_in_main(self, func, *args):
+        """Передает вызов func(*args) в основной поток (из фоновой задачи)"""
+        self.main_calls.put((func, args))
+    
+    def pump(self, limit=50):
+        """Выполняет накопленные вызовы основного потока"""
+        for _ in range(limit):
+            try:
+                func, args = self.main_calls.get_nowait()
+            except queue.Empty:
+                return
+            self._execute(func, args)
+    
+    def stop(self, timeout=None):
+        """
+        Останавливает фоновый поток после текущей очереди
+        
+        Args:
+            timeout: Сколько секунд ждать завершения потока (None - не ждать)
+        """
+        thread = self.thread
+        if thread is not None:
+            self.tasks.put(None)
+            self.thread = None
+            if timeout is not None:
+                thread.join(timeout)
+    
+    def _execute(self, func, args):
+        """Выполняет одно задание"""
+        try:
+            func(*args)
+        except Exception as e:
+            err("[WinChance] Error in background task: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+    
+    def _run(self):
+        """Цикл фонового потока"""
+        while True:
+            job = self.tasks.get()
+            if job is None:
+                break
+            self._execute(job[0], job[1])
+
+
+_tasks = BackgroundTaskRunner()
+
+
+# Каталог конфигов, интервал проверки внешних правок и задержка записи (сек)
+CONFIG_DIR = './mods/configs'
+CONFIG_POLL_INTERVAL = 5.0
+CONFIG_SAVE_DELAY = 2.0
+
+
+def merge_config(target, source):
+    """
+    Переносит значения source в target; вложенные словари сливаются по ключам
+    
+    Частичная секция пользовательского конфига не теряет ключи по умолчанию.
+    
+    Returns:
+        dict: target
+    """
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_config(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+
+class ConfigService(object):
+    """
+    Единая точка работы с конфигами мода (mods/configs/<name>.json)
+    
+    Файлы читаются один раз и дальше отдаются из памяти, дополненные
+    значениями по умолчанию. Внешние правки (и появление файла, которого
+    не было при загрузке) замечаются по mtime на медленном таймере (poll),
+    подписчики получают новый конфиг. Записи откладываются на
+    CONFIG_SAVE_DELAY, схлопываются и выполняются атомарно (через
+    временный файл) в потоке записи.
+    """
+    
+    def __init__(self, config_dir=CONFIG_DIR):
+        self.config_dir = config_dir
+        self.configs = {}
+        # name -> конфиг по умолчанию (копия)
+        self.defaults = {}
+        # Конфиги без файла и без значений по умолчанию - ждем появления файла
+        self.missing = set()
+        # name -> mtime файла при последнем чтении/записи (под lock: пишет и поток записи)
+        self.mtimes = {}
+        self.lock = threading.Lock()
+        # name -> [callback(config)] для внешних правок
+        self.listeners = {}
+        # name -> id отложенной записи (BigWorld.callback)
+        self.pending = {}
+        # Конфиги, запись которых еще не завершена (их mtime не сверяем; под lock)
+        self.writing = set()
+        self.last_poll = perf_clock()
+        self.dir_ready = False
+    
+    def path(self, name):
+        """Путь к файлу конфига"""
+        return os.path.join(self.config_dir, name + '.json')
+    
+    def load(self, name, defaults=None):
+        """
+        Возвращает конфиг, читая файл только при первом обращении
+        
+        Args:
+            name: Имя конфига (файл без .json)
+            defaults: Конфиг по умолчанию; записывается на диск, если файла нет,
+                и дополняет отсутствующие в файле ключи (в том числе вложенные)
+            
+        Returns:
+            dict: Конфиг (None если файла нет и defaults не заданы)
+        """
+        if name in self.configs:
+            return self.configs[name]
+        
+        if defaults is not None:
+            self.defaults[name] = copy.deepcopy(defaults)
+        
+        path = self.path(name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            if defaults is None:
+                self.missing.add(name)
+                return None
+            self.configs[name] = copy.deepcopy(defaults)
+            self._save_now(name)
+            log("[WinChance] Config {} not found, default created".format(name))
+            return self.configs[name]
+        
+        try:
+            config = self._read(name)
+        except Exception as e:
+            # Битый файл не перезаписываем - ждем исправления (poll заметит новый mtime)
+            err("[WinChance] Error loading config {}: {}".format(name, e))
+            config = copy.deepcopy(defaults or {})
+        
+        self.configs[name] = config
+        with self.lock:
+            self.mtimes[name] = mtime
+        return config
+    
+    def _read(self, name):
+        """Читает файл конфига и дополняет его значениями по умолчанию"""
+        with codecs.open(self.path(name), 'r', 'utf-8-sig') as f:
+            config = json.load(f)
+        defaults = self.defaults.get(name)
+        if defaults is None or not isinstance(config, dict):
+            return config
+        return merge_config(copy.deepcopy(defaults), config)
+    
+    def get(self, name):
+        """Возвращает загруженный конфиг или None"""
+        return self.configs.get(name)
+    
+    def set(self, name, config):
+        """Заменяет конфиг и планирует отложенную запись"""
+        self.configs[name] = copy.deepcopy(config)
+        self._schedule(name)
+    
+    def update(self, name, **values):
+        """Обновляет поля конфига и планирует отложенную запись"""
+        config = self.configs.get(name)
+        if config is None:
+            config = self.configs[name] = {}
+            self.missing.discard(name)
+        config.update(values)
+        self._schedule(name)
+    
+    def subscribe(self, name, callback):
+        """Подписывает callback(config) на внешние правки файла"""
+        self.listeners.setdefault(name, []).append(callback)
+    
+    def poll(self):
+        """Проверяет mtime конфигов раз в CONFIG_POLL_INTERVAL и перечитывает измененные"""
+        now = perf_clock()
+        if now - self.last_poll < CONFIG_POLL_INTERVAL:
+            return
+        self.last_poll = now
+        
+        for name in list(self.configs) + list(self.missing):
+            if name in self.pending:
+                continue
+            # Сверка под lock: поток записи обновляет mtime своей записи
+            with self.lock:
+                if name in self.writing:
+                    continue
+                try:
+                    mtime = os.path.getmtime(self.path(name))
+                except OSError:
+                    continue
+                if mtime == self.mtimes.get(name):
+                    continue
+                self.mtimes[name] = mtime
+            
+            try:
+                config = self._read(name)
+            except Exception as e:
+                err("[WinChance] Error reloading config {}: {}".format(name, e))
+                continue
+            
+            self.configs[name] = config
+            self.missing.discard(name)
+            log("[WinChance] Config {} changed on disk, reloaded".format(name))
+            for callback in self.listeners.get(name, ()):
+                try:
+                    callback(config)
+                except Exception as e:
+                    err("[WinChance] Error applying config {}: {}".format(name, e))
+    
+    def flush(self):
+        """Немедленно ставит в очередь все отложенные записи (при выгрузке мода)"""
+        for name, callback_id in list(self.pending.items()):
+            try:
+                BigWorld.cancelCallback(callback_id)
+            except Exception:
+                pass
+            self._save_now(name)
+    
+    def _schedule(self, name):
+        """Откладывает запись конфига; повторные изменения переносят её"""
+        callback_id = self.pending.pop(name, None)
+        if callback_id is not None:
+            try:
+                BigWorld.cancelCallback(callback_id)
+            except Exception:
+                pass
+        self.pending[name] = BigWorld.callback(CONFIG_SAVE_DELAY, functools.partial(self._save_now, name))
+    
+    def _save_now(self, name):
+        """Ставит запись снимка конфига в поток записи"""
+        self.pending.pop(name, None)
+        with self.lock:
+            self.writing.add(name)
+        path = self.path(name)
+        _writer.submit_coalesced(path, self._write_atomic, name, path, copy.deepcopy(self.configs[name]))
+    
+    def _write_atomic(self, name, path, config):
+        """Записывает конфиг через временный файл (в потоке записи)"""
+        try:
+            if not self.dir_ready:
+                if not os.path.isdir(self.config_dir):
+                    os.makedirs(self.config_dir)
+                self.dir_ready = True
+            
+            temp_path = path + '.tmp'
+            with _metrics.timer('io.write.config'):
+                with codecs.open(temp_path, 'w', 'utf-8-sig') as f:
+                    json.dump(config, f, indent=2, ensure_ascii=False)
+                try:
+                    os.rename(temp_path, path)
+                except OSError:
+                    # Windows: rename не заменяет существующий файл
+                    os.remove(path)
+                    os.rename(temp_path, path)
+            
+            mtime = os.path.getmtime(path)
+            with self.lock:
+                self.mtimes[name] = mtime
+        except Exception as e:
+            err("[WinChance] Error saving config {}: {}".format(name, e))
+        finally:
+            with self.lock:
+                self.writing.discard(name)
+
+
+_configs = ConfigService()
+
+
+def get_current_time():
+    """Получает текущее время в формате строки"""
+    try:
+        # Используем time.localtime вместо datetime для совместимости с WoT
+        current_time = time.localtime()
+        # ISO 8601 формат для совместимости с .NET DateTime
+        return time.strftime('%Y-%m-%dT%H:%M:%S', current_time)
+    except:
+        # Fallback на BigWorld time
+        return str(int(BigWorld.time()))
+
+
+def save_api_config():
+    """Сохраняет конфигурацию API (отложенная запись через ConfigService)"""
+    log("[WinChance] Saving API config")
+    _configs.set('mod_winchance_api', API_CONFIG)
+    return True
+
+def load_api_config():
+    """Загружает конфигурацию API и следит за её правками"""
+    try:
+        _apply_api_config(_configs.load('mod_winchance_api', API_CONFIG))
+        _configs.subscribe('mod_winchance_api', _apply_api_config)
+    except Exception as e:
+        err("[WinChance] Error loading API config: {}".format(e))
+
+def _apply_api_config(config):
+    """Применяет конфигурацию API (вложенные секции - по ключам)"""
+    merge_config(API_CONFIG, config)
+    log("[WinChance] API config loaded: enabled={}, url={}".format(
+        API_CONFIG['enabled'], API_CONFIG['api_url']))
+
+def load_debug_config():
+    """Загружает отладочный конфиг и следит за его правками"""
+    try:
+        _apply_debug_config(_configs.load('mod_winchance_debug', DEBUG_CONFIG))
+        _configs.subscribe('mod_winchance_debug', _apply_debug_config)
+    except Exception as e:
+        err("[WinChance] Error loading debug config: {}".format(e))
+
+def _apply_debug_config(config):
+    """Применяет отладочный конфиг к watchdog, профайлеру, метрикам и логгеру"""
+    merge_config(DEBUG_CONFIG, config)
+    
+    _watchdog.configure(DEBUG_CONFIG['watchdog'])
+    _profiler.configure(DEBUG_CONFIG['profile'])
+    _metrics.configure(DEBUG_CONFIG['metrics'])
+    _logger.configure(DEBUG_CONFIG['logging'])
+    log("[WinChance] Debug config loaded")
@@ -0,0 +1,1094 @@
+# -*- coding: utf-8 -*-
+"""
+Отображение шанса на победу: жизненный цикл боя и результаты из ангара
+"""
+
+import os
+import BigWorld
+from gui.battle_control import avatar_getter
+
+from .calculator import BattleRoster, WinChanceCalculator
+from .collector import BattleStatsCollector
+from .encounters import EncounterIndex
+from .model import _model_file
+from .priors import PriorTable
+from .tankstats import TankStatsStore
+from .core import (API_CONFIG, XVM_AVAILABLE, _logger, _metrics, _profiler, _tasks,
+                   _watchdog, err, get_current_time, log, timed)
+from .stats import PlayerStatsCache, VehicleInfoCache, XvmStatsProvider
+from .storage import BattleLogger, BattleResultLogger, ResultPipeline
+from .ui import DraggableWinChanceWindow
+
+# Периоды арены (constants.ARENA_PERIOD)
+ARENA_PERIOD_WAITING = 1
+ARENA_PERIOD_PREBATTLE = 2
+
+# Задержка первого расчета после предзагрузки на экране загрузки (сек)
+PREFETCH_FIRST_CALC_DELAY = 0.5
+
+# Офлайн-дамп рейтингов (tools/build_rating_db.py)
+RATING_DB_PATH = './mods/configs/mod_winchance/ratings.db'
+
+
+class WinChanceDisplay(object):
+    """Класс для отображения шанса на победу"""
+    
+    def __init__(self):
+        self.is_in_battle = False
+        self.overlay = DraggableWinChanceWindow()
+        self.data_ready = False
+        self.logger = BattleLogger()
+        self.result_logger = BattleResultLogger()
+        
+        # История встреч с игроками, обновляется при фиксации результата
+        self.encounters = EncounterIndex()
+        self.encounters.open()
+        self.encounters_met = 0  # Сколько игроков текущего боя уже встречались
+        
+        # Априорные шансы по карте, режиму и стороне спавна
+        self.priors = PriorTable()
+        self.priors.load()
+        
+        # Накопительная статистика игрока по танкам
+        self.tank_stats = TankStatsStore()
+        self.tank_stats.load()
+        
+        self.results = ResultPipeline(self.result_logger, self.encounters, self.priors, self.tank_stats)
+        self.results.load()
+        
+        # Кеш статистики игроков из прошлых боев
+        self.player_cache = PlayerStatsCache()
+        self.player_cache.load()
+        
+        # Метаданные техники по compactDescr
+        self.vehicle_info = VehicleInfoCache()
+        self.vehicle_info.load()
+        self.hangar_warmed = False  # Кеш техники прогрет в текущем визите в ангар
+        
+        # Коэффициенты модели загружены при инициализации мода (mod_winchance.init)
+        self.calculator = WinChanceCalculator(self.vehicle_info, _model_file.model)
+        
+        # Игроки текущего боя
+        self.roster = BattleRoster(self.calculator, self.vehicle_info)
+        
+        # Источники статистики по приоритету: XVM, сервис рейтингов,
+        # кеш прошлых боев, офлайн-дамп
+        self.stats_providers = []
+        if XVM_AVAILABLE:
+            self.stats_providers.append(XvmStatsProvider())
+        self.remote_stats = None
+        stats_service = API_CONFIG.get('stats_service') or {}
+        if stats_service.get('enabled') and stats_service.get('url'):
+            from .remote import RemoteStatsProvider
+            self.remote_stats = RemoteStatsProvider(stats_service)
+            self.stats_providers.append(self.remote_stats)
+        self.stats_providers.append(self.player_cache)
+        if os.path.exists(RATING_DB_PATH):
+            from .ratingdb import OfflineRatingDb
+            rating_db = OfflineRatingDb(RATING_DB_PATH)
+            if rating_db.open():
+                self.stats_providers.append(rating_db)
+        
+        # Данные текущего боя для логирования
+        self.current_battle_data = None
+        
+        # Сохраняем данные арены для использования после окончания боя
+        self.saved_battle_id = None
+        self.saved_player_team = None
+        self.saved_arena_period_callback = None
+        self.monitoring_active = False  # Флаг активного мониторинга
+        
+        # Арена, на onNewVehicleListReceived которой мы подписаны
+        self._vehicle_list_arena = None
+        self._calc_retries = 0
+        
+        # Подписываемся на события результатов боя
+        self._subscribe_to_battle_events()
+        self.stats_collector = BattleStatsCollector(self.vehicle_info)
+        
+    @timed('battle.start')
+    def on_battle_start(self):
+        """Вызывается при старте боя"""
+
+        """Обработчик начала боя"""
+        try:
+            log("[WinChance] Battle started")
+            self.is_in_battle = True
+            
+            # Если токена нет - пытаемся зарегистрироваться снова
+            if API_CONFIG['enabled'] and not API_CONFIG.get('token'):
+                log("[WinChance] Attempting registration at battle start...")
+                from .api import check_and_register_if_needed
+                check_and_register_if_needed()
+        
+        except Exception as e:
+            err("[WinChance] Error in on_battle_start: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+        
+        try:
+            # Если есть активный мониторинг предыдущего боя
+            if self.monitoring_active and self.saved_arena_period_callback is not None:
+                log("[WinChance] Previous battle monitoring is still active, attempting to save results...")
+                
+                # Пытаемся получить результаты предыдущего боя
+                try:
+                    arena = avatar_getter.getArena()
+                    if arena is not None:
+                        # Арена еще есть, пробуем получить результаты
+                        period = getattr(arena, 'period', None)
+                        if period == 3:
+                            log("[WinChance] Previous battle finished, saving results before new battle")
+                            self._try_get_battle_results_from_arena(arena)
+                        else:
+                            log("[WinChance] Previous battle still in progress (period={}), cannot save results".format(period))
+                except Exception as e:
+                    err("[WinChance] Error checking previous battle: {}".format(e))
+                
+                # Останавливаем старый мониторинг
+                try:
+                    BigWorld.cancelCallback(self.saved_arena_period_callback)
+                except:
+                    pass
+                self.saved_arena_period_callback = None
+                self.monitoring_active = False
+                log("[WinChance] Previous battle monitoring stopped")
+            
+            self.is_in_battle = True
+            self.data_ready = False
+            self.hangar_warmed = False
+            self.current_battle_data = None
+            log("[WinChance] Battle started, waiting for XVM data...")
+            
+            # Профиль пишется на бой (включая результаты, полученные в ангаре)
+            _profiler.on_battle_start(getattr(avatar_getter.getArena(), 'arenaUniqueID', 0))
+            
+            for provider in self.stats_providers:
+                provider.on_battle_start()
+            
+            # Собираем базовую информацию о бое
+            self._collect_battle_info()
+            
+            # Создаем overlay (но не показываем пока нет данных)
+            self.overlay.create()
+            
+            # Новый бой - новый счетчик попыток расчета
+            self._calc_retries = 0
+            self.encounters_met = 0
+            
+            # Предзагрузка статистики еще на экране загрузки; если список
+            # техники пока пуст - дождемся его от арены
+            if not self._prefetch():
+                self._subscribe_vehicle_list()
+            
+            # Первый расчет сразу после предзагрузки, дальше - повторные попытки
+            BigWorld.callback(PREFETCH_FIRST_CALC_DELAY, self._calculate_once)
+            
+            # Инициализируем сбор статистики
+            self.stats_collector.on_battle_start()
+            self._log_tank_stats()
+            
+        except Exception as e:
+            err("[WinChance] Error in on_battle_start: {}".format(e))
+    
+    def on_battle_end(self):
+        """Вызывается при окончании боя"""
+        try:
+            log("[WinChance] Battle ended (player left)")
+            
+            # НЕ отменяем callback - продолжаем мониторинг арены
+            # до получения результатов боя
+            # Callback отменится автоматически когда arena станет None
+            
+            self.is_in_battle = False
+            self.data_ready = False
+            self._unsubscribe_vehicle_list()
+            self.roster.detach()
+            
+            # Уничтожаем overlay
+            self.overlay.destroy()
+            
+            # Сохраняем кеш статистики игроков
+            self.player_cache.save()
+            self.vehicle_info.save()
+            
+            log("[WinChance] Overlay destroyed, arena monitoring continues")
+            
+        except Exception as e:
+            err("[WinChance] Error in on_battle_end: {}".format(e))
+    
+    
+    @timed('calc.prefetch')
+    def _prefetch(self):
+        """
+        Предзагрузка на экране загрузки: строит индекс игроков, достает
+        статистику из кеша, отправляет запросы источникам и заранее
+        считает показатели команд
+        
+        Returns:
+            bool: True если список техники арены уже доступен
+        """
+        try:
+            arena = avatar_getter.getArena()
+            if arena is None or not getattr(arena, 'vehicles', None):
+                return False
+            
+            players_data = self._get_players_data()
+            player_team = getattr(BigWorld.player(), 'team', None)
+            if players_data and player_team:
+                self.calculator.update(player_team)
+            
+            _logger.info("[WinChance] Prefetched stats for {} players (period={})",
+                         len(players_data), getattr(arena, 'period', None))
+            return True
+        
+        except Exception as e:
+            _logger.error("[WinChance] Error in _prefetch: {}", e)
+            return False
+    
+    def _subscribe_vehicle_list(self):
+        """Подписывается на получение списка техники арены"""
+        try:
+            arena = avatar_getter.getArena()
+            event = getattr(arena, 'onNewVehicleListReceived', None)
+            if event is None:
+                return
+            event += self._on_vehicle_list_received
+            self._vehicle_list_arena = arena
+        except Exception as e:
+            _logger.error("[WinChance] Error subscribing to vehicle list: {}", e)
+    
+    def _unsubscribe_vehicle_list(self):
+        """Отписывается от получения списка техники арены"""
+        arena = self._vehicle_list_arena
+        self._vehicle_list_arena = None
+        if arena is None:
+            return
+        try:
+            arena.onNewVehicleListReceived -= self._on_vehicle_list_received
+        except Exception:
+            pass
+    
+    def _on_vehicle_list_received(self, *args):
+        """Список техники пришел - запускаем предзагрузку"""
+        self._unsubscribe_vehicle_list()
+        if self.is_in_battle and not self.data_ready:
+            self._prefetch()
+    
+    def _report_prediction_lead(self, arena):
+        """
+        Метрика "прогноз готов за T-x секунд до начала боя"
+        
+        Args:
+            arena: Текущая арена
+        """
+        try:
+            period = getattr(arena, 'period', None)
+            if period == ARENA_PERIOD_WAITING:
+                # Еще идет загрузка - отсчет даже не начался
+                _metrics.incr('calc.ready_on_loading')
+                _logger.info("[WinChance] Prediction ready during loading screen")
+                return
+            
+            end_time = getattr(arena, 'periodEndTime', 0)
+            if period == ARENA_PERIOD_PREBATTLE:
+                lead = end_time - BigWorld.serverTime()
+            else:
+                # Бой уже идет - отрицательное значение, отставание от старта
+                lead = end_time - getattr(arena, 'periodLength', 0) - BigWorld.serverTime()
+            
+            _metrics.set_gauge('calc.ready_lead_sec', round(lead, 2))
+            _metrics.observe('calc.ready_lead', lead * 1000.0)
+            _logger.info("[WinChance] Prediction ready at T-{:.1f} sec", lead)
+        except Exception as e:
+            _logger.debug("[WinChance] Cannot measure prediction lead: {}", e)
+    
+    @timed('calc.calculate_once')
+    def _calculate_once(self):
+        """Рассчитывает win chance один раз когда данные готовы"""
+        try:
+            if not self.is_in_battle:
+                return
+            
+            # Если данные уже обработаны - не повторяем
+            if self.data_ready:
+                return
+            
+            # Счетчик попыток (сбрасывается в on_battle_start)
+            self._calc_retries += 1
+            _metrics.incr('calc.attempts')
+            
+            _logger.info("[WinChance] Calculating win chance (attempt {})...", self._calc_retries)
+            
+            # Получаем данные игроков
+            arena = avatar_getter.getArena()
+            if arena is None:
+                if self._calc_retries < 15:
+                    BigWorld.callback(2.0, self._calculate_once)
+                return
+            
+            # Получаем команду игрока
+            player = BigWorld.player()
+            if not hasattr(player, 'team'):
+                if self._calc_retries < 15:
+                    BigWorld.callback(2.0, self._calculate_once)
+                return
+            
+            player_team = player.team
+            
+            # Получаем данные из XVM
+            players_data = self._get_players_data()
+            if not players_data:
+                if self._calc_retries < 15:
+                    BigWorld.callback(2.0, self._calculate_once)
+                return
+            
+            # Проверяем что получили реальные данные XVM (не дефолтные)
+            real_data_count = self.roster.real_data_count()
+            
+            _logger.info("[WinChance] Got {} players with real XVM data", real_data_count)
+            _metrics.set_gauge('xvm.real_data_count', real_data_count)
+            
+            # Пока сервис рейтингов отвечает - проверяем чаще
+            if real_data_count < 20 and self.remote_stats is not None and self.remote_stats.in_flight():
+                _logger.debug("[WinChance] Waiting for rating service ({}/20), retrying in 0.5 sec...", real_data_count)
+                BigWorld.callback(0.5, self._calculate_once)
+                return
+            
+            # Если меньше 20 игроков с реальными данными - ждем еще, но не вечно
+            # Максимум 30 секунд (15 попыток * 2 сек), в экономном режиме XVM не ждем
+            if real_data_count < 20 and self._calc_retries < 15 and not _watchdog.is_degraded('xvm'):
+                _logger.debug("[WinChance] Waiting for more XVM data ({}/20), retrying in 2 sec...", real_data_count)
+                BigWorld.callback(2.0, self._calculate_once)
+                return
+            
+            if real_data_count < 20:
+                _logger.info("[WinChance] Timeout waiting for full data. Calculating with partial data ({} players)", real_data_count)
+            else:
+                _logger.info("[WinChance] XVM data ready, calculating...")
+                
+            # Данные готовы (или таймаут)! Рассчитываем
+            self._apply_prior(arena, player_team)
+            self.calculator.update(player_team)
+            self._load_encounters(arena, player)
+            
+            # Отображаем результаты
+            self._show_display()
+            self.data_ready = True
+            self._unsubscribe_vehicle_list()
+            self._report_prediction_lead(arena)
+            
+            # Сохраняем результаты в лог файл
+            self._save_battle_results()
+            
+            # Сохраняем данные для получения результатов после боя
+            self._save_arena_data_for_results()
+            
+            # Отправляем предварительные данные в API со статусом "undone"
+            if API_CONFIG['enabled'] and API_CONFIG.get('token'):
+                try:
+                    _logger.info("[WinChance] Sending initial prediction to API (undone status)...")
+                    undone_data = self.stats_collector.prepare_api_data(
+                        battle_result='undone',
+                        win_chance=self.calculator.win_chance,
+                        ally_wgr=self.calculator.ally_wgr,
+                        enemy_wgr=self.calculator.enemy_wgr
+                    )
+                    if undone_data:
+                        from .api import send_battle_to_api
+                        send_battle_to_api(undone_data)
+                except Exception as e:
+                    _logger.error("[WinChance] Error sending initial prediction: {}", e)
+            
+            _logger.info("[WinChance] Win chance displayed successfully")
+            
+        except Exception as e:
+            _logger.error("[WinChance] Error in _calculate_once: {}", e)
+            import traceback
+            _logger.error("{}", traceback.format_exc())
+    
+    @timed('calc.players_data', 'xvm')
+    def _get_players_data(self):
+        """
+        Обновляет статистику игроков текущего боя
+        
+        Состав ростера поддерживается событиями арены; источники
+        опрашиваются только для игроков, у которых еще нет живых данных
+        (XVM/сервис).
+        
+        Returns:
+            dict: Записи игроков (vehicle_id -> PlayerRecord)
+        """
+        try:
+            arena = avatar_getter.getArena()
+            if arena is None:
+                _logger.debug("[WinChance] Arena is None in _get_players_data")
+                return {}
+            
+            roster = self.roster
+            roster.sync(arena)
+            _logger.debug("[WinChance] Found {} vehicles in arena", len(roster.records))
+            
+            # Готовим источники статистики (поиск данных XVM и т.п.)
+            for provider in self.stats_providers:
+                provider.prepare()
+            
+            # Игроки без живой статистики (XVM/сервис) - для запроса к сервису рейтингов
+            unresolved = []
+            records = roster.records
+            
+            for vehicle_id in list(roster.unresolved):
+                record = records[vehicle_id]
+                account_id = record.account_id
+                if not account_id:
+                    continue
+                
+                # Опрашиваем источники по порядку (XVM, сервис, кеш прошлых боев, офлайн-дамп)
+                live = False
+                for provider in self.stats_providers:
+                    stats = provider.get_stats(account_id, record.vehicle_cd)
+                    if stats:
+                        live = provider.cacheable
+                        roster.set_stats(vehicle_id, stats, provider.name, live)
+                        if live:
+                            self.player_cache.put(account_id, stats)
+                        break
+                
+                if not live:
+                    unresolved.append(account_id)
+            
+            # Недостающих игроков запрашиваем у сервиса рейтингов одной серией пачек
+            if self.remote_stats is not None and unresolved:
+                self.remote_stats.request(unresolved)
+            
+            _logger.debug("[WinChance] Processed {} players successfully", len(roster.records))
+            return roster.records
+            
+        except Exception as e:
+            _logger.error("[WinChance] Error in _get_players_data: {}", e)
+            import traceback
+            _logger.error("{}", traceback.format_exc())
+            return {}
+    
+    def _log_tank_stats(self):
+        """Выводит в лог статистику игрока на текущем танке"""
+        tank_id = (self.stats_collector.player_vehicle or {}).get('id')
+        summary = self.tank_stats.get(tank_id)
+        if summary is None:
+            return
+        _logger.info("[WinChance] {}: {} battles, {:.1f}% wins, damage {:.0f} +- {:.0f}, assisted {:.0f}",
+                     summary['name'], summary['battles'], summary['win_rate'],
+                     summary['avg']['DamageDealt'], summary['var']['DamageDealt'] ** 0.5,
+                     summary['avg']['DamageAssisted'])
+    
+    def _apply_prior(self, arena, player_team):
+        """Выставляет калькулятору поправку по карте, режиму и стороне спавна"""
+        arena_type = getattr(arena, 'arenaType', None)
+        self.calculator.intercept = self.priors.intercept(
+            getattr(arena_type, 'name', None), getattr(arena_type, 'gameplayName', None), player_team)
+        _metrics.set_gauge('calc.prior_intercept', self.calculator.intercept)
+    
+    def _load_encounters(self, arena, player):
+        """
+        Запоминает состав боя для индекса встреч и одним запросом
+        достает историю встреч со всеми игроками боя
+        """
+        try:
+            own_vehicle_id = getattr(player, 'playerVehicleID', None)
+            players = [(record.account_id, record.team)
+                       for vehicle_id, record in self.roster.records.items()
+                       if vehicle_id != own_vehicle_id and record.account_id]
+            
+            self.encounters.begin(getattr(arena, 'arenaUniqueID', None), player.team, players)
+            history = self.encounters.lookup_many([account_id for account_id, _ in players])
+            self.encounters_met = len(history)
+            _logger.debug("[WinChance] Met {} of {} players before", len(history), len(players))
+        except Exception as e:
+            _logger.error("[WinChance] Error loading encounters: {}", e)
+    
+    def _show_display(self):
+        """Отображает шанс на победу"""
+        try:
+            calc = self.calculator
+            
+            # Формируем простое текстовое сообщение
+            message = "Win Chance: {:.1f}% | Ally WGR: {:.0f} | Enemy WGR: {:.0f}".format(
+                calc.win_chance, calc.ally_wgr, calc.enemy_wgr)
+            if self.encounters_met:
+                message += " | Met: {}".format(self.encounters_met)
+            
+            # Обновляем overlay
+            self.overlay.update_text(message)
+            
+            # Логируем результат
+            log("[WinChance] " + message)
+                
+        except Exception as e:
+            err("[WinChance] Error in _show_display: {}".format(e))
+    
+    def _format_display_text(self):
+        """
+        Форматирует текст для отображения
+        
+        Returns:
+            str: Форматированный текст
+        """
+        calc = self.calculator
+        
+        # Определяем цвет на основе шанса
+        if calc.win_chance >= 60:
+            color_start = "<font color='#00FF00'>"  # Зеленый
+        elif calc.win_chance >= 45:
+            color_start = "<font color='#FFFF00'>"  # Желтый
+        else:
+            color_start = "<font color='#FF0000'>"  # Красный
+        
+        color_end = "</font>"
+        
+        text = "<textformat leading='-2'>"
+        text += "<font size='16' face='$FieldFont'>"
+        text += "<b>Шанс победы:</b> {}{:.1f}%{}<br/>".format(
+            color_start, calc.win_chance, color_end)
+        text += "<font size='13'>"
+        text += "WGR союзники: <font color='#00FF00'>{:.0f}</font><br/>".format(calc.ally_wgr)
+        text += "WGR противники: <font color='#FF0000'>{:.0f}</font>".format(calc.enemy_wgr)
+        text += "</font>"
+        text += "</font>"
+        text += "</textformat>"
+        
+        return text
+    
+    def _show_message(self, message):
+        """Показывает сообщение в игре"""
+        try:
+            # Метод 1: Используем SystemMessages для показа уведомлений
+            try:
+                from gui.SystemMessages import pushMessage
+                pushMessage(message, type='information')
+                return
+            except:
+                pass
+            
+            # Метод 2: Messenger в чат
+            try:
+                from messenger import MessengerEntry
+                MessengerEntry.g_instance.gui.addClientMessage(message)
+                return
+            except:
+                pass
+            
+            # Метод 3: Battle messenger
+            try:
+                player = BigWorld.player()
+                if hasattr(player, 'guiSessionProvider'):
+                    ctrl = player.guiSessionProvider.shared.messages
+                    if ctrl:
+                        ctrl.showMessage('information', message, {'text': message})
+                        return
+            except:
+                pass
+            
+            # Fallback - просто логируем
+            log("[WinChance] {}".format(message))
+            
+        except Exception as e:
+            _logger.debug("[WinChance] Error showing message: {}", e)
+    
+    def _hide_display(self):
+        """Скрывает отображение"""
+        try:
+            # Ничего не делаем - сообщения в чате остаются
+            pass
+        except Exception as e:
+            err("[WinChance] Error in _hide_display: {}".format(e))
+    
+    def _collect_battle_info(self):
+        """Собирает информацию о текущем бое"""
+        try:
+            arena = avatar_getter.getArena()
+            if arena is None:
+                return
+            
+            player = BigWorld.player()
+            if not hasattr(player, 'vehicleTypeDescriptor'):
+                return
+            
+            # Получаем ID боя
+            battle_id = getattr(arena, 'arenaUniqueID', 'Unknown')
+            
+            # Время начала боя
+            start_time = get_current_time()
+            
+            # Полное имя танка (из кеша метаданных)
+            info = self.vehicle_info.describe(player.vehicleTypeDescriptor) or {}
+            vehicle_name = info.get('user_name', 'Unknown')
+            
+            # ID танка (compDescr)
+            vehicle_id = getattr(player, 'vehicleID', 0)
+            
+            # Имя игрока
+            player_name = getattr(player, 'name', 'Unknown')
+            
+            self.current_battle_data = {
+                'battle_id': str(battle_id),
+                'start_time': start_time,
+                'player_name': player_name,
+                'player_vehicle_id': vehicle_id,
+                'player_vehicle_name': vehicle_name,
+                'win_chance': 0,
+                'ally_wgr': 0,
+                'enemy_wgr': 0
+            }
+            
+            log("[WinChance] Battle info collected: ID={}, Vehicle={}".format(
+                battle_id, vehicle_name))
+            
+        except Exception as e:
+            err("[WinChance] Error collecting battle info: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+    
+    def _save_battle_results(self):
+        """Сохраняет предсказание шанса на победу в лог файл"""
+        try:
+            if self.current_battle_data is None:
+                _logger.debug("[WinChance] No battle data to save")
+                return
+            
+            # Обновляем данные рассчитанными значениями
+            self.current_battle_data['win_chance'] = self.calculator.win_chance
+            self.current_battle_data['ally_wgr'] = self.calculator.ally_wgr
+            self.current_battle_data['enemy_wgr'] = self.calculator.enemy_wgr
+            
+            # Логируем через BattleLogger (для истории всех боев)
+            self.logger.log_battle_result(self.current_battle_data)
+            
+            # Сохраняем предсказание для последующей отправки в API после окончания боя
+            self.result_logger.save_prediction(self.current_battle_data, self.stats_collector.battle_info())
+            
+            log("[WinChance] Battle prediction saved: win_chance={:.1f}%, ally_wgr={:.0f}, enemy_wgr={:.0f}".format(
+                self.calculator.win_chance, self.calculator.ally_wgr, self.calculator.enemy_wgr))
+            
+        except Exception as e:
+            err("[WinChance] Error saving battle results: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+    
+    def _collect_battle_statistics(self):
+        """Собирает статистику из результатов боя"""
+        try:
+            player = BigWorld.player()
+            if not player:
+                log("[WinChance] Cannot collect statistics - player not available")
+                return
+            
+            # Пытаемся получить статистику из разных источников
+            stats_collected = False
+            
+            # Источник 1: player.battleResults (если доступен)
+            if hasattr(player, 'battleResults') and player.battleResults:
+                try:
+                    results = player.battleResults
+                    # Обновляем stats_collector
+                    if hasattr(results, 'damageDealt'):
+                        self.stats_collector.damage_dealt = getattr(results, 'damageDealt', 0)
+                    if hasattr(results, 'damageAssisted'):
+                        self.stats_collector.damage_assisted = getattr(results, 'damageAssisted', 0)
+                    if hasattr(results, 'damageBlocked'):
+                        self.stats_collector.damage_blocked = getattr(results, 'damageBlocked', 0)
+                    if hasattr(results, 'kills'):
+                        self.stats_collector.kills = getattr(results, 'kills', 0)
+                    if hasattr(results, 'spotted'):
+                        self.stats_collector.spotted = getattr(results, 'spotted', 0)
+                    if hasattr(results, 'shots'):
+                        self.stats_collector.shots = getattr(results, 'shots', 0)
+                    if hasattr(results, 'hits'):
+                        self.stats_collector.hits = getattr(results, 'hits', 0)
+                    if hasattr(results, 'pierced'):
+                        self.stats_collector.penetrations = getattr(results, 'pierced', 0)
+                    
+                    stats_collected = True
+                    log("[WinChance] Battle statistics collected from battleResults")
+                except Exception as e:
+                    _logger.debug("[WinChance] Error collecting from battleResults: {}", e)
+            
+            # Источник 2: Простые атрибуты player (fallback)
+            if not stats_collected:
+                try:
+                    # Пытаемся получить базовую статистику
+                    if hasattr(player, 'damageDealt'):
+                        self.stats_collector.damage_dealt = getattr(player, 'damageDealt', 0)
+                    if hasattr(player, 'kills'):
+                        self.stats_collector.kills = getattr(player, 'kills', 0)
+                    
+                    log("[WinChance] Basic statistics collected from player")
+                except Exception as e:
+                    _logger.debug("[WinChance] Error collecting basic stats: {}", e)
+            
+            log("[WinChance] Statistics: damage={}, kills={}, shots={}".format(
+                self.stats_collector.damage_dealt,
+                self.stats_collector.kills,
+                self.stats_collector.shots
+            ))
+            
+        except Exception as e:
+            err("[WinChance] Error collecting battle statistics: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+    
+    def _save_battle_result(self, battle_id, player_team, winner_team):
+        """Сохраняет результат боя"""
+        try:
+            # Собираем статистику из результатов боя
+            self._collect_battle_statistics()
+            
+            # Определяем победу/поражение/ничью
+            if winner_team == 0:
+                # winner_team = 0 означает ничью
+                team_result = 3  # Draw
+                win = False
+                result_str = 'draw'
+            elif winner_team == player_team:
+                # Наша команда победила
+                team_result = 1  # Win
+                win = True
+                result_str = 'win'
+            else:
+                # Вражеская команда победила
+                team_result = 2  # Lose
+                win = False
+                result_str = 'lose'
+            
+            # Подготавливаем данные с учетом рассчитанных шансов
+            log("[WinChance] Preparing API data for battle result: {}".format(result_str))
+            api_data = self.stats_collector.prepare_api_data(
+                battle_result=result_str,
+                win_chance=self.calculator.win_chance,
+                ally_wgr=self.calculator.ally_wgr,
+                enemy_wgr=self.calculator.enemy_wgr
+            )
+            
+            if api_data:
+                log("[WinChance] API data: ArenaId={}, Result={}, Tank={}".format(
+                    api_data.get('ArenaUniqueId'),
+                    api_data.get('Result'),
+                    api_data.get('Tank', {}).get('Name', 'Unknown')
+                ))
+            else:
+                err("[WinChance] Failed to prepare API data - prepare_api_data returned None")
+            
+            # Сохраняем результат и отправляем в API (один раз на бой)
+            if self.results.finalize(battle_id, win, team_result, api_data):
+                log("[WinChance] Battle result saved to file")
+            else:
+                log("[WinChance] Battle {} already finalized, merged as update".format(battle_id))
+        
+        except Exception as e:
+            err("[WinChance] Error saving battle result: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+    
+    def _subscribe_to_battle_events(self):
+        """Подписывается на события боя для получения результатов"""
+        try:
+            # Подписка происходит через мониторинг арены в _check_arena_period
+            log("[WinChance] Battle event subscription initialized")
+        except Exception as e:
+            err("[WinChance] Error subscribing to battle events: {}".format(e))
+    
+    def _save_arena_data_for_results(self):
+        """Сохраняет данные арены для последующего получения результатов"""
+        try:
+            arena = avatar_getter.getArena()
+            if arena is None:
+                log("[WinChance] Cannot save arena data - arena is None")
+                return
+            
+            player = BigWorld.player()
+            if not hasattr(player, 'team'):
+                log("[WinChance] Cannot save arena data - no player team")
+                return
+            
+            # Сохраняем данные
+            self.saved_battle_id = getattr(arena, 'arenaUniqueID', None)
+            self.saved_player_team = player.team
+            self.monitoring_active = True
+            
+            log("[WinChance] Arena data saved: Battle ID={}, Team={}".format(
+                self.saved_battle_id, self.saved_player_team))
+            
+            # Начинаем мониторить период арены для определения окончания боя
+            self._start_arena_monitoring()
+            
+        except Exception as e:
+            err("[WinChance] Error saving arena data: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+    
+    def _start_arena_monitoring(self):
+        """Начинает мониторинг арены для определения окончания боя"""
+        try:
+            self.saved_arena_period_callback = BigWorld.callback(1.0, self._check_arena_period)
+            log("[WinChance] Arena monitoring started")
+        except Exception as e:
+            err("[WinChance] Error starting arena monitoring: {}".format(e))
+    
+    @timed('arena.check_period')
+    def _check_arena_period(self):
+        """Проверяет период боя и пытается получить результаты"""
+        try:
+            # Проверяем что мониторинг еще активен
+            if not self.monitoring_active:
+                log("[WinChance] Monitoring was stopped externally")
+                return
+            
+            # Проверяем наличие арены независимо от статуса игрока
+            arena = avatar_getter.getArena()
+            if arena is None:
+                # Арена исчезла - останавливаем мониторинг
+                log("[WinChance] Arena disappeared, stopping monitoring")
+                self.monitoring_active = False
+                self.saved_arena_period_callback = None
+                return
+            
+            # Проверяем что это тот же бой, который мы мониторим
+            current_arena_id = getattr(arena, 'arenaUniqueID', None)
+            if current_arena_id != self.saved_battle_id:
+                log("[WinChance] Arena ID changed ({} != {}), stopping old monitoring".format(
+                    current_arena_id, self.saved_battle_id))
+                self.monitoring_active = False
+                self.saved_arena_period_callback = None
+                return
+            
+            # Проверяем период боя
+            period = getattr(arena, 'period', None)
+            
+            # Период 3 = PERIOD_AFTERBATTLE (бой закончен)
+            if period == 3:
+                log("[WinChance] Battle finished detected (period=3)")
+                self._try_get_battle_results_from_arena(arena)
+                # Останавливаем мониторинг после получения результатов
+                self.monitoring_active = False
+                self.saved_arena_period_callback = None
+                return
+            
+            # Продолжаем мониторинг пока арена существует
+            if self.monitoring_active:
+                self.saved_arena_period_callback = BigWorld.callback(1.0, self._check_arena_period)
+            
+        except Exception as e:
+            err("[WinChance] Error in _check_arena_period: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+            # При ошибке останавливаем мониторинг
+            self.monitoring_active = False
+            self.saved_arena_period_callback = None
+    
+    def _try_get_battle_results_from_arena(self, arena):
+        """Получает результаты боя из арены"""
+        try:
+            if arena is None:
+                log("[WinChance] Cannot get results - arena is None")
+                return
+            
+            # Получаем команду-победителя
+            winner_team = getattr(arena, 'winnerTeam', 0)
+            
+            # Альтернативный способ через periodAdditionalInfo
+            if winner_team == 0:
+                period_info = getattr(arena, 'periodAdditionalInfo', None)
+                if period_info:
+                    # periodAdditionalInfo содержит информацию о победителе
+                    if isinstance(period_info, (list, tuple)) and len(period_info) > 0:
+                        winner_team = period_info[0]
+            
+            # Еще один способ - через vehicles
+            if winner_team == 0:
+                vehicles = getattr(arena, 'vehicles', {})
+                team1_alive = 0
+                team2_alive = 0
+                
+                for vehicle_id, vehicle_info in vehicles.items():
+                    if isinstance(vehicle_info, dict):
+                        team = vehicle_info.get('team', 0)
+                        is_alive = vehicle_info.get('isAlive', False)
+                    else:
+                        team = getattr(vehicle_info, 'team', 0)
+                        is_alive = getattr(vehicle_info, 'isAlive', False)
+                    
+                    if is_alive:
+                        if team == 1:
+                            team1_alive += 1
+                        elif team == 2:
+                            team2_alive += 1
+                
+                if team1_alive > 0 and team2_alive == 0:
+                    winner_team = 1
+                elif team2_alive > 0 and team1_alive == 0:
+                    winner_team = 2
+            
+            # Используем сохраненные данные
+            battle_id = self.saved_battle_id
+            player_team = self.saved_player_team
+            
+            if battle_id is None or player_team is None:
+                log("[WinChance] Missing saved data for result logging")
+                return
+            
+            log("[WinChance] Battle result detected: Winner={}, Player team={}".format(
+                winner_team, player_team))
+            
+            # Сохраняем результат
+            self._save_battle_result(battle_id, player_team, winner_team)
+            
+        except Exception as e:
+            err("[WinChance] Error getting battle results from arena: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+
+
+# Добавляем метод обработки в WinChanceDisplay
+@timed('hangar.on_result')
+def on_hangar_result(self, result):
+    """
+    Обрабатывает результаты, полученные в ангаре
+    
+    В основном потоке только быстрая проверка по ожидающим боям;
+    распаковка, формирование данных и отправка в API идут в фоне.
+    """
+    try:
+        if not result:
+            return
+        
+        # Результаты боев, которых нет среди ожидающих, не распаковываем
+        if not self.result_logger.may_be_pending(result):
+            _metrics.incr('hangar.results_skipped')
+            return
+        
+        _metrics.incr('hangar.results_parsed')
+        _tasks.submit(self._process_hangar_result, result, dict(self.result_logger.pending_battles))
+    
+    except Exception as e:
+        err("[WinChance] Error handling hangar result: {}".format(e))
+        import traceback
+        err(traceback.format_exc())
+
+
+def _process_hangar_result(self, result, pending_battles):
+    """
+    Распаковывает результат боя и формирует данные для API (в фоновом потоке)
+    
+    Args:
+        result: Результат боя (pickle-строка или dict)
+        pending_battles: Снимок ожидающих боев на момент получения
+    """
+    try:
+        # Распаковываем результат если нужно
+        # Обычно это уже распакованный объект или pickle строка
+        # Пробуем распарсить
+        battle_results = None
+        
+        if isinstance(result, str):
+            try:
+                try:
+                    import cPickle as pickle
+                except ImportError:
+                    import pickle
+                battle_results = pickle.loads(result)
+            except Exception:
+                pass
+        
+        if not battle_results and isinstance(result, dict):
+             battle_results = result
+             
+        if not battle_results:
+            # log("[WinChance] Unknown battle result format")
+            return
+
+        # Извлекаем arenaUniqueId
+        arena_id = battle_results.get('arenaUniqueId')
+        if not arena_id:
+            return
+            
+        # Проверяем, ждем ли мы этот бой
+        pending_battle = pending_battles.get(str(arena_id))
+        if not pending_battle:
+            return
+            
+        log("[WinChance] Received battle results for pending arena: {}".format(arena_id))
+        
+        # Находим статистику нашего игрока
+        # battle_results structure: {'personal': {accountDBID: {...stats...}}, 'common': {...}, ...}
+        
+        personal = battle_results.get('personal', {})
+        # Ищем по всем ключам, т.к. accountDBID может быть строкой или int
+        my_stats = None
+        for acc_id, stats in personal.items():
+            if isinstance(stats, dict) and 'damageDealt' in stats:
+                my_stats = stats
+                break
+        if not my_stats:
+            return
+        
+        # Поля боя (карта, режим, команда, танк) сохранены вместе с предсказанием
+        battle_info = pending_battle.get('battle_info') or {}
+        player_team = battle_info.get('Team') or my_stats.get('team')
+        if not player_team:
+            log("[WinChance] Cannot use hangar results for {}: player team unknown".format(arena_id))
+            return
+        
+        # Определяем победителя из common
+        common = battle_results.get('common', {})
+        winner_team = common.get('winnerTeam', 0) # 0 - draw, 1, 2
+        
+        # Коды результата те же, что и при фиксации по арене
+        if winner_team == 0:
+            result_str = 'draw'
+            win = False
+            team_result = 3
+        elif winner_team == player_team:
+            result_str = 'win'
+            win = True
+            team_result = 1
+        else:
+            result_str = 'lose'
+            win = False
+            team_result = 2
+        
+        # Формируем DTO: поля боя - как при отправке по арене,
+        # личный результат - из результатов ангара
+        api_data = dict(battle_info)
+        api_data.update({
+            'ArenaUniqueId': arena_id,
+            'Team': player_team,
+            'Result': result_str,
+            
+            'WinChance': pending_battle.get('win_chance', 0),
+            'AllyWgr': pending_battle.get('ally_wgr', 0),
+            'EnemyWgr': pending_battle.get('enemy_wgr', 0),
+            
+            'DamageDealt': my_stats.get('damageDealt', 0),
+            'DamageAssisted': my_stats.get('damageAssisted', 0) + my_stats.get('damageAssistedRadio', 0) + my_stats.get('damageAssistedTrack', 0),
+            'DamageBlocked': my_stats.get('damageBlockedByArmor', 0),
+            'Kills': my_stats.get('kills', 0),
+            'Spotted': my_stats.get('spotted', 0),
+            'Experience': my_stats.get('xp', 0),
+            'Credits': my_stats.get('credits', 0),
+            'Shots': my_stats.get('shots', 0),
+            'Hits': my_stats.get('directHits', 0),
+            'Penetrations': my_stats.get('piercings', 0)
+        })
+        
+        log("[WinChance] API data prepared from Hangar results")
+        
+        # Фиксируем результат в основном потоке: лог и API один раз на бой,
+        # для уже зафиксированного боя - обновление полей личного результата
+        _tasks.call_in_main(self.results.finalize, arena_id, win, team_result, api_data, True)
+
+    except Exception as e:
+        err("[WinChance] Error processing hangar result: {}".format(e))
+        import traceback
+        err(traceback.format_exc())
+
+WinChanceDisplay.on_hangar_result = on_hangar_result
+WinChanceDisplay._process_hangar_result = _process_hangar_result
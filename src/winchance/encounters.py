@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+Индекс встреч с игроками между боями (mmap + хеш-таблица)
+"""
+
+import os
+import json
+import mmap
+import struct
+import time
+
+from .core import _logger, _metrics, _writer, err, log, timed
+
+# Формат файла индекса встреч: заголовок <4sHHII (magic, version, record_size,
+# capacity, count) и capacity слотов открытой адресации <QIIIII (accountDBID,
+# боев вместе, побед вместе, боев против, побед против, время последней встречи).
+# accountDBID == 0 - пустой слот, capacity - степень двойки
+ENCOUNTER_MAGIC = b'WCEH'
+ENCOUNTER_VERSION = 1
+ENCOUNTER_HEADER = struct.Struct('<4sHHII')
+ENCOUNTER_RECORD = struct.Struct('<QIIIII')
+ENCOUNTER_KEY = struct.Struct('<Q')
+
+ENCOUNTER_INITIAL_CAPACITY = 4096
+ENCOUNTER_MAX_LOAD = 0.7
+
+# Сколько начатых, но не зафиксированных боев хранить
+ENCOUNTER_OPEN_MAX = 20
+
+# Запас свободных слотов: таблица растет заранее (в ангаре), чтобы
+# фиксация результата боя не пересобирала файл
+ENCOUNTER_RESERVE = 30 * ENCOUNTER_OPEN_MAX
+
+# Множитель хеша Фибоначчи: accountDBID идут почти подряд
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_HASH_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def _probe(buffer, bits, account_id):
+    """
+    Ищет слот игрока линейным пробированием
+
+    Returns:
+        tuple: (смещение слота, True если игрок найден)
+    """
+    mask = (1 << bits) - 1
+    index = ((account_id * _HASH_MULTIPLIER) & _HASH_MASK) >> (64 - bits)
+    while True:
+        offset = ENCOUNTER_HEADER.size + index * ENCOUNTER_RECORD.size
+        key = ENCOUNTER_KEY.unpack_from(buffer, offset)[0]
+        if key == account_id:
+            return offset, True
+        if key == 0:
+            return offset, False
+        index = (index + 1) & mask
+
+
+class EncounterIndex(object):
+    """
+    История встреч с игроками: сколько боев вместе и против, сколько из них выиграно
+
+    Файл отображается в память, поиск - O(1) по хеш-таблице без загрузки
+    и парсинга. Состав боя запоминается при расчете шанса (begin), а
+    счетчики обновляются одним проходом при фиксации результата (record).
+    Файл создается и растет только в maintain() на простое в ангаре; если
+    места нет, record откладывает результат до следующего maintain().
+    """
+
+    def __init__(self, path='./mods/configs/mod_winchance/cache/encounters.idx'):
+        self.path = path
+        self.open_file = os.path.splitext(path)[0] + '_open.json'
+        self.file = None
+        self.mapping = None
+        self.bits = 0
+        self.count = 0
+        # str(arena_id) -> [команда игрока, [[accountDBID, команда], ...], время начала]
+        # (+ победа, если результат отложен до роста таблицы)
+        self.open_battles = {}
+
+    @property
+    def capacity(self):
+        return 1 << self.bits if self.mapping is not None else 0
+
+    def open(self):
+        """
+        Открывает индекс (если файла еще нет, он создается при первой записи)
+
+        Returns:
+            bool: True если индекс открыт
+        """
+        self._load_open_battles()
+        try:
+            if not os.path.exists(self.path):
+                return False
+
+            self.file = open(self.path, 'r+b')
+            self.mapping = mmap.mmap(self.file.fileno(), 0)
+
+            magic, version, record_size, capacity, count = ENCOUNTER_HEADER.unpack_from(self.mapping, 0)
+            if (magic != ENCOUNTER_MAGIC or version != ENCOUNTER_VERSION or
+                    record_size != ENCOUNTER_RECORD.size or capacity & (capacity - 1) or
+                    len(self.mapping) < ENCOUNTER_HEADER.size + capacity * ENCOUNTER_RECORD.size):
+                err("[WinChance] Invalid encounter index: {}".format(self.path))
+                self.close()
+                return False
+
+            self.bits = capacity.bit_length() - 1
+            self.count = count
+            log("[WinChance] Encounter index opened: {} players".format(count))
+            return True
+        except Exception as e:
+            err("[WinChance] Error opening encounter index: {}".format(e))
+            self.close()
+            return False
+
+    def close(self):
+        """Сбрасывает изменения на диск и закрывает файл"""
+        if self.mapping is not None:
+            try:
+                self.mapping.flush()
+                self.mapping.close()
+            except Exception as e:
+                err("[WinChance] Error closing encounter index: {}".format(e))
+            self.mapping = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.bits = 0
+
+    def lookup_many(self, account_ids):
+        """
+        Возвращает историю встреч сразу для всех игроков боя
+
+        Args:
+            account_ids: accountDBID игроков
+
+        Returns:
+            dict: accountDBID -> {'with_battles', 'with_wins', 'against_battles',
+                  'against_wins', 'last_seen'} для уже встречавшихся игроков
+        """
+        result = {}
+        mapping = self.mapping
+        if mapping is None:
+            return result
+        for account_id in account_ids:
+            if not account_id:
+                continue
+            offset, found = _probe(mapping, self.bits, account_id)
+            if found:
+                _, with_battles, with_wins, against_battles, against_wins, last_seen = \
+                    ENCOUNTER_RECORD.unpack_from(mapping, offset)
+                result[account_id] = {
+                    'with_battles': with_battles,
+                    'with_wins': with_wins,
+                    'against_battles': against_battles,
+                    'against_wins': against_wins,
+                    'last_seen': last_seen
+                }
+        _metrics.incr('encounters.lookups', len(account_ids))
+        _metrics.incr('encounters.hits', len(result))
+        return result
+
+    def begin(self, arena_id, player_team, players):
+        """
+        Запоминает состав боя до фиксации результата
+
+        Args:
+            arena_id: ID боя
+            player_team: Команда игрока
+            players: Список (accountDBID, команда) остальных игроков боя
+        """
+        if not arena_id or not player_team:
+            return
+        self.open_battles[str(arena_id)] = [
+            player_team,
+            [[account_id, team] for account_id, team in players if account_id],
+            int(time.time())
+        ]
+        while len(self.open_battles) > ENCOUNTER_OPEN_MAX:
+            oldest = min(self.open_battles, key=lambda key: self.open_battles[key][2])
+            del self.open_battles[oldest]
+        self._save_open_battles()
+
+    @timed('storage.encounters', 'storage')
+    def record(self, arena_id, win):
+        """
+        Обновляет счетчики всех игроков боя одним проходом
+
+        Args:
+            arena_id: ID боя
+            win: True если команда игрока победила
+
+        Returns:
+            int: Сколько игроков обновлено (0, если результат отложен)
+        """
+        key = str(arena_id)
+        battle = self.open_battles.get(key)
+        if battle is None:
+            return 0
+
+        player_team, players = battle[0], battle[1]
+        if self.mapping is None or self.count + len(players) > self.capacity * ENCOUNTER_MAX_LOAD:
+            # Пересборка файла - только в ангаре (maintain)
+            battle[3:] = [bool(win)]
+            self._save_open_battles()
+            _metrics.incr('encounters.deferred')
+            return 0
+
+        del self.open_battles[key]
+        self._save_open_battles()
+        try:
+            mapping = self.mapping
+            now = int(time.time())
+            for account_id, team in players:
+                offset, found = _probe(mapping, self.bits, account_id)
+                if found:
+                    _, with_battles, with_wins, against_battles, against_wins, _ = \
+                        ENCOUNTER_RECORD.unpack_from(mapping, offset)
+                else:
+                    with_battles = with_wins = against_battles = against_wins = 0
+                    self.count += 1
+                if team == player_team:
+                    with_battles += 1
+                    with_wins += 1 if win else 0
+                else:
+                    against_battles += 1
+                    against_wins += 1 if win else 0
+                ENCOUNTER_RECORD.pack_into(mapping, offset, account_id, with_battles, with_wins,
+                                           against_battles, against_wins, now)
+            ENCOUNTER_HEADER.pack_into(mapping, 0, ENCOUNTER_MAGIC, ENCOUNTER_VERSION,
+                                       ENCOUNTER_RECORD.size, self.capacity, self.count)
+
+            # Страницы mmap сбрасываем на диск в потоке записи
+            _writer.submit_coalesced(self.path, self._flush)
+            _logger.debug("[WinChance] Encounters recorded for battle {}: {} players", arena_id, len(players))
+            return len(players)
+        except Exception as e:
+            err("[WinChance] Error recording encounters: {}".format(e))
+            return 0
+
+    @timed('storage.encounters_maintain')
+    def maintain(self):
+        """
+        Создает или увеличивает таблицу и фиксирует отложенные результаты
+
+        Вызывается из монитора только вне боя: пересборка переписывает
+        весь файл.
+
+        Returns:
+            bool: True если таблица пересобрана
+        """
+        deferred = [(key, battle) for key, battle in self.open_battles.items() if len(battle) > 3]
+        if self.mapping is None and not deferred:
+            return False
+        needed = self.count + sum(len(battle[1]) for _, battle in deferred) + ENCOUNTER_RESERVE
+        rebuilt = False
+        try:
+            if self.mapping is None or needed > self.capacity * ENCOUNTER_MAX_LOAD:
+                capacity = max(self.capacity, ENCOUNTER_INITIAL_CAPACITY)
+                while needed > capacity * ENCOUNTER_MAX_LOAD:
+                    capacity *= 2
+                self._rebuild(capacity)
+                rebuilt = True
+        except Exception as e:
+            err("[WinChance] Error resizing encounter index: {}".format(e))
+            return False
+        for key, battle in deferred:
+            self.record(key, battle[3])
+        return rebuilt
+
+    def _rebuild(self, capacity):
+        """Пересобирает файл с новой емкостью (рост таблицы)"""
+        bits = capacity.bit_length() - 1
+        buffer = bytearray(ENCOUNTER_HEADER.size + capacity * ENCOUNTER_RECORD.size)
+
+        mapping = self.mapping
+        if mapping is not None:
+            for index in range(self.capacity):
+                offset = ENCOUNTER_HEADER.size + index * ENCOUNTER_RECORD.size
+                account_id = ENCOUNTER_KEY.unpack_from(mapping, offset)[0]
+                if account_id:
+                    new_offset, _ = _probe(buffer, bits, account_id)
+                    buffer[new_offset:new_offset + ENCOUNTER_RECORD.size] = \
+                        mapping[offset:offset + ENCOUNTER_RECORD.size]
+        ENCOUNTER_HEADER.pack_into(buffer, 0, ENCOUNTER_MAGIC, ENCOUNTER_VERSION,
+                                   ENCOUNTER_RECORD.size, capacity, self.count)
+
+        cache_dir = os.path.dirname(self.path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(bytes(buffer))
+
+        # В Windows нельзя заменить файл, пока он отображен в память
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp_path, self.path)
+
+        self.file = open(self.path, 'r+b')
+        self.mapping = mmap.mmap(self.file.fileno(), 0)
+        self.bits = bits
+        log("[WinChance] Encounter index resized to {} slots".format(capacity))
+
+    def _flush(self):
+        """Сбрасывает изменения на диск (в потоке записи)"""
+        try:
+            with _metrics.timer('io.write.encounters'):
+                mapping = self.mapping
+                if mapping is not None:
+                    mapping.flush()
+        except (ValueError, EnvironmentError):
+            # Индекс закрыт или пересобран в основном потоке
+            pass
+
+    def _load_open_battles(self):
+        try:
+            if os.path.exists(self.open_file):
+                with open(self.open_file, 'r') as f:
+                    self.open_battles = json.load(f)
+        except Exception as e:
+            err("[WinChance] Error loading open encounter battles: {}".format(e))
+            self.open_battles = {}
+
+    def _save_open_battles(self):
+        _writer.submit_coalesced(self.open_file, self._write_open_battles, dict(self.open_battles))
+
+    def _write_open_battles(self, open_battles):
+        """Записывает составы незафиксированных боев (в потоке записи)"""
+        try:
+            cache_dir = os.path.dirname(self.open_file)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            with open(self.open_file, 'w') as f:
+                json.dump(open_battles, f, separators=(',', ':'))
+        except Exception as e:
+            err("[WinChance] Error saving open encounter battles: {}".format(e))
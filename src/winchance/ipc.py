@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Протокол обмена с процессом-компаньоном и неблокирующий клиент
+
+Кадр: 4 байта длины (big-endian) + JSON в UTF-8.
+  запрос:  {"id": 1, "op": "ping", "args": {...}}
+  ответ:   {"id": 1, "ok": true, "result": ...} или {"id": 1, "ok": false, "error": "..."}
+
+Модуль не зависит от игры - его же использует companion/winchance_companion.py.
+"""
+
+import json
+import errno
+import select
+import socket
+import struct
+import time
+
+PROTOCOL_VERSION = 1
+
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+
+# Пауза между попытками подключения к компаньону (сек)
+RECONNECT_INTERVAL = 5.0
+
+# Запросов в полете одновременно, сверх этого отправка идет без компаньона
+MAX_IN_FLIGHT = 256
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK))
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EALREADY) + _WOULD_BLOCK
+
+
+class ProtocolError(Exception):
+    """Нарушение формата кадра"""
+
+
+def encode_frame(message):
+    """
+    Кодирует сообщение в кадр
+
+    Args:
+        message: JSON-сериализуемый dict
+
+    Returns:
+        bytes: Длина + тело
+    """
+    body = json.dumps(message, separators=(',', ':'))
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    if len(body) > MAX_FRAME_SIZE:
+        raise ProtocolError("frame too large: {} bytes".format(len(body)))
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+class FrameDecoder(object):
+    """Собирает кадры из произвольных кусков потока"""
+
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, data):
+        """
+        Добавляет данные и возвращает все полностью принятые сообщения
+
+        Args:
+            data: Очередной кусок потока
+
+        Returns:
+            list: Декодированные сообщения
+        """
+        self.buffer += data
+        messages = []
+        while len(self.buffer) >= FRAME_HEADER.size:
+            size = FRAME_HEADER.unpack_from(self.buffer, 0)[0]
+            if size > MAX_FRAME_SIZE:
+                raise ProtocolError("frame too large: {} bytes".format(size))
+            end = FRAME_HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            body = self.buffer[FRAME_HEADER.size:end]
+            self.buffer = self.buffer[end:]
+            messages.append(json.loads(body.decode('utf-8')))
+        return messages
+
+
+class CompanionClient(object):
+    """
+    Неблокирующий клиент компаньона
+
+    Все операции выполняются в pump(), который вызывается из игрового цикла:
+    подключение, отправка накопленного, чтение ответов и вызов колбэков.
+    Пока соединения нет, send() возвращает False и вызывающий код
+    выполняет работу сам.
+    """
+
+    def __init__(self, host, port, timeout=10.0, clock=time.time):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.clock = clock
+        self.sock = None
+        self.connecting = False
+        self.connected = False
+        self.next_attempt = 0.0
+        self.out_buffer = b''
+        self.decoder = FrameDecoder()
+        self.next_id = 0
+        self.in_flight = {}  # id -> (deadline, callback, fallback)
+        self.last_error = None
+
+    def send(self, op, args=None, callback=None, fallback=None):
+        """
+        Отправляет запрос компаньону
+
+        Args:
+            op: Имя операции
+            args: Аргументы операции
+            callback: callback(ok, result_or_error) при ответе
+            fallback: Вызывается без аргументов, если ответа не будет
+                      (разрыв соединения или таймаут)
+
+        Returns:
+            bool: True, если запрос принят к отправке
+        """
+        if not self.connected or len(self.in_flight) >= MAX_IN_FLIGHT:
+            return False
+        self.next_id += 1
+        try:
+            frame = encode_frame({'id': self.next_id, 'op': op, 'args': args or {}})
+        except (ProtocolError, TypeError, ValueError):
+            return False
+        self.out_buffer += frame
+        self.in_flight[self.next_id] = (self.clock() + self.timeout, callback, fallback)
+        self._flush()
+        return True
+
+    def pump(self):
+        """Продвигает соединение без блокировки; вызывается из игрового цикла"""
+        if self.sock is None:
+            if self.clock() >= self.next_attempt:
+                self._connect()
+            return
+        if self.connecting:
+            self._check_connected()
+            return
+        self._flush()
+        self._read()
+        self._expire()
+
+    def close(self):
+        """Закрывает соединение; запросы в полете уходят в fallback"""
+        self._drop(None)
+
+    def _connect(self):
+        self.next_attempt = self.clock() + RECONNECT_INTERVAL
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            code = sock.connect_ex((self.host, self.port))
+        except socket.error:
+            return
+        if code not in (0,) + _IN_PROGRESS:
+            sock.close()
+            return
+        self.sock = sock
+        self.connecting = code != 0
+        if not self.connecting:
+            self._on_connected()
+
+    def _check_connected(self):
+        try:
+            _, writable, failed = select.select([], [self.sock], [self.sock], 0)
+        except (select.error, socket.error, ValueError):
+            self._drop(None)
+            return
+        if failed:
+            self._drop(None)
+        elif writable:
+            if self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                self._drop(None)
+            else:
+                self._on_connected()
+
+    def _on_connected(self):
+        self.connecting = False
+        self.connected = True
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error:
+            pass
+
+    def _flush(self):
+        while self.out_buffer and self.sock is not None:
+            try:
+                sent = self.sock.send(self.out_buffer)
+            except socket.error as e:
+                if e.args and e.args[0] in _WOULD_BLOCK:
+                    return
+                self._drop(e)
+                return
+            self.out_buffer = self.out_buffer[sent:]
+
+    def _read(self):
+        while self.sock is not None:
+            try:
+                data = self.sock.recv(65536)
+            except socket.error as e:
+                if e.args and e.args[0] in _WOULD_BLOCK:
+                    return
+                self._drop(e)
+                return
+            if not data:
+                self._drop(None)
+                return
+            try:
+                messages = self.decoder.feed(data)
+            except (ProtocolError, ValueError) as e:
+                self._drop(e)
+                return
+            for message in messages:
+                self._dispatch(message)
+
+    def _dispatch(self, message):
+        entry = self.in_flight.pop(message.get('id'), None)
+        if entry is None:
+            return
+        callback = entry[1]
+        if callback is not None:
+            if message.get('ok'):
+                callback(True, message.get('result'))
+            else:
+                callback(False, message.get('error'))
+
+    def _expire(self):
+        now = self.clock()
+        expired = [request_id for request_id, entry in self.in_flight.items() if entry[0] <= now]
+        for request_id in expired:
+            fallback = self.in_flight.pop(request_id)[2]
+            if fallback is not None:
+                fallback()
+
+    def _drop(self, error):
+        """Закрывает сокет и отдает запросы в полете в fallback"""
+        if self.connected and error is not None:
+            self.last_error = error
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+        self.sock = None
+        self.connecting = False
+        self.connected = False
+        self.out_buffer = b''
+        self.decoder = FrameDecoder()
+        pending, self.in_flight = self.in_flight, {}
+        for request_id in sorted(pending):
+            fallback = pending[request_id][2]
+            if fallback is not None:
+                fallback()
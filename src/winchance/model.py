@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Коэффициенты модели шанса на победу из внешнего файла
+"""
+
+import os
+import json
+import codecs
+
+from .core import CONFIG_POLL_INTERVAL, _metrics, err, log, perf_clock
+
+# Файл модели. Формат (все поля, кроме format и version, необязательны):
+# {
+#   "format": "winchance-model", "version": 1, "name": "2024-06",
+#   "k": 0.0005,                   - крутизна логистической кривой (на 1 WGR)
+#   "min_chance": 5.0, "max_chance": 95.0,
+#   "default_wgr": 5000,           - WGR игрока без статистики
+#   "base_wgr": 5000,              - WGR при винрейте 50%
+#   "wgr_per_winrate": 175,        - WGR за 1% винрейта сверх 50% (и за 1% разницы
+#                                    винрейта на текущем танке и общего)
+#   "confidence_battles": 100,     - до стольких боев оценка и поправка за танк ослаблены
+#   "wgr_min": 0, "wgr_max": 15000,
+#   "tier_weights": {"10": 1.2},   - вес игрока в среднем WGR команды по уровню
+#   "class_weights": {"SPG": 0.7}  - и по классу техники (теги heavyTank, SPG, ...)
+# }
+MODEL_PATH = './mods/configs/mod_winchance/model.json'
+MODEL_FORMAT = 'winchance-model'
+MODEL_VERSION = 1
+
+# Встроенные коэффициенты (используются, если файла нет или он отклонен)
+MODEL_DEFAULTS = {
+    'name': 'builtin',
+    'k': 0.0005,
+    'min_chance': 5.0,
+    'max_chance': 95.0,
+    'default_wgr': 5000,
+    'base_wgr': 5000,
+    'wgr_per_winrate': 175,
+    'confidence_battles': 100,
+    'wgr_min': 0,
+    'wgr_max': 15000,
+}
+
+
+class WinChanceModel(object):
+    """
+    Разобранная модель: коэффициенты и таблицы весов в готовом к расчету виде
+
+    Создается один раз при загрузке файла; в бою калькулятор только
+    читает атрибуты и делает поиск по словарям весов.
+    """
+
+    def __init__(self, data=None):
+        values = dict(MODEL_DEFAULTS)
+        values.update(data or {})
+
+        self.name = values['name']
+        self.k = float(values['k'])
+        self.min_chance = float(values['min_chance'])
+        self.max_chance = float(values['max_chance'])
+        self.default_wgr = float(values['default_wgr'])
+        self.base_wgr = float(values['base_wgr'])
+        self.wgr_per_winrate = float(values['wgr_per_winrate'])
+        self.confidence_battles = float(values['confidence_battles'])
+        self.wgr_min = float(values['wgr_min'])
+        self.wgr_max = float(values['wgr_max'])
+        if not self.min_chance <= self.max_chance or not self.wgr_min <= self.wgr_max:
+            raise ValueError('empty chance or WGR range')
+
+        # Ключи JSON - строки, уровни техники приводим к int
+        self.tier_weights = dict((int(tier), self._weight(value))
+                                 for tier, value in (values.get('tier_weights') or {}).items())
+        self.class_weights = dict((str(vehicle_class), self._weight(value))
+                                  for vehicle_class, value in (values.get('class_weights') or {}).items())
+        # Без таблиц веса всех игроков равны 1.0 и метаданные техники не нужны
+        self.weighted = bool(self.tier_weights or self.class_weights)
+
+    @staticmethod
+    def _weight(value):
+        weight = float(value)
+        if weight <= 0:
+            raise ValueError('weight must be positive: {}'.format(value))
+        return weight
+
+    def vehicle_weight(self, entry):
+        """
+        Вес игрока в среднем WGR команды
+
+        Args:
+            entry: Метаданные техники (VehicleInfoCache) или None
+
+        Returns:
+            float: Произведение весов уровня, класса и коэффициента танка
+        """
+        if not self.weighted or entry is None:
+            return 1.0
+        return (self.tier_weights.get(entry.get('tier'), 1.0) *
+                self.class_weights.get(entry.get('type'), 1.0) *
+                (entry.get('coef') or 1.0))
+
+
+class ModelFile(object):
+    """
+    Файл модели с перечитыванием по mtime
+
+    Файл читается при инициализации мода; check_reload вызывается из
+    монитора только в ангаре, поэтому модель не меняется посреди боя.
+    Файл с неизвестной версией формата или битыми значениями отклоняется,
+    продолжает работать предыдущая модель.
+    """
+
+    def __init__(self, path=MODEL_PATH):
+        self.path = path
+        self.model = WinChanceModel()
+        self.mtime = None
+        self.last_check = 0.0
+
+    def load(self):
+        """
+        Читает файл модели, если он изменился с прошлого чтения
+
+        Returns:
+            bool: True если загружена новая модель
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+
+        if mtime is None:
+            # Файл удален - возвращаемся к встроенным коэффициентам
+            if self.model.name == MODEL_DEFAULTS['name']:
+                return False
+            self.model = WinChanceModel()
+            log("[WinChance] Model file removed, using builtin model")
+            return True
+
+        try:
+            with codecs.open(self.path, 'r', 'utf-8-sig') as f:
+                data = json.load(f)
+            if data.get('format') != MODEL_FORMAT or data.get('version') != MODEL_VERSION:
+                raise ValueError('unsupported model format {} v{}'.format(data.get('format'), data.get('version')))
+            model = WinChanceModel(data)
+        except Exception as e:
+            # Битый файл не применяем - ждем исправления (новый mtime)
+            _metrics.incr('model.rejected')
+            err("[WinChance] Error loading model {}: {}".format(self.path, e))
+            return False
+
+        self.model = model
+        _metrics.incr('model.loads')
+        log("[WinChance] Model {} loaded (k={}, tiers: {}, classes: {})".format(
+            model.name, model.k, len(model.tier_weights), len(model.class_weights)))
+        return True
+
+    def check_reload(self):
+        """Проверяет mtime раз в CONFIG_POLL_INTERVAL (вызывать только вне боя)"""
+        now = perf_clock()
+        if now - self.last_check < CONFIG_POLL_INTERVAL:
+            return False
+        self.last_check = now
+        return self.load()
+
+
+_model_file = ModelFile()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Априорные шансы по карте, режиму и стороне спавна
+"""
+
+import os
+import json
+import math
+
+from .core import _logger, _metrics, _writer, err, log
+
+# Псевдо-бои с винрейтом 50%, которыми сглаживается статистика:
+# пока боев на карте мало, поправка остается около нуля
+PRIOR_STRENGTH = 50.0
+
+# Ограничение поправки свободного члена (|0.4| ~ +-10% при равных командах)
+PRIOR_MAX_INTERCEPT = 0.4
+
+
+class PriorTable(object):
+    """
+    Винрейт по (карта, режим, команда), накопленный по зафиксированным боям
+
+    Файл читается один раз при создании дисплея, дальше поправка
+    берется из словаря без обращения к диску. Результаты боев
+    добавляются по одному (record), запись на диск - в потоке записи.
+    """
+
+    def __init__(self, path='./mods/configs/mod_winchance/cache/priors.json'):
+        self.path = path
+        # (карта, режим, команда) -> [боев, побед]
+        self.counts = {}
+        # (карта, режим, команда) -> поправка свободного члена
+        self.intercepts = {}
+
+    def load(self):
+        """Загружает таблицу с диска"""
+        try:
+            if not os.path.exists(self.path):
+                return
+
+            with open(self.path, 'r') as f:
+                rows = json.load(f)
+
+            for map_name, mode, team, battles, wins in rows:
+                key = (map_name, mode, team)
+                self.counts[key] = [battles, wins]
+                self.intercepts[key] = self._intercept(battles, wins)
+
+            log("[WinChance] Win rate priors loaded: {} entries".format(len(self.counts)))
+        except Exception as e:
+            err("[WinChance] Error loading win rate priors: {}".format(e))
+            self.counts = {}
+            self.intercepts = {}
+
+    def intercept(self, map_name, mode, team):
+        """
+        Поправка свободного члена логистической модели
+
+        Returns:
+            float: log-odds победы на этой карте и стороне (0.0 если данных нет)
+        """
+        return self.intercepts.get((map_name, mode, team), 0.0)
+
+    def record(self, map_name, mode, team, win):
+        """
+        Добавляет результат зафиксированного боя
+
+        Args:
+            map_name: Имя карты
+            mode: Режим (gameplayName)
+            team: Команда игрока (сторона спавна)
+            win: True если команда игрока победила
+        """
+        if not map_name or map_name == 'Unknown' or not mode or team not in (1, 2):
+            return
+
+        key = (map_name, mode, team)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0, 0]
+        counts[0] += 1
+        counts[1] += 1 if win else 0
+        self.intercepts[key] = self._intercept(counts[0], counts[1])
+        _metrics.incr('priors.records')
+        _logger.debug("[WinChance] Prior {}: {}/{} -> {:.3f}", key, counts[1], counts[0], self.intercepts[key])
+
+        rows = [[key[0], key[1], key[2], value[0], value[1]] for key, value in sorted(self.counts.items())]
+        _writer.submit_coalesced(self.path, self._write_table, rows)
+
+    def _intercept(self, battles, wins):
+        """Сглаженный винрейт в log-odds"""
+        rate = (wins + PRIOR_STRENGTH * 0.5) / (battles + PRIOR_STRENGTH)
+        value = math.log(rate / (1.0 - rate))
+        return max(-PRIOR_MAX_INTERCEPT, min(PRIOR_MAX_INTERCEPT, value))
+
+    def _write_table(self, rows):
+        """Записывает таблицу на диск (в потоке записи)"""
+        try:
+            cache_dir = os.path.dirname(self.path)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            with _metrics.timer('io.write.priors'):
+                with open(self.path, 'w') as f:
+                    json.dump(rows, f, separators=(',', ':'))
+        except Exception as e:
+            err("[WinChance] Error saving win rate priors: {}".format(e))
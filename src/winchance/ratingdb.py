@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Офлайн-дамп рейтингов игроков (mmap + бинарный поиск)
+
+Импортируется, только если файл дампа существует.
+"""
+
+import os
+import mmap
+import struct
+
+from .core import err, log
+from .stats import StatsProvider
+
+# Формат файла офлайн-рейтингов (см. tools/build_rating_db.py):
+# заголовок <4sHHI (magic, version, record_size, count) и отсортированные
+# по accountDBID записи <QIII (accountDBID, wgr, wins, battles)
+RATING_DB_MAGIC = b'WCRD'
+RATING_DB_VERSION = 1
+RATING_DB_HEADER = struct.Struct('<4sHHI')
+RATING_DB_RECORD = struct.Struct('<QIII')
+RATING_DB_KEY = struct.Struct('<Q')
+
+
+class OfflineRatingDb(StatsProvider):
+    """
+    Статистика игроков из офлайн-дампа рейтингов
+    
+    Файл отображается в память через mmap и ищется бинарным поиском,
+    поэтому даже многомиллионный дамп не требует парсинга и почти не
+    занимает RAM.
+    """
+    
+    name = 'ratingdb'
+    
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.mapping = None
+        self.count = 0
+    
+    def open(self):
+        """
+        Открывает файл рейтингов
+        
+        Returns:
+            bool: True если файл найден и корректен
+        """
+        try:
+            if not os.path.exists(self.path):
+                return False
+            
+            self.file = open(self.path, 'rb')
+            self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            
+            magic, version, record_size, count = RATING_DB_HEADER.unpack_from(self.mapping, 0)
+            expected_size = RATING_DB_HEADER.size + count * RATING_DB_RECORD.size
+            if (magic != RATING_DB_MAGIC or version != RATING_DB_VERSION or
+                    record_size != RATING_DB_RECORD.size or len(self.mapping) < expected_size):
+                err("[WinChance] Invalid rating database: {}".format(self.path))
+                self.close()
+                return False
+            
+            self.count = count
+            log("[WinChance] Offline rating database opened: {} players".format(count))
+            return True
+            
+        except Exception as e:
+            err("[WinChance] Error opening rating database: {}".format(e))
+            self.close()
+            return False
+    
+    def get_stats(self, account_id, vehicle_cd=0):
+        """Ищет игрока бинарным поиском по accountDBID"""
+        if self.mapping is None or not account_id:
+            return None
+        
+        mapping = self.mapping
+        header_size = RATING_DB_HEADER.size
+        record_size = RATING_DB_RECORD.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key = RATING_DB_KEY.unpack_from(mapping, header_size + mid * record_size)[0]
+            if key < account_id:
+                lo = mid + 1
+            elif key > account_id:
+                hi = mid
+            else:
+                _, wgr, wins, battles = RATING_DB_RECORD.unpack_from(mapping, header_size + mid * record_size)
+                return {
+                    'wgr': wgr,
+                    'wins': wins,
+                    'battles': battles,
+                    'winrate': (wins * 100.0 / battles) if battles else 50.0
+                }
+        return None
+    
+    def close(self):
+        """Закрывает отображение файла"""
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except Exception:
+                pass
+            self.mapping = None
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+            self.file = None
+        self.count = 0
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Статистика игроков из REST-сервиса рейтингов
+
+Импортируется, только если сервис включен в конфиге API.
+"""
+
+import json
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from .api import _urlopen_measured
+from .core import _logger
+from .stats import StatsProvider
+
+class RemoteStatsProvider(StatsProvider):
+    """
+    Статистика игроков из REST-сервиса рейтингов
+    
+    Неизвестные accountDBID запрашиваются пачками (GET url?ids=1,2,3)
+    параллельно из небольшого пула потоков. Ответ - JSON вида
+    {"data": {"<accountDBID>": {"wgr": ..., "wins": ..., "battles": ...}}}.
+    Результаты складываются в словарь и подхватываются следующим
+    вызовом _get_players_data. Словарь живет один бой: полученная
+    статистика к тому времени уже сохранена в PlayerStatsCache.
+    """
+    
+    name = 'remote'
+    cacheable = True
+    
+    def __init__(self, config):
+        self.url = config.get('url')
+        self.batch_size = max(1, int(config.get('batch_size', 100)))
+        self.workers = max(1, int(config.get('workers', 4)))
+        self.timeout = float(config.get('timeout', 5))
+        self.batches = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        # accountDBID -> статистика текущего боя, заполняется рабочими потоками
+        self.results = {}
+        # accountDBID, уже запрошенные в этом бою
+        self.requested = set()
+        self.in_flight_batches = 0
+        # Номер боя: ответы на запросы прошлых боев отбрасываются
+        self.generation = 0
+    
+    def on_battle_start(self):
+        """Начинает новый бой: результаты и запросы прошлого боя сбрасываются"""
+        with self.lock:
+            self.generation += 1
+            self.results = {}
+        self.requested = set()
+    
+    def get_stats(self, account_id, vehicle_cd=0):
+        """Возвращает статистику игрока, если сервис её уже прислал"""
+        return self.results.get(account_id)
+    
+    def in_flight(self):
+        """Возвращает True, пока есть незавершенные запросы"""
+        return self.in_flight_batches > 0
+    
+    def request(self, account_ids):
+        """
+        Запрашивает статистику игроков, которых нет в XVM
+        
+        Args:
+            account_ids: accountDBID без живой статистики
+        """
+        ids = sorted(account_id for account_id in account_ids
+                     if account_id not in self.requested and account_id not in self.results)
+        if not ids or not self.url:
+            return
+        
+        self.requested.update(ids)
+        self._start_workers()
+        
+        for start in range(0, len(ids), self.batch_size):
+            with self.lock:
+                self.in_flight_batches += 1
+            self.batches.put((self.generation, ids[start:start + self.batch_size]))
+        
+        _logger.debug("[WinChance] Requested stats for {} players from rating service", len(ids))
+    
+    def close(self):
+        """Останавливает рабочие потоки"""
+        for _ in self.threads:
+            self.batches.put(None)
+        self.threads = []
+    
+    def _start_workers(self):
+        """Запускает пул потоков при первом запросе"""
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._run, name='WinChanceStats')
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+    
+    def _run(self):
+        """Цикл рабочего потока"""
+        while True:
+            job = self.batches.get()
+            if job is None:
+                break
+            try:
+                self._fetch(*job)
+            except Exception as e:
+                _logger.error("[WinChance] Rating service request failed: {}", e)
+            finally:
+                with self.lock:
+                    self.in_flight_batches -= 1
+    
+    def _fetch(self, generation, batch):
+        """Выполняет один запрос пачки и сохраняет результаты"""
+        separator = '&' if '?' in self.url else '?'
+        url = "{}{}ids={}".format(self.url, separator, ','.join(str(account_id) for account_id in batch))
+        response = _urlopen_measured('stats', url, timeout=self.timeout)
+        payload = json.loads(response.read())
+        data = payload.get('data', payload) if isinstance(payload, dict) else {}
+        
+        results = {}
+        for account_id, row in data.items():
+            if not isinstance(row, dict):
+                continue
+            wgr = row.get('wgr', 0)
+            wins = row.get('wins', row.get('w', 0))
+            battles = row.get('battles', row.get('b', 0))
+            if wgr or battles:
+                results[int(account_id)] = {
+                    'wgr': wgr,
+                    'wins': wins,
+                    'battles': battles,
+                    'winrate': (wins * 100.0 / battles) if battles else 50.0
+                }
+        
+        with self.lock:
+            if generation == self.generation:
+                self.results.update(results)
@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+"""
+Источники статистики игроков: XVM, кеш прошлых боев, метаданные техники
+"""
+
+import os
+import json
+import time
+import collections
+
+from .core import _logger, _metrics, _writer, battle, err, log
+
+class StatsProvider(object):
+    """
+    Источник статистики игроков для _get_players_data
+    
+    Провайдеры опрашиваются по порядку, первый ответ используется.
+    """
+    
+    # Короткое имя источника (PlayerRecord.source)
+    name = None
+    
+    # Сохранять ли ответы провайдера в PlayerStatsCache
+    cacheable = False
+    
+    def on_battle_start(self):
+        """Вызывается при старте нового боя"""
+        pass
+    
+    def prepare(self):
+        """Вызывается один раз перед серией запросов get_stats"""
+        pass
+    
+    def get_stats(self, account_id, vehicle_cd=0):
+        """
+        Возвращает статистику игрока
+        
+        Args:
+            account_id: accountDBID игрока
+            vehicle_cd: compactDescr техники игрока (0 - неизвестна)
+        
+        Returns:
+            dict: {'wgr', 'wins', 'battles', ...} или None
+        """
+        return None
+    
+    def close(self):
+        """Освобождает ресурсы провайдера"""
+        pass
+
+
+# Размер кеша статистики игроков и время жизни записи (сек)
+PLAYER_CACHE_MAX_SIZE = 5000
+PLAYER_CACHE_TTL = 7 * 24 * 3600
+
+
+class PlayerStatsCache(StatsProvider):
+    """LRU-кеш статистики игроков между боями (accountDBID -> wgr, wins, battles)"""
+    
+    name = 'cache'
+    
+    def __init__(self, max_size=PLAYER_CACHE_MAX_SIZE, ttl=PLAYER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_file = './mods/configs/mod_winchance/cache/player_stats.json'
+        # accountDBID -> (wgr, wins, battles, timestamp); порядок = порядок использования
+        self.entries = collections.OrderedDict()
+        self.dirty = False
+    
+    def load(self):
+        """Загружает кеш с диска, пропуская устаревшие записи"""
+        try:
+            if not os.path.exists(self.cache_file):
+                return
+            
+            with open(self.cache_file, 'r') as f:
+                rows = json.load(f)
+            
+            expire_before = time.time() - self.ttl
+            for account_id, wgr, wins, battles, timestamp in rows:
+                if timestamp >= expire_before:
+                    self.entries[account_id] = (wgr, wins, battles, timestamp)
+            
+            log("[WinChance] Player stats cache loaded: {} entries".format(len(self.entries)))
+        except Exception as e:
+            err("[WinChance] Error loading player stats cache: {}".format(e))
+            self.entries = collections.OrderedDict()
+    
+    def get_stats(self, account_id, vehicle_cd=0):
+        """
+        Возвращает статистику игрока из кеша
+        
+        Returns:
+            dict: Статистика в формате XVM-статистики или None
+        """
+        entry = self.entries.pop(account_id, None)
+        if entry is None:
+            return None
+        
+        if entry[3] < time.time() - self.ttl:
+            self.dirty = True
+            return None
+        
+        # Перемещаем в конец как недавно использованную
+        self.entries[account_id] = entry
+        wgr, wins, battles = entry[0], entry[1], entry[2]
+        return {
+            'wgr': wgr,
+            'wins': wins,
+            'battles': battles,
+            'winrate': (wins * 100.0 / battles) if battles else 50.0
+        }
+    
+    def put(self, account_id, stats):
+        """Сохраняет статистику игрока в кеш"""
+        wgr = stats.get('wgr', 0)
+        if not account_id or not wgr:
+            return
+        
+        self.entries.pop(account_id, None)
+        self.entries[account_id] = (wgr, stats.get('wins', 0), stats.get('battles', 0), int(time.time()))
+        self.dirty = True
+        
+        # Вытесняем самые давно использованные записи
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def save(self):
+        """Сохраняет кеш на диск в фоновом потоке (если были изменения)"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        
+        rows = [[account_id] + list(entry) for account_id, entry in self.entries.items()]
+        _writer.submit_coalesced(self.cache_file, self._write_cache, rows)
+    
+    def _write_cache(self, rows):
+        """Записывает кеш на диск (в потоке записи)"""
+        try:
+            cache_dir = os.path.dirname(self.cache_file)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            
+            with _metrics.timer('io.write.player_cache'):
+                with open(self.cache_file, 'w') as f:
+                    json.dump(rows, f, separators=(',', ':'))
+        except Exception as e:
+            err("[WinChance] Error saving player stats cache: {}".format(e))
+
+
+class VehicleInfoCache(object):
+    """
+    Метаданные техники по compactDescr (имя, уровень, класс, нация, коэффициент модели)
+    
+    Дескриптор разбирается один раз на танк, результат сохраняется между
+    сессиями и прогревается по ангару, поэтому в бою разбор не нужен.
+    """
+    
+    def __init__(self):
+        self.cache_file = './mods/configs/mod_winchance/cache/vehicles.json'
+        # compactDescr -> {'name', 'user_name', 'tier', 'type', 'nation', 'coef'}
+        self.entries = {}
+        self.dirty = False
+    
+    def load(self):
+        """Загружает кеш с диска"""
+        try:
+            if not os.path.exists(self.cache_file):
+                return
+            
+            with open(self.cache_file, 'r') as f:
+                rows = json.load(f)
+            
+            for vehicle_cd, name, user_name, tier, vehicle_class, nation, coef in rows:
+                self.entries[vehicle_cd] = {
+                    'name': name,
+                    'user_name': user_name,
+                    'tier': tier,
+                    'type': vehicle_class,
+                    'nation': nation,
+                    'coef': coef
+                }
+            
+            log("[WinChance] Vehicle info cache loaded: {} vehicles".format(len(self.entries)))
+        except Exception as e:
+            err("[WinChance] Error loading vehicle info cache: {}".format(e))
+            self.entries = {}
+    
+    def get(self, vehicle_cd):
+        """Возвращает метаданные техники или None"""
+        return self.entries.get(vehicle_cd)
+    
+    def describe(self, vehicle_descr):
+        """
+        Возвращает метаданные техники по дескриптору, разбирая его только для нового танка
+        
+        Args:
+            vehicle_descr: VehicleDescriptor (с полями type и level)
+            
+        Returns:
+            dict: Метаданные техники или None
+        """
+        vehicle_type = getattr(vehicle_descr, 'type', None)
+        if vehicle_type is None:
+            return None
+        
+        vehicle_cd = getattr(vehicle_type, 'compactDescr', 0)
+        entry = self.entries.get(vehicle_cd)
+        if entry is not None:
+            return entry
+        
+        # tags is a frozenset; ищем тег класса техники (heavyTank, mediumTank, SPG...)
+        tags_list = list(getattr(vehicle_type, 'tags', frozenset()))
+        vehicle_class = 'unknown'
+        for tag in tags_list:
+            if 'Tank' in tag or 'SPG' in tag:
+                vehicle_class = tag
+                break
+        if vehicle_class == 'unknown' and tags_list:
+            vehicle_class = tags_list[0]
+        
+        name = getattr(vehicle_type, 'name', '')
+        entry = {
+            'name': name,
+            'user_name': getattr(vehicle_type, 'userString', 'Unknown'),
+            'tier': getattr(vehicle_descr, 'level', 0) or getattr(vehicle_type, 'level', 0),
+            'type': vehicle_class,
+            'nation': name.split(':')[0] if ':' in name else 'unknown',
+            # Поправочный коэффициент танка для модели (1.0 - без поправки)
+            'coef': 1.0
+        }
+        if vehicle_cd:
+            self.entries[vehicle_cd] = entry
+            self.dirty = True
+        return entry
+    
+    def warm_from_hangar(self):
+        """
+        Разбирает технику из ангара игрока, которой еще нет в кеше
+        
+        Returns:
+            bool: True если ангар был доступен
+        """
+        try:
+            from helpers import dependency
+            from skeletons.gui.shared import IItemsCache
+            from gui.shared.utils.requesters import REQ_CRITERIA
+            
+            items_cache = dependency.instance(IItemsCache)
+            if not items_cache.isSynced():
+                return False
+            vehicles = items_cache.items.getVehicles(REQ_CRITERIA.INVENTORY)
+            
+            added = 0
+            for vehicle_cd, vehicle in vehicles.items():
+                if vehicle_cd not in self.entries:
+                    self.describe(vehicle.descriptor)
+                    added += 1
+            
+            if added:
+                log("[WinChance] Vehicle info cache warmed from hangar: {} new vehicles".format(added))
+                self.save()
+            return True
+        except Exception as e:
+            _logger.debug("[WinChance] Cannot warm vehicle info cache from hangar: {}", e)
+            return False
+    
+    def save(self):
+        """Сохраняет кеш на диск в фоновом потоке (если были изменения)"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        
+        rows = [[vehicle_cd, e['name'], e['user_name'], e['tier'], e['type'], e['nation'], e['coef']]
+                for vehicle_cd, e in self.entries.items()]
+        _writer.submit_coalesced(self.cache_file, self._write_cache, rows)
+    
+    def _write_cache(self, rows):
+        """Записывает кеш на диск (в потоке записи)"""
+        try:
+            cache_dir = os.path.dirname(self.cache_file)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            
+            with _metrics.timer('io.write.vehicle_cache'):
+                with open(self.cache_file, 'w') as f:
+                    json.dump(rows, f, separators=(',', ':'))
+        except Exception as e:
+            err("[WinChance] Error saving vehicle info cache: {}".format(e))
+
+
+class _XvmCacheBattleAccessor(object):
+    """Доступ к xvm_main.stats._stat.cacheBattle через индекс accountDBID -> vehCD"""
+    
+    def __init__(self, module, stat):
+        self.module = module
+        self.stat = stat
+        # Индекс ключей cacheBattle: accountDBID -> {vehCD (0 - без техники): ключ}.
+        # Храним ключи, а не данные: XVM заменяет значения на месте
+        self.index = {}
+        self.indexed_cache = None
+        self.indexed_size = -1
+    
+    def alive(self):
+        """True пока XVM не заменил объект статистики"""
+        return getattr(self.module, '_stat', None) is self.stat and hasattr(self.stat, 'cacheBattle')
+    
+    def prepare(self):
+        """
+        Строит индекс accountDBID -> vehCD -> данные по ключам cacheBattle
+        
+        Индекс перестраивается только когда XVM подменил или дополнил кеш
+        (объект доступа создается заново на каждый бой), поэтому поиск
+        игрока не перебирает ключи. Данные читаются из кеша при поиске.
+        """
+        cache = self.stat.cacheBattle
+        if cache is self.indexed_cache and len(cache) == self.indexed_size:
+            return
+        
+        index = {}
+        for cache_key in cache:
+            # Ключи вида "accountDBID=vehCD" или просто "accountDBID"
+            account, _, vehicle = str(cache_key).partition('=')
+            try:
+                account_id = int(account)
+                vehicle_cd = int(vehicle) if vehicle else 0
+            except ValueError:
+                continue
+            entries = index.get(account_id)
+            if entries is None:
+                entries = index[account_id] = {}
+            entries[vehicle_cd] = cache_key
+        
+        self.index = index
+        self.indexed_cache = cache
+        self.indexed_size = len(cache)
+        _logger.debug("[WinChance] Indexed XVM cacheBattle: {} accounts", len(index))
+    
+    def lookup(self, account_id, vehicle_cd):
+        """
+        Данные игрока из индекса cacheBattle
+        
+        Returns:
+            tuple: (данные XVM или None, True если это запись текущей техники -
+                   ее 'v' относится к танку игрока в этом бою)
+        """
+        entries = self.index.get(account_id)
+        if not entries:
+            return None, False
+        cache = self.stat.cacheBattle
+        if vehicle_cd and vehicle_cd in entries:
+            return cache.get(entries[vehicle_cd]), True
+        # Записи без техники или по другой технике: общая статистика в них та же
+        key = entries.get(0)
+        if key is None:
+            key = next(iter(entries.values()))
+        return cache.get(key), False
+
+
+class _XvmPlayersAccessor(object):
+    """Доступ к xvm_main.stats._stat.players (объекты _Player без статистики)"""
+    
+    def __init__(self, module, stat):
+        self.module = module
+        self.stat = stat
+    
+    def alive(self):
+        """True пока XVM не заменил объект статистики"""
+        return getattr(self.module, '_stat', None) is self.stat and hasattr(self.stat, 'players')
+    
+    def prepare(self):
+        pass
+    
+    def lookup(self, account_id, vehicle_cd):
+        # Это объекты _Player, реальные статы только в cacheBattle
+        return None, False
+
+
+class _XvmBattlePlayersDataAccessor(object):
+    """Доступ к battle.players_data (старые версии XVM)"""
+    
+    def alive(self):
+        """True пока battle.players_data не пуст"""
+        return bool(getattr(battle, 'players_data', None))
+    
+    def prepare(self):
+        pass
+    
+    def lookup(self, account_id, vehicle_cd):
+        return battle.players_data.get(account_id), False
+
+
+class XvmStatsProvider(StatsProvider):
+    """
+    Статистика игроков из кеша XVM
+    
+    Источник данных находится один раз на бой и сохраняется как объект
+    доступа; повторный поиск - только если источник исчез.
+    """
+    
+    name = 'xvm'
+    cacheable = True
+    
+    def __init__(self):
+        self.accessor = None
+    
+    def on_battle_start(self):
+        """Новый бой - источник ищется заново"""
+        self.accessor = None
+    
+    def prepare(self):
+        """Находит источник данных XVM перед опросом игроков"""
+        try:
+            if self.accessor is None or not self.accessor.alive():
+                self.accessor = self._find_xvm_data_source()
+            if self.accessor is not None:
+                self.accessor.prepare()
+        except Exception as e:
+            _logger.error("[WinChance] Error preparing XVM data source: {}", e)
+            self.accessor = None
+    
+    def get_stats(self, account_id, vehicle_cd=0):
+        """Возвращает статистику игрока из XVM"""
+        accessor = self.accessor
+        if accessor is None:
+            return None
+        try:
+            player_data, on_vehicle = accessor.lookup(account_id, vehicle_cd)
+            if player_data:
+                return self._extract_stats_from_xvm_data(player_data, on_vehicle)
+            return None
+        except Exception as e:
+            _logger.info("[WinChance] Error getting XVM stats for account {}: {}", account_id, e)
+            import traceback
+            _logger.error("{}", traceback.format_exc())
+            return None
+    
+    def _find_xvm_data_source(self):
+        """
+        Находит источник данных XVM
+        
+        Returns:
+            Объект доступа (alive/prepare/lookup) или None
+        """
+        try:
+            # Метод 1: xvm_main.stats._stat (ПРАВИЛЬНЫЙ СПОСОБ для XVM v13!)
+            try:
+                import xvm_main.stats as xvm_stats
+                stat = getattr(xvm_stats, '_stat', None)
+                if stat is not None:
+                    # Проверяем cacheBattle
+                    if hasattr(stat, 'cacheBattle'):
+                        _logger.debug("[WinChance] Found xvm_main.stats._stat.cacheBattle")
+                        return _XvmCacheBattleAccessor(xvm_stats, stat)
+                    # Проверяем players
+                    if hasattr(stat, 'players'):
+                        _logger.debug("[WinChance] Found xvm_main.stats._stat.players")
+                        return _XvmPlayersAccessor(xvm_stats, stat)
+            except Exception as e:
+                _logger.debug("[WinChance] Error accessing xvm_main.stats._stat: {}", e)
+            
+            # Метод 2: battle.players_data
+            if getattr(battle, 'players_data', None):
+                _logger.debug("[WinChance] Found XVM data in battle.players_data")
+                return _XvmBattlePlayersDataAccessor()
+            
+            _logger.debug("[WinChance] No XVM data source found")
+            return None
+            
+        except Exception as e:
+            _logger.error("[WinChance] Error finding XVM data source: {}", e)
+            import traceback
+            _logger.error("{}", traceback.format_exc())
+            return None
+    
+    def _extract_stats_from_xvm_data(self, player_data, on_vehicle=False):
+        """
+        Извлекает статистику из данных XVM
+        
+        Args:
+            player_data: Данные игрока XVM
+            on_vehicle: Данные взяты по текущей технике игрока - тогда
+                статистика на ней ('v': бои и победы) тоже используется
+        """
+        try:
+            # XVM может хранить данные в разных форматах
+            # Пробуем разные варианты
+            
+            stats = {}
+            
+            # Вариант 1: Прямые поля
+            if isinstance(player_data, dict):
+                stats['wgr'] = player_data.get('wgr', player_data.get('WGR', 0))
+                stats['xwgr'] = player_data.get('xwgr', player_data.get('XWGR', 0))
+                stats['wins'] = player_data.get('w', player_data.get('wins', 0))
+                stats['battles'] = player_data.get('b', player_data.get('battles', 0))
+                stats['winrate'] = player_data.get('wr', player_data.get('winrate', 0))
+                vehicle = player_data.get('v') if on_vehicle else None
+                if isinstance(vehicle, dict) and vehicle.get('b'):
+                    stats['vehicle_battles'] = vehicle.get('b', 0)
+                    stats['vehicle_wins'] = vehicle.get('w', 0)
+            
+            # Вариант 2: Вложенная структура
+            elif hasattr(player_data, 'stats'):
+                xvm_stats = player_data.stats
+                stats['wgr'] = getattr(xvm_stats, 'wgr', 0)
+                stats['wins'] = getattr(xvm_stats, 'w', 0)
+                stats['battles'] = getattr(xvm_stats, 'b', 0)
+            
+            # Проверяем, что получили хоть что-то полезное. Без WGR
+            # оставляем 0 - калькулятор оценит его по винрейту по модели
+            if stats.get('wgr', 0) > 0 or stats.get('battles', 0) > 0:
+                return stats
+            
+            return None
+            
+        except Exception as e:
+            _logger.debug("[WinChance] Error extracting stats: {}", e)
+            return None
@@ -0,0 +1,535 @@
+# -*- coding: utf-8 -*-
+"""
+Логи предсказаний и фактических результатов боев
+"""
+
+import os
+import json
+import codecs
+import time
+import collections
+
+from .core import (API_CONFIG, _logger, _metrics, _watchdog, _writer, err,
+                   get_current_time, log, timed)
+
+class BattleResultLogger(object):
+    """Класс для логирования фактических результатов боев"""
+    
+    def __init__(self):
+        self.log_dir = './mods/configs/mod_winchance/logs'
+        self.results_file = os.path.join(self.log_dir, 'battle_results.csv')
+        self.results_json = os.path.join(self.log_dir, 'battle_results.json')
+        self.pending_file = os.path.join(self.log_dir, 'pending_battles.json')
+        self.ensure_log_directory()
+        
+        # Храним данные ожидающих боев: {arena_id: battle_data}
+        self.pending_battles = {}
+        # Байтовые маркеры arena_id ожидающих боев для быстрой проверки (см. may_be_pending)
+        self._pending_markers = None
+        self._load_pending_battles()
+        
+    def ensure_log_directory(self):
+        """Создает директорию для логов если её нет"""
+        try:
+            if not os.path.exists(self.log_dir):
+                os.makedirs(self.log_dir)
+                log("[WinChance] Created results log directory: {}".format(self.log_dir))
+        except Exception as e:
+            err("[WinChance] Error creating results log directory: {}".format(e))
+
+    def _load_pending_battles(self):
+        """Загружает список ожидающих боев из файла"""
+        try:
+            if os.path.exists(self.pending_file):
+                with open(self.pending_file, 'r') as f:
+                    content = f.read()
+                    if content:
+                        self.pending_battles = json.loads(content)
+                        _metrics.set_gauge('pending.count', len(self.pending_battles))
+                        log("[WinChance] Loaded {} pending battles from storage".format(len(self.pending_battles)))
+            else:
+                self.pending_battles = {}
+        except Exception as e:
+            err("[WinChance] Error loading pending battles: {}".format(e))
+            self.pending_battles = {}
+
+    @timed('storage.save_pending', 'storage')
+    def _save_pending_battles_to_file(self):
+        """Сохраняет список ожидающих боев в файл"""
+        _metrics.set_gauge('pending.count', len(self.pending_battles))
+        self._pending_markers = None
+        
+        # Запись идет в фоновом потоке; в экономном режиме - после выхода в ангар
+        _watchdog.run_or_defer('storage', _writer.submit_coalesced, self.pending_file,
+                               self._write_pending_battles, dict(self.pending_battles))
+
+    def _write_pending_battles(self, pending_battles):
+        """Записывает снимок ожидающих боев на диск (в потоке записи)"""
+        try:
+            with _metrics.timer('io.write.pending_battles'):
+                with open(self.pending_file, 'w') as f:
+                    json.dump(pending_battles, f, indent=2)
+        except Exception as e:
+            err("[WinChance] Error saving pending battles: {}".format(e))
+
+    @timed('storage.save_prediction')
+    def save_prediction(self, battle_data, battle_info=None):
+        """
+        Сохраняет предсказание для текущего боя
+        
+        Args:
+            battle_data: Данные боя с предсказанием (battle_id - arenaUniqueID)
+            battle_info: Поля боя для API (BattleStatsCollector.battle_info) -
+                по ним формируется результат, полученный в ангаре
+        """
+        try:
+            arena_id = str(battle_data.get('battle_id', ''))
+            if not arena_id or arena_id == 'Unknown':
+                return
+
+            pending = battle_data.copy()
+            pending['battle_info'] = battle_info
+            self.pending_battles[arena_id] = pending
+            self._save_pending_battles_to_file()
+            
+            log("[WinChance] Prediction saved for battle {} (Total pending: {})".format(
+                arena_id, len(self.pending_battles)))
+        except Exception as e:
+            err("[WinChance] Error saving prediction: {}".format(e))
+
+    def may_be_pending(self, result):
+        """
+        Быстрая проверка без распаковки: может ли результат боя относиться к ожидающему бою
+        
+        Для pickle-строки ищется arena_id в текстовом (протокол 0) и
+        двоичном little-endian виде. Ложные срабатывания допустимы,
+        пропуск ожидающего боя - нет.
+        
+        Args:
+            result: Результат боя (pickle-строка или dict)
+            
+        Returns:
+            bool: False если результат точно не нужен
+        """
+        if not self.pending_battles:
+            return False
+        
+        if isinstance(result, dict):
+            return str(result.get('arenaUniqueId')) in self.pending_battles
+        if not isinstance(result, (str, bytes)):
+            return True
+        
+        if self._pending_markers is None:
+            markers = []
+            for arena_id in self.pending_battles:
+                markers.append(arena_id.encode('ascii'))
+                try:
+                    value = int(arena_id)
+                except ValueError:
+                    continue
+                packed = bytearray()
+                while value > 0:
+                    packed.append(value & 0xff)
+                    value >>= 8
+                if packed:
+                    markers.append(bytes(packed))
+            self._pending_markers = markers
+        
+        for marker in self._pending_markers:
+            if marker in result:
+                return True
+        return False
+    
+    def get_pending_battle(self, arena_id):
+        """Возвращает данные ожидающего боя по ID"""
+        return self.pending_battles.get(str(arena_id))
+
+    def remove_pending_battle(self, arena_id):
+        """Удаляет бой из списка ожидающих"""
+        if str(arena_id) in self.pending_battles:
+            del self.pending_battles[str(arena_id)]
+            self._save_pending_battles_to_file()
+    
+    @timed('storage.save_result', 'storage')
+    def save_result(self, battle_id, win, team_result, personal_result, keep_pending=False):
+        """
+        Сохраняет фактический результат боя
+        
+        Args:
+            battle_id: ID боя
+            win: True если победа, False если поражение
+            team_result: Результат команды (1=победа, 2=поражение, 3=ничья)
+            personal_result: Личный результат игрока
+            keep_pending: Не удалять бой из ожидающих (ждем результаты из ангара)
+        """
+        try:
+            pending_battle = self.get_pending_battle(battle_id)
+            if pending_battle is None:
+                log("[WinChance] No pending battle data found for result logging (ID: {})".format(battle_id))
+                return
+            
+            # Время окончания боя
+            end_time = get_current_time()
+            
+            # Формируем полные данные результата
+            result_data = pending_battle.copy()
+            result_data['end_time'] = end_time
+            result_data['victory'] = win
+            result_data['team_result'] = team_result
+            result_data['personal_result'] = personal_result
+            
+            # Рассчитываем точность предсказания
+            predicted_win = result_data.get('win_chance', 50) >= 50
+            result_data['prediction_correct'] = (predicted_win == win)
+            result_data['prediction_error'] = abs(result_data.get('win_chance', 50) - (100 if win else 0))
+            
+            # Сохраняем в CSV и JSON в фоновом потоке (в экономном режиме - после выхода в ангар)
+            _watchdog.run_or_defer('storage', _writer.submit, self._write_result_files, result_data)
+            
+            log("[WinChance] Battle result saved: Battle ID={}, Victory={}, Predicted={:.1f}%".format(
+                battle_id, win, result_data.get('win_chance', 0)))
+            
+            # Удаляем из ожидающих
+            if not keep_pending:
+                self.remove_pending_battle(battle_id)
+            
+        except Exception as e:
+            err("[WinChance] Error saving battle result: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+    
+    def _write_result_files(self, result_data):
+        """Записывает результат боя в CSV и JSON (в потоке записи)"""
+        with _metrics.timer('io.write.results_csv'):
+            self._save_result_to_csv(result_data)
+        with _metrics.timer('io.write.results_json'):
+            self._save_result_to_json(result_data)
+    
+    def _save_result_to_csv(self, result_data):
+        """Сохраняет результат в CSV файл"""
+        try:
+            file_exists = os.path.exists(self.results_file)
+            
+            with codecs.open(self.results_file, 'a', encoding='utf-8') as f:
+                # Заголовок
+                if not file_exists:
+                    f.write('Battle_ID,Start_Time,End_Time,Player_Name,Vehicle_Name,'
+                           'Win_Chance,Ally_WGR,Enemy_WGR,Victory,Team_Result,'
+                           'Prediction_Correct,Prediction_Error\n')
+                
+                # Данные
+                line = '{},{},{},{},{},{:.1f},{:.0f},{:.0f},{},{},{},{:.1f}\n'.format(
+                    result_data.get('battle_id', ''),
+                    result_data.get('start_time', ''),
+                    result_data.get('end_time', ''),
+                    result_data.get('player_name', ''),
+                    result_data.get('player_vehicle_name', ''),
+                    result_data.get('win_chance', 0),
+                    result_data.get('ally_wgr', 0),
+                    result_data.get('enemy_wgr', 0),
+                    'Win' if result_data.get('victory', False) else 'Loss',
+                    result_data.get('team_result', 0),
+                    'Yes' if result_data.get('prediction_correct', False) else 'No',
+                    result_data.get('prediction_error', 0)
+                )
+                f.write(line)
+            
+            _logger.debug("[WinChance] Result logged to CSV: {}", self.results_file)
+            
+        except Exception as e:
+            err("[WinChance] Error writing result to CSV: {}".format(e))
+    
+    def _save_result_to_json(self, result_data):
+        """Сохраняет результат в JSON файл"""
+        try:
+            # Загружаем существующие данные
+            results = []
+            if os.path.exists(self.results_json):
+                try:
+                    with codecs.open(self.results_json, 'r', encoding='utf-8') as f:
+                        results = json.load(f)
+                except:
+                    results = []
+            
+            # Добавляем новый результат
+            results.append(result_data)
+            
+            # Сохраняем обратно
+            with codecs.open(self.results_json, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            
+            _logger.debug("[WinChance] Result logged to JSON: {}", self.results_json)
+            
+        except Exception as e:
+            err("[WinChance] Error writing result to JSON: {}".format(e))
+
+
+# Сколько последних зафиксированных боев помнить
+FINALIZED_ARENAS_MAX = 500
+
+# Поля личного результата, которые результаты из ангара уточняют
+# у уже отправленного боя (остальные поля знает только путь по арене)
+HANGAR_MERGE_FIELDS = ('DamageDealt', 'DamageAssisted', 'DamageBlocked', 'Kills', 'Spotted',
+                       'Experience', 'Credits', 'Shots', 'Hits', 'Penetrations')
+
+
+def _merge_fields(api_data):
+    """Отправленные значения полей личного результата (то, с чем сравнивает _merge)"""
+    if not api_data:
+        return {}
+    return dict((field, api_data[field]) for field in HANGAR_MERGE_FIELDS if field in api_data)
+
+
+class ResultPipeline(object):
+    """
+    Единая точка фиксации результата боя (по арене и по результатам из ангара)
+    
+    Каждый бой фиксируется один раз: строка в логе результатов и полная
+    отправка в API. Более поздние и более полные данные из ангара
+    отправляются как обновление только измененных полей. Множество
+    зафиксированных боев ограничено и сохраняется между сессиями вместе
+    с отправленными значениями полей личного результата.
+    """
+    
+    def __init__(self, result_logger, encounters=None, priors=None, tank_stats=None,
+                 max_size=FINALIZED_ARENAS_MAX):
+        self.result_logger = result_logger
+        self.encounters = encounters
+        self.priors = priors
+        self.tank_stats = tank_stats
+        self.max_size = max_size
+        self.finalized_file = os.path.join(result_logger.log_dir, 'finalized_arenas.json')
+        # str(arena_id) -> отправленные в API поля HANGAR_MERGE_FIELDS; порядок = порядок фиксации
+        self.finalized = collections.OrderedDict()
+    
+    def load(self):
+        """Загружает список зафиксированных боев"""
+        try:
+            if not os.path.exists(self.finalized_file):
+                return
+            with open(self.finalized_file, 'r') as f:
+                for entry in json.load(f)[-self.max_size:]:
+                    # Старый формат - только ID боя
+                    if isinstance(entry, list):
+                        self.finalized[str(entry[0])] = dict(entry[1])
+                    else:
+                        self.finalized[str(entry)] = {}
+            log("[WinChance] Loaded {} finalized battles".format(len(self.finalized)))
+        except Exception as e:
+            err("[WinChance] Error loading finalized battles: {}".format(e))
+            self.finalized = collections.OrderedDict()
+    
+    def is_finalized(self, arena_id):
+        """True если результат боя уже зафиксирован"""
+        return str(arena_id) in self.finalized
+    
+    def finalize(self, arena_id, win, team_result, api_data, from_hangar=False):
+        """
+        Фиксирует результат боя или дополняет уже зафиксированный
+        
+        Args:
+            arena_id: ID боя
+            win: True если победа
+            team_result: Результат команды
+            api_data: Данные боя для API (или None)
+            from_hangar: Результат из ангара (окончательный, бой больше не ждем)
+            
+        Returns:
+            bool: True если бой зафиксирован этим вызовом
+        """
+        key = str(arena_id)
+        # Статистику танка ведем только по личным результатам из ангара,
+        # один раз на бой: пока бой ожидает результатов, он еще не учтен
+        if from_hangar and self.result_logger.get_pending_battle(key) is not None:
+            self._add_tank_stats(api_data)
+        
+        if key in self.finalized:
+            _metrics.incr('results.duplicates')
+            self._merge(key, api_data)
+            if from_hangar:
+                self.result_logger.remove_pending_battle(key)
+            return False
+        
+        self.finalized[key] = _merge_fields(api_data)
+        while len(self.finalized) > self.max_size:
+            evicted, _ = self.finalized.popitem(last=False)
+            self.result_logger.remove_pending_battle(evicted)
+        self._save()
+        
+        # Бой, зафиксированный по арене, остается ожидающим до результатов из ангара
+        self.result_logger.save_result(arena_id, win, team_result, "Win" if win else "Loss",
+                                       keep_pending=not from_hangar)
+        if self.encounters is not None:
+            self.encounters.record(arena_id, win)
+        # Ничьи в априорный винрейт не входят
+        if self.priors is not None and api_data and team_result in (1, 2):
+            self.priors.record(api_data.get('MapName'), api_data.get('BattleType'), api_data.get('Team'), win)
+        if api_data:
+            from . import api
+            self._dispatch('send_battle', api._send_battle_request, api_data)
+        return True
+    
+    def _merge(self, key, api_data):
+        """Отправляет в API только поля личного результата, изменившиеся с прошлой отправки"""
+        if not api_data:
+            return
+        sent = self.finalized[key]
+        changes = dict((field, api_data[field]) for field in HANGAR_MERGE_FIELDS
+                       if field in api_data and sent.get(field) != api_data[field])
+        if not changes:
+            return
+        sent.update(changes)
+        self._save()
+        from . import api
+        if not api.battle_updates_supported():
+            return
+        _logger.info("[WinChance] Merging {} updated fields into finalized battle {}", len(changes), key)
+        self._dispatch('send_battle_update', api._send_battle_update_request, key, changes)
+    
+    def _add_tank_stats(self, api_data):
+        """Учитывает бой в статистике танка (данные из ангара)"""
+        if self.tank_stats is not None and api_data:
+            self.tank_stats.add(api_data)
+    
+    def _dispatch(self, offload, request_func, *args):
+        """
+        Отправляет запрос в API через компаньон или в фоновом потоке
+        
+        Args:
+            offload: Имя функции модуля companion для передачи запроса компаньону
+            request_func: HTTP-запрос для фонового потока
+        """
+        if not API_CONFIG['enabled'] or not API_CONFIG.get('token'):
+            return
+        from . import api
+        api.dispatch_request(offload, request_func, *args)
+    
+    def _save(self):
+        """Сохраняет список зафиксированных боев (в потоке записи)"""
+        entries = [[key, dict(sent)] for key, sent in self.finalized.items()]
+        _watchdog.run_or_defer('storage', _writer.submit_coalesced, self.finalized_file,
+                               self._write_finalized, entries)
+    
+    def _write_finalized(self, entries):
+        """Записывает зафиксированные бои ([ID, отправленные поля]) на диск (в потоке записи)"""
+        try:
+            with _metrics.timer('io.write.finalized'):
+                with open(self.finalized_file, 'w') as f:
+                    json.dump(entries, f, separators=(',', ':'))
+        except Exception as e:
+            err("[WinChance] Error saving finalized battles: {}".format(e))
+
+
+class BattleLogger(object):
+    """Класс для логирования результатов боев"""
+    
+    def __init__(self):
+        self.log_dir = './mods/configs/mod_winchance/logs'
+        self.ensure_log_directory()
+        
+    def ensure_log_directory(self):
+        """Создает директорию для логов если её нет"""
+        try:
+            if not os.path.exists(self.log_dir):
+                os.makedirs(self.log_dir)
+                log("[WinChance] Created log directory: {}".format(self.log_dir))
+        except Exception as e:
+            err("[WinChance] Error creating log directory: {}".format(e))
+    
+    @timed('storage.log_battle', 'storage')
+    def log_battle_result(self, battle_data):
+        """
+        Записывает результаты боя в файл
+        
+        Args:
+            battle_data: Словарь с данными боя
+                - battle_id: ID боя
+                - start_time: Время начала боя
+                - player_vehicle_id: ID танка игрока
+                - player_vehicle_name: Название танка игрока
+                - player_name: Имя игрока
+                - win_chance: Шанс на победу (%)
+                - ally_wgr: WGR союзников
+                - enemy_wgr: WGR противников
+        """
+        # Запись идет в фоновом потоке; в экономном режиме - после выхода в ангар
+        _watchdog.run_or_defer('storage', _writer.submit, self._write_battle_result, dict(battle_data))
+    
+    def _write_battle_result(self, battle_data):
+        """Записывает результаты боя в JSON и CSV (в потоке записи)"""
+        try:
+            # Записываем в JSON файл (один файл на день)
+            with _metrics.timer('io.write.battles_json'):
+                self._log_to_json(battle_data)
+            
+            # Также записываем в CSV для удобства анализа
+            with _metrics.timer('io.write.battles_csv'):
+                self._log_to_csv(battle_data)
+            
+            log("[WinChance] Battle result logged: Battle ID={}, Win Chance={:.1f}%".format(
+                battle_data.get('battle_id', 'Unknown'),
+                battle_data.get('win_chance', 0)))
+            
+        except Exception as e:
+            err("[WinChance] Error logging battle result: {}".format(e))
+            import traceback
+            err(traceback.format_exc())
+    
+    def _log_to_json(self, battle_data):
+        """Записывает данные в JSON файл"""
+        try:
+            # Имя файла на основе даты
+            date_str = time.strftime('%Y-%m-%d', time.localtime())
+            json_file = os.path.join(self.log_dir, 'battles_{}.json'.format(date_str))
+            
+            # Загружаем существующие данные или создаем новый список
+            battles = []
+            if os.path.exists(json_file):
+                try:
+                    with codecs.open(json_file, 'r', encoding='utf-8') as f:
+                        battles = json.load(f)
+                except:
+                    battles = []
+            
+            # Добавляем новую запись
+            battles.append(battle_data)
+            
+            # Сохраняем обратно
+            with codecs.open(json_file, 'w', encoding='utf-8') as f:
+                json.dump(battles, f, ensure_ascii=False, indent=2)
+            
+            _logger.debug("[WinChance] Logged to JSON: {}", json_file)
+            
+        except Exception as e:
+            err("[WinChance] Error writing to JSON: {}".format(e))
+    
+    def _log_to_csv(self, battle_data):
+        """Записывает данные в CSV файл"""
+        try:
+            csv_file = os.path.join(self.log_dir, 'battles.csv')
+            
+            # Проверяем, существует ли файл (для заголовков)
+            file_exists = os.path.exists(csv_file)
+            
+            with codecs.open(csv_file, 'a', encoding='utf-8') as f:
+                # Записываем заголовок если файл новый
+                if not file_exists:
+                    f.write('Battle_ID,Start_Time,Player_Name,Vehicle_ID,Vehicle_Name,Win_Chance,Ally_WGR,Enemy_WGR\n')
+                
+                # Записываем данные
+                line = '{},{},{},{},{},{:.1f},{:.0f},{:.0f}\n'.format(
+                    battle_data.get('battle_id', ''),
+                    battle_data.get('start_time', ''),
+                    battle_data.get('player_name', ''),
+                    battle_data.get('player_vehicle_id', ''),
+                    battle_data.get('player_vehicle_name', ''),
+                    battle_data.get('win_chance', 0),
+                    battle_data.get('ally_wgr', 0),
+                    battle_data.get('enemy_wgr', 0)
+                )
+                f.write(line)
+            
+            _logger.debug("[WinChance] Logged to CSV: {}", csv_file)
+            
+        except Exception as e:
+            err("[WinChance] Error writing to CSV: {}".format(e))
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Накопительная статистика игрока по танкам
+"""
+
+import os
+import json
+
+from .core import _metrics, _writer, err, log
+
+# Показатели боя из данных для API, по которым ведутся суммы и суммы квадратов
+TANK_STATS_FIELDS = ('DamageDealt', 'DamageAssisted', 'DamageBlocked', 'Kills',
+                     'Spotted', 'Shots', 'Hits', 'Penetrations')
+
+# Версия файла: в версии 1 бои учитывались по арене с нулевыми показателями
+TANK_STATS_VERSION = 2
+
+# Строка агрегата: [боев, побед, поражений, сумма_1, сумма квадратов_1, ...]
+_BATTLES, _WINS, _LOSSES, _SUMS = 0, 1, 2, 3
+
+
+class TankStatsStore(object):
+    """
+    Средние и дисперсии показателей игрока по каждому танку
+
+    Агрегаты обновляются за O(1) при получении результатов боя в ангаре
+    (личные показатели есть только там) и никогда не пересчитываются по
+    логам.
+    """
+
+    def __init__(self, path='./mods/configs/mod_winchance/cache/tank_stats.json'):
+        self.path = path
+        # TankId -> имя танка
+        self.names = {}
+        # TankId -> строка агрегата
+        self.rows = {}
+
+    def load(self):
+        """Загружает агрегаты с диска"""
+        try:
+            if not os.path.exists(self.path):
+                return
+
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+
+            # Набор показателей или версия изменились - старые суммы несопоставимы
+            if (tuple(data.get('fields', ())) != TANK_STATS_FIELDS or
+                    data.get('version', 1) != TANK_STATS_VERSION):
+                log("[WinChance] Tank stats format changed, starting over")
+                return
+
+            for row in data.get('tanks', []):
+                tank_id = row[0]
+                self.names[tank_id] = row[1]
+                self.rows[tank_id] = row[2:]
+
+            log("[WinChance] Tank stats loaded: {} tanks".format(len(self.rows)))
+        except Exception as e:
+            err("[WinChance] Error loading tank stats: {}".format(e))
+            self.names = {}
+            self.rows = {}
+
+    def add(self, api_data):
+        """
+        Добавляет бой в агрегаты его танка
+
+        Args:
+            api_data: Данные боя в формате API (Tank, Result, показатели)
+        """
+        if self._apply(api_data):
+            self._save()
+
+    def get(self, tank_id):
+        """
+        Средние и дисперсии показателей по танку
+
+        Args:
+            tank_id: compactDescr танка
+
+        Returns:
+            dict: {'name', 'battles', 'wins', 'losses', 'win_rate',
+                   'avg': {показатель: среднее}, 'var': {показатель: дисперсия}}
+                  или None если боев на танке нет
+        """
+        row = self.rows.get(tank_id)
+        if not row or row[_BATTLES] <= 0:
+            return None
+
+        battles = float(row[_BATTLES])
+        avg = {}
+        var = {}
+        for index, field in enumerate(TANK_STATS_FIELDS):
+            total = row[_SUMS + index * 2]
+            squares = row[_SUMS + index * 2 + 1]
+            mean = total / battles
+            avg[field] = mean
+            var[field] = max(0.0, squares / battles - mean * mean)
+
+        return {
+            'name': self.names.get(tank_id),
+            'battles': row[_BATTLES],
+            'wins': row[_WINS],
+            'losses': row[_LOSSES],
+            'win_rate': row[_WINS] * 100.0 / battles,
+            'avg': avg,
+            'var': var
+        }
+
+    def _apply(self, api_data):
+        """
+        Добавляет вклад боя
+
+        Returns:
+            bool: True если агрегаты изменились
+        """
+        tank = (api_data or {}).get('Tank') or {}
+        tank_id = tank.get('TankId')
+        if not tank_id:
+            return False
+
+        row = self.rows.get(tank_id)
+        if row is None:
+            row = self.rows[tank_id] = [0] * (_SUMS + 2 * len(TANK_STATS_FIELDS))
+        if tank.get('Name'):
+            self.names[tank_id] = tank['Name']
+
+        result = api_data.get('Result')
+        row[_BATTLES] += 1
+        if result == 'win':
+            row[_WINS] += 1
+        elif result == 'lose':
+            row[_LOSSES] += 1
+
+        for index, field in enumerate(TANK_STATS_FIELDS):
+            value = api_data.get(field) or 0
+            row[_SUMS + index * 2] += value
+            row[_SUMS + index * 2 + 1] += value * value
+        return True
+
+    def _save(self):
+        """Сохраняет агрегаты на диск в фоновом потоке"""
+        rows = [[tank_id, self.names.get(tank_id)] + list(row) for tank_id, row in self.rows.items()]
+        _writer.submit_coalesced(self.path, self._write_rows, rows)
+
+    def _write_rows(self, rows):
+        """Записывает агрегаты на диск (в потоке записи)"""
+        try:
+            cache_dir = os.path.dirname(self.path)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            with _metrics.timer('io.write.tank_stats'):
+                with open(self.path, 'w') as f:
+                    json.dump({'version': TANK_STATS_VERSION, 'fields': TANK_STATS_FIELDS, 'tanks': rows}, f, separators=(',', ':'))
+        except Exception as e:
+            err("[WinChance] Error saving tank stats: {}".format(e))
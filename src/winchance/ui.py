@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Перетаскиваемое окно с шансом на победу
+"""
+
+import BigWorld
+
+from .core import _configs, _logger, _metrics, _watchdog, err, log, timed
+
+class DraggableWinChanceWindow(object):
+    """Перетаскиваемое окно для отображения Win Chance"""
+    
+    def __init__(self):
+        self.components = []
+        self.isDragging = False
+        self.lastMousePos = (0, 0)
+        self.mouseHandlerActive = False
+        self.callbackID = None
+        
+        # Дефолтная позиция (правый верхний угол)
+        self.posX = 0.75
+        self.posY = 0.05
+        
+        self.loadConfig()
+    
+    def loadConfig(self):
+        """Загружает позицию из конфига и следит за его правками"""
+        try:
+            config = _configs.load('mod_winchance')
+            if config is not None:
+                self._apply_config(config)
+            _configs.subscribe('mod_winchance', self._apply_config)
+        except Exception as e:
+            _logger.debug("[WinChance] Error loading config: {}", e)
+    
+    def _apply_config(self, config):
+        """Применяет позицию из конфига"""
+        self.posX = config.get('posX', self.posX)
+        self.posY = config.get('posY', self.posY)
+        log("[WinChance] Config loaded: position ({:.3f}, {:.3f})".format(self.posX, self.posY))
+    
+    @timed('overlay.save_config', 'storage')
+    def saveConfig(self):
+        """Сохраняет позицию в конфиг"""
+        try:
+            # Отложенная запись; несколько перетаскиваний подряд схлопываются
+            _configs.update('mod_winchance', posX=self.posX, posY=self.posY)
+        except Exception as e:
+            _logger.debug("[WinChance] Error saving config: {}", e)
+    
+    def create(self):
+        """Cоздает окно"""
+        try:
+            log("[WinChance] Window created (GUI-based)")
+            return True
+        except Exception as e:
+            err("[WinChance] Error creating window: {}".format(e))
+            return False
+    
+    def update_text(self, text):
+        """Обновляет текст окна"""
+        try:
+            self.createWindow(text)
+        except Exception as e:
+            _logger.debug("[WinChance] Update text error: {}", e)
+    
+    def createWindow(self, message):
+        """Создает/обновляет окно с текстом"""
+        try:
+            self.destroyWindow()
+            _metrics.incr('overlay.redraws')
+            
+            import GUI
+            
+            # Парсим сообщение: "Win Chance: 56.5% | Ally WGR: 5684 | Enemy WGR: 5160"
+            parts = message.split('|')
+            
+            # === ФОН ===
+            bgLines = 3
+            for i in range(bgLines):
+                bgLine = GUI.Text(u"█" * 50)
+                bgLine.font = "default_small.font"
+                bgLine.colour = (240, 240, 240, 230)  # Светло-серый фон
+                bgLine.position = (self.posX - 0.01, self.posY + i * 0.030, 0.9)
+                GUI.addRoot(bgLine)
+                self.components.append(('bg', bgLine, i))
+            
+            
+            # === Win Chance (первая строка, сверху) ===
+            if len(parts) > 0:
+                chance_text = parts[0].strip()  # "Win Chance: 56.5%"
+                chance_value = float(chance_text.split(':')[1].strip().replace('%', ''))
+                
+                # Цвет на основе шанса
+                if chance_value >= 60:
+                    color = (50, 205, 50, 255)  # Зеленый
+                elif chance_value >= 45:
+                    color = (255, 215, 0, 255)  # Желтый/золотой
+                else:
+                    color = (220, 20, 60, 255)  # Красный
+                
+                chanceComp = GUI.Text(chance_text)
+                chanceComp.font = "default_medium.font"
+                chanceComp.colour = color
+                chanceComp.position = (self.posX, self.posY + 0.040, 0.95)  # Больший Y = выше
+                GUI.addRoot(chanceComp)
+                self.components.append(('text', chanceComp, 0.040))
+            
+            # === WGR (вторая строка, снизу) ===
+            if len(parts) >= 3:
+                # Форматируем: "Ally WGR: 5580 | Enemy WGR: 4463"
+                ally_wgr = parts[1].strip().replace('Ally WGR:', '').strip()
+                enemy_wgr = parts[2].strip().replace('Enemy WGR:', '').strip()
+                
+                wgr_line = u"Ally WGR: {} | Enemy WGR: {}".format(ally_wgr, enemy_wgr)
+                
+                # Сколько игроков боя уже встречались ("Met: 3")
+                if len(parts) >= 4:
+                    wgr_line += u" | {}".format(parts[3].strip())
+                
+                wgrText = GUI.Text(wgr_line)
+                wgrText.font = "default_small.font"
+                wgrText.colour = (120, 120, 120, 255)  # Серый
+                wgrText.position = (self.posX, self.posY + 0.008, 0.95)  # Меньший Y = ниже
+                GUI.addRoot(wgrText)
+                self.components.append(('text', wgrText, 0.008))
+            
+            self.startMouseHandler()
+            
+        except Exception as e:
+            err("[WinChance] Error creating window: {}".format(e))
+    
+    def destroyWindow(self):
+        """Уничтожает окно"""
+        try:
+            import GUI
+            self.stopMouseHandler()
+            for _, component, _ in self.components:
+                try:
+                    GUI.delRoot(component)
+                except:
+                    pass
+            self.components = []
+        except:
+            pass
+    
+    def startMouseHandler(self):
+        """Запускает обработчик мыши для перетаскивания"""
+        if not self.mouseHandlerActive and not _watchdog.is_degraded('overlay'):
+            self.mouseHandlerActive = True
+            self.checkMouseInput()
+    
+    def stopMouseHandler(self):
+        """Останавливает обработчик мыши"""
+        self.mouseHandlerActive = False
+        if self.callbackID is not None:
+            try:
+                BigWorld.cancelCallback(self.callbackID)
+            except:
+                pass
+            self.callbackID = None
+    
+    @timed('overlay.mouse_input', 'overlay')
+    def checkMouseInput(self):
+        """Проверяет ввод мыши для перетаскивания (Ctrl + ЛКМ)"""
+        if not self.mouseHandlerActive:
+            return
+        
+        # В экономном режиме перетаскивание отключается
+        if _watchdog.is_degraded('overlay'):
+            self.stopMouseHandler()
+            return
+        
+        try:
+            import GUI
+            import Keys
+            
+            cursor = GUI.mcursor()
+            if cursor:
+                mouseX, mouseY = cursor.position[0], cursor.position[1]
+                
+                # Проверяем Ctrl + ЛКМ
+                ctrlPressed = BigWorld.isKeyDown(Keys.KEY_LCONTROL) or BigWorld.isKeyDown(Keys.KEY_RCONTROL)
+                leftMouseDown = BigWorld.isKeyDown(Keys.KEY_LEFTMOUSE)
+                
+                if ctrlPressed and leftMouseDown:
+                    if not self.isDragging:
+                        self.isDragging = True
+                        self.lastMousePos = (mouseX, mouseY)
+                    else:
+                        deltaX = mouseX - self.lastMousePos[0]
+                        deltaY = mouseY - self.lastMousePos[1]
+                        
+                        self.posX += deltaX
+                        self.posY += deltaY
+                        self.updateWindowPosition()
+                        self.lastMousePos = (mouseX, mouseY)
+                else:
+                    if self.isDragging:
+                        self.isDragging = False
+                        _watchdog.run_or_defer('storage', self.saveConfig)
+        except Exception as e:
+            _logger.debug("[WinChance] Mouse error: {}", e)
+        
+        # Следующая проверка
+        self.callbackID = BigWorld.callback(0.05, self.checkMouseInput)
+    
+    def updateWindowPosition(self):
+        """Обновляет позицию всех компонентов"""
+        try:
+            import GUI
+            for comp_type, component, offset in self.components:
+                if comp_type == 'bg':
+                    component.position = (self.posX - 0.01, self.posY + offset * 0.022, 0.9)
+                elif comp_type == 'text':
+                    component.position = (self.posX, self.posY + offset, 0.95)
+        except:
+            pass
+    
+    def destroy(self):
+        """Уничтожает окно"""
+        try:
+            self.destroyWindow()
+            log("[WinChance] Window destroyed")
+        except Exception as e:
+            err("[WinChance] Error destroying window: {}".format(e))
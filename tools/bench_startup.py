@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Cold-start benchmark for the mod entry point.
+
+Runs `import mod_winchance; mod_winchance.init()` in fresh interpreters
+against minimal stand-ins for the game modules (BigWorld, Account,
+gui.battle_control) and reports:
+  - median import + init time (the part that delays client startup)
+  - median time of the first two monitor ticks (lazy display creation,
+    then the API client import and startup check)
+  - heavy modules that were already loaded after init
+
+Exits with code 1 when the median import + init time or one of the
+first ticks exceeds its budget, or a heavy module is loaded during init,
+so it can guard builds.
+
+Usage:
+  python bench_startup.py [--python python2.7] [--runs 15] [--budget-ms 60] [--tick-budget-ms 40]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Модули, которые не должны загружаться до первого использования
+HEAVY_MODULES = ('urllib2', 'urllib.request', 'socket', 'cPickle', 'mmap',
+                 'winchance.display', 'winchance.api', 'winchance.remote', 'winchance.ratingdb')
+
+STUBS = {
+    'BigWorld.py': '''
+import time
+_callbacks = {}
+_next_id = [0]
+
+def callback(delay, fn):
+    _next_id[0] += 1
+    _callbacks[_next_id[0]] = fn
+    return _next_id[0]
+
+def cancelCallback(callback_id):
+    _callbacks.pop(callback_id, None)
+
+def run_pending():
+    pending = list(_callbacks.items())
+    _callbacks.clear()
+    for _, fn in pending:
+        fn()
+
+def player():
+    return None
+
+def time():
+    return 0.0
+''',
+    'Account.py': '''
+class Account(object):
+    def onBattleResultsReceived(self, accountDBID, stuck, result):
+        pass
+''',
+    'gui/__init__.py': '',
+    'gui/battle_control/__init__.py': '',
+    'gui/battle_control/avatar_getter.py': '''
+def getArena():
+    return None
+''',
+}
+
+RESULT_MARKER = 'BENCH_RESULT '
+
+SAMPLE = '''
+import sys, time, json
+RESULT = %(marker)r
+start = time.time()
+import mod_winchance
+mod_winchance.init()
+init_ms = (time.time() - start) * 1000.0
+loaded = sorted(name for name in %(heavy)r if name in sys.modules)
+import BigWorld
+ticks_ms = []
+for _ in range(2):
+    start = time.time()
+    BigWorld.run_pending()
+    ticks_ms.append((time.time() - start) * 1000.0)
+mod_winchance.fini()
+sys.stdout.write('\\n' + RESULT + json.dumps({'init_ms': init_ms, 'ticks_ms': ticks_ms, 'loaded': loaded}) + '\\n')
+'''
+
+
+def write_stubs(root):
+    """Write stand-ins for the game modules into root"""
+    for rel_path, source in STUBS.items():
+        path = os.path.join(root, rel_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(source)
+
+
+def run_sample(python, root, src_dir):
+    """Run one cold start in a fresh interpreter and return its measurements"""
+    work_dir = tempfile.mkdtemp(dir=root)
+    try:
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.join(root, 'stubs'), src_dir])
+        env['PYTHONDONTWRITEBYTECODE'] = '1'
+        output = subprocess.check_output(
+            [python, '-c', SAMPLE % {'heavy': HEAVY_MODULES, 'marker': RESULT_MARKER}], cwd=work_dir, env=env)
+        # Строка результата отделена от вывода фоновых задач мода
+        lines = [line for line in output.decode('utf-8').splitlines() if line.startswith(RESULT_MARKER)]
+        return json.loads(lines[-1][len(RESULT_MARKER):])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure mod cold-start time')
+    parser.add_argument('--python', default=sys.executable, help='interpreter to benchmark (the game uses 2.7)')
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float, default=60.0, help='maximum median import + init time')
+    parser.add_argument('--tick-budget-ms', type=float, default=40.0,
+                        help='maximum median time of each of the first monitor ticks')
+    parser.add_argument('--src', default=SRC_DIR, help='directory containing mod_winchance.py')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='winchance_bench_')
+    try:
+        write_stubs(os.path.join(root, 'stubs'))
+        samples = [run_sample(args.python, root, os.path.abspath(args.src)) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    init_ms = median([sample['init_ms'] for sample in samples])
+    ticks_ms = [median([sample['ticks_ms'][index] for sample in samples]) for index in range(2)]
+    loaded = sorted(set(name for sample in samples for name in sample['loaded']))
+
+    print('runs:             %d' % args.runs)
+    print('import + init:    %.1f ms (budget %.1f ms)' % (init_ms, args.budget_ms))
+    print('first tick:       %.1f ms (budget %.1f ms)' % (ticks_ms[0], args.tick_budget_ms))
+    print('second tick:      %.1f ms (budget %.1f ms)' % (ticks_ms[1], args.tick_budget_ms))
+    print('heavy after init: %s' % (', '.join(loaded) or 'none'))
+
+    if init_ms > args.budget_ms or max(ticks_ms) > args.tick_budget_ms or loaded:
+        print('FAIL')
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
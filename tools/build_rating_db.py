@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Builds the offline player rating database (ratings.db) used by the mod
+when XVM is not available.
+
+Input is a CSV file with a header row or a JSON export:
+  CSV:  account_id,wgr,wins,battles
+  JSON: [{"account_id": 1, "wgr": 5000, "wins": 10, "battles": 20}, ...]
+        or {"1": {"wgr": 5000, "wins": 10, "battles": 20}, ...}
+
+Column aliases: accountDBID/id for account_id, global_rating for wgr.
+
+Output format (little endian, see OfflineRatingDb in src/winchance/ratingdb.py):
+  header  <4sHHI  magic 'WCRD', version 1, record size, record count
+  records <QIII   accountDBID, wgr, wins, battles - sorted by accountDBID
+
+Usage:
+  python build_rating_db.py ratings.csv ratings.db
+  copy ratings.db to <WoT>/mods/configs/mod_winchance/ratings.db
+"""
+import csv
+import json
+import os
+import struct
+import sys
+
+MAGIC = b'WCRD'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+RECORD = struct.Struct('<QIII')
+
+ID_FIELDS = ('account_id', 'accountDBID', 'id')
+WGR_FIELDS = ('wgr', 'global_rating')
+UINT32_MAX = 0xFFFFFFFF
+
+
+def pick(row, names, default=None):
+    """Return the first present field from names"""
+    for name in names:
+        value = row.get(name)
+        if value not in (None, ''):
+            return value
+    return default
+
+
+def to_record(account_id, row):
+    """Convert one input row to a (account_id, wgr, wins, battles) tuple"""
+    clamp = lambda value: max(0, min(UINT32_MAX, int(float(value or 0))))
+    return (int(account_id), clamp(pick(row, WGR_FIELDS, 0)),
+            clamp(row.get('wins')), clamp(row.get('battles')))
+
+
+def read_csv(path):
+    """Yield records from a CSV export"""
+    with open(path, 'r') as f:
+        for row in csv.DictReader(f):
+            account_id = pick(row, ID_FIELDS)
+            if account_id:
+                yield to_record(account_id, row)
+
+
+def read_json(path):
+    """Yield records from a JSON export (list of rows or id -> row mapping)"""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        for account_id, row in data.items():
+            yield to_record(account_id, row)
+    else:
+        for row in data:
+            account_id = pick(row, ID_FIELDS)
+            if account_id:
+                yield to_record(account_id, row)
+
+
+def build(src_path, dst_path):
+    """Build dst_path from src_path, returns the number of players written"""
+    reader = read_json if src_path.lower().endswith('.json') else read_csv
+
+    # Later rows for the same account override earlier ones
+    records = {}
+    for record in reader(src_path):
+        records[record[0]] = record
+
+    tmp_path = dst_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(records)))
+        for account_id in sorted(records):
+            f.write(RECORD.pack(*records[account_id]))
+
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    os.rename(tmp_path, dst_path)
+    return len(records)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(2)
+
+    count = build(sys.argv[1], sys.argv[2])
+    print("Wrote %d players to %s" % (count, sys.argv[2]))
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end check of the companion process and the mod's client.
+
+Starts a stand-in API server, launches companion/winchance_companion.py
+and drives winchance.companion the way the game loop does (pump() on a
+timer) against stand-ins for the game modules. Checks:
+  - handshake, battle upload and update reach the API (with a retry
+    after a 500 answer)
+  - stats.summary over a sample battle_results.csv
+  - requests in flight fall back to the local path when the companion
+    is killed
+  - the client waits at least the companion's retry budget
+  - a companion of another protocol version is dropped for the session
+
+Usage:
+  python companion_harness.py [--python python2.7]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from bench_startup import write_stubs
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+COMPANION = os.path.join(ROOT_DIR, 'companion', 'winchance_companion.py')
+
+SAMPLE_RESULTS = (
+    'Battle_ID,Start_Time,End_Time,Player_Name,Vehicle_Name,Win_Chance,Ally_WGR,Enemy_WGR,'
+    'Victory,Team_Result,Prediction_Correct,Prediction_Error\n'
+    '1,,,p,t,70.0,6000,5000,Win,1,Yes,30.0\n'
+    '2,,,p,t,40.0,5000,6000,Win,1,No,60.0\n'
+)
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_api():
+    """Stand-in API: records requests, answers 500 to the first upload"""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def _handle(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            received.append((self.command, self.path, json.loads(body.decode('utf-8'))))
+            status = 500 if len(received) == 1 else (201 if self.command == 'POST' else 200)
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        do_POST = do_PUT = _handle
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, received
+
+
+def wait_for(predicate, companion, timeout=10.0):
+    """Run the game loop (pump every 20 ms) until predicate() holds"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        companion.pump()
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def check(condition, message):
+    print('%s %s' % ('ok  ' if condition else 'FAIL', message))
+    if not condition:
+        raise SystemExit(1)
+
+
+def run(python):
+    work_dir = tempfile.mkdtemp(prefix='winchance_companion_')
+    process = None
+    try:
+        write_stubs(os.path.join(work_dir, 'stubs'))
+        logs_dir = os.path.join(work_dir, 'logs')
+        os.makedirs(logs_dir)
+        with open(os.path.join(logs_dir, 'battle_results.csv'), 'w') as f:
+            f.write(SAMPLE_RESULTS)
+
+        api_server, received = start_api()
+        port = free_port()
+        process = subprocess.Popen([python, COMPANION, '--port', str(port), '--logs', logs_dir,
+                                    '--backoff', '0.05'], stdout=subprocess.PIPE)
+        process.stdout.readline()
+
+        sys.path[:0] = [os.path.join(work_dir, 'stubs'), os.path.join(ROOT_DIR, 'src')]
+        os.chdir(work_dir)
+        from winchance import companion, ipc
+        from winchance.core import API_CONFIG
+
+        API_CONFIG.update({'api_url': 'http://127.0.0.1:%d' % api_server.server_address[1], 'token': 't'})
+        API_CONFIG['companion'] = {'enabled': True, 'host': '127.0.0.1', 'port': port, 'timeout': 5}
+
+        check(wait_for(lambda: companion._handshake_done, companion), 'handshake')
+        # 4 попытки по 10 с и задержки 0.05+0.1+0.2 с, плюс запас
+        check(companion._client.timeout == 40.35 + companion.BUDGET_MARGIN,
+              'client timeout covers retry budget: %s' % companion._client.timeout)
+
+        fallbacks = []
+        check(companion.send_battle({'ArenaUniqueId': 7, 'Result': 'win'}, lambda: fallbacks.append('create')),
+              'upload accepted by companion')
+        check(wait_for(lambda: len(received) >= 2, companion), 'upload retried after HTTP 500')
+        check(received[-1] == ('POST', '/api/battles', {'ArenaUniqueId': 7, 'Result': 'win'}), 'upload body')
+
+        check(companion.send_battle_update(7, {'DamageDealt': 900}), 'update accepted by companion')
+        check(wait_for(lambda: len(received) >= 3, companion), 'update delivered')
+        check(received[-1] == ('PUT', '/api/battles/7', {'DamageDealt': 900}), 'update body')
+
+        summary = []
+        companion._client.send('stats.summary', {}, lambda ok, result: summary.append((ok, result)))
+        check(wait_for(lambda: summary, companion), 'summary answered')
+        ok, result = summary[0]
+        check(ok and result['battles'] == 2 and result['accuracy'] == 50.0, 'summary values: %s' % result)
+
+        # Компаньон пропал с запросом в полете: отправка уходит в fallback
+        api_server.shutdown()
+        companion.send_battle({'ArenaUniqueId': 8}, lambda: fallbacks.append('lost'))
+        process.kill()
+        process.wait()
+        check(wait_for(lambda: fallbacks == ['lost'], companion), 'fallback after companion exit')
+        check(not companion.send_battle({'ArenaUniqueId': 9}), 'no offload while disconnected')
+
+        # Компаньон другой версии протокола: отключаемся до конца сессии
+        process = subprocess.Popen([python, COMPANION, '--port', str(port)], stdout=subprocess.PIPE)
+        process.stdout.readline()
+        companion.PROTOCOL_VERSION = ipc.PROTOCOL_VERSION + 1
+        check(wait_for(lambda: companion._disabled, companion), 'version mismatch disables companion')
+        wait_for(lambda: False, companion, 0.5)
+        check(companion._client is None and not companion.enabled(), 'no reconnect after version mismatch')
+
+        # Медленный клиент: кадры, пришедшие по частям, собираются целиком
+        decoder = ipc.FrameDecoder()
+        frame = ipc.encode_frame({'id': 1, 'ok': True}) * 2
+        messages = []
+        for i in range(len(frame)):
+            messages.extend(decoder.feed(frame[i:i + 1]))
+        check(messages == [{'id': 1, 'ok': True}] * 2, 'frame reassembly')
+        print('OK')
+        return 0
+    finally:
+        if process is not None and process.poll() is None:
+            process.kill()
+        os.chdir(ROOT_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Companion end-to-end check')
+    parser.add_argument('--python', default=sys.executable, help='interpreter for the companion process')
+    args = parser.parse_args()
+    return run(args.python)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
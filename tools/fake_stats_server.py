@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the rating service used by RemoteStatsProvider.
+
+Answers GET /api/stats?ids=1,2,3 with
+  {"data": {"1": {"wgr": ..., "wins": ..., "battles": ...}, ...}}
+
+Stats come from an optional CSV/JSON export (same formats as
+build_rating_db.py); unknown ids get deterministic pseudo-random stats.
+
+Usage:
+  python fake_stats_server.py [--port 5001] [--delay 0.2] [--source ratings.csv]
+
+then set in mods/configs/mod_winchance_api.json:
+  "stats_service": {"enabled": true, "url": "http://localhost:5001/api/stats"}
+"""
+import argparse
+import json
+import random
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+import build_rating_db
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(known, delay):
+    """Create a request handler bound to the known stats and response delay"""
+
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            ids = [int(value) for value in ','.join(query.get('ids', [])).split(',') if value]
+
+            if delay:
+                time.sleep(delay)
+
+            data = {}
+            for account_id in ids:
+                if account_id in known:
+                    _, wgr, wins, battles = known[account_id]
+                else:
+                    rng = random.Random(account_id)
+                    battles = rng.randint(100, 40000)
+                    wins = int(battles * rng.uniform(0.44, 0.62))
+                    wgr = int(5000 + (wins * 100.0 / battles - 50.0) * 175)
+                data[str(account_id)] = {'wgr': wgr, 'wins': wins, 'battles': battles}
+
+            body = json.dumps({'data': data}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return StatsHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--source', help='CSV or JSON export with known player stats')
+    args = parser.parse_args()
+
+    known = {}
+    if args.source:
+        reader = build_rating_db.read_json if args.source.lower().endswith('.json') else build_rating_db.read_csv
+        for record in reader(args.source):
+            known[record[0]] = record
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(known, args.delay))
+    print("Serving rating stats on http://127.0.0.1:%d/api/stats" % args.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end check of the battle result path: prediction -> arena result
+-> hangar result.
+
+Runs the mod (mod_winchance.init and the battle monitor on a simulated
+clock) against stand-ins for the game modules and a stand-in API
+server, plays one battle and then delivers its hangar results. Checks:
+  - the prediction is kept as a pending battle with its battle fields
+  - the arena result is uploaded once with the real map, team and tank
+  - the hangar result updates only the personal-result fields and
+    clears the pending battle
+  - per-tank averages come from the hangar result, not arena zeros
+
+Usage:
+  python2.7 results_harness.py   (the mod code needs Python 2.7)
+"""
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from bench_startup import write_stubs
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+ARENA_ID = 4242
+TANK_CD = 1234
+
+# Поверх заглушек bench_startup: часы BigWorld, игрок и текущая арена
+STUBS = {
+    'BigWorld.py': '''
+_callbacks = {}
+_next_id = [0]
+_now = [0.0]
+
+class _Player(object):
+    pass
+
+_player = _Player()
+
+def callback(delay, fn):
+    _next_id[0] += 1
+    _callbacks[_next_id[0]] = (_now[0] + delay, fn)
+    return _next_id[0]
+
+def cancelCallback(callback_id):
+    _callbacks.pop(callback_id, None)
+
+def time():
+    return _now[0]
+
+def serverTime():
+    return _now[0]
+
+def player():
+    return _player
+
+def advance(step):
+    _now[0] += step
+    due = sorted((at, callback_id) for callback_id, (at, _) in _callbacks.items() if at <= _now[0])
+    for _, callback_id in due:
+        entry = _callbacks.pop(callback_id, None)
+        if entry is not None:
+            entry[1]()
+''',
+    'gui/battle_control/avatar_getter.py': '''
+_arena = [None]
+
+def getArena():
+    return _arena[0]
+''',
+}
+
+
+class VehicleType(object):
+    compactDescr = TANK_CD
+    userString = 'T-34'
+    name = 'ussr:R04_T-34'
+    tags = frozenset(['mediumTank'])
+
+
+class VehicleDescr(object):
+    type = VehicleType()
+    level = 5
+
+
+class ArenaType(object):
+    name = 'karelia'
+    gameplayName = 'ctf'
+
+
+class Arena(object):
+    arenaUniqueID = ARENA_ID
+    arenaType = ArenaType()
+    period = 2
+    periodEndTime = 600.0
+
+    def __init__(self):
+        self.vehicles = dict((i, {'team': 1 if i < 15 else 2, 'name': 'p%d' % i, 'accountDBID': 1000 + i,
+                                  'vehicleType': VehicleDescr(), 'isAlive': True}) for i in range(30))
+
+
+def start_api():
+    """Stand-in API: records uploads and updates, answers every request"""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def _handle(self):
+            length = int(self.headers.get('Content-Length', 0) or 0)
+            body = self.rfile.read(length) if length else b''
+            if self.command in ('POST', 'PUT'):
+                received.append((self.command, self.path, json.loads(body.decode('utf-8'))))
+            self.send_response(201 if self.command == 'POST' else 200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        do_GET = do_POST = do_PUT = _handle
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, received
+
+
+def run_game(seconds, step=0.1):
+    """Advance the simulated clock, letting background threads run"""
+    import BigWorld
+    for _ in range(int(seconds / step)):
+        BigWorld.advance(step)
+        time.sleep(0.002)
+
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        run_game(0.5)
+        if predicate():
+            return True
+    return False
+
+
+def check(condition, message):
+    print('%s %s' % ('ok  ' if condition else 'FAIL', message))
+    if not condition:
+        raise SystemExit(1)
+
+
+def hangar_result(personal):
+    return pickle.dumps({'arenaUniqueId': ARENA_ID, 'common': {'winnerTeam': 1},
+                         'personal': {TANK_CD: personal}})
+
+
+def run():
+    work_dir = tempfile.mkdtemp(prefix='winchance_results_')
+    server = None
+    try:
+        stubs_dir = os.path.join(work_dir, 'stubs')
+        write_stubs(stubs_dir)
+        for rel_path, source in STUBS.items():
+            with open(os.path.join(stubs_dir, rel_path), 'w') as f:
+                f.write(source)
+        sys.path[:0] = [stubs_dir, os.path.join(ROOT_DIR, 'src')]
+        os.chdir(work_dir)
+
+        import Account
+        import BigWorld
+        from gui.battle_control import avatar_getter
+        import mod_winchance
+
+        server, received = start_api()
+        mod_winchance.init()
+        mod_winchance.API_CONFIG.update({'enabled': True, 'token': 't',
+                                         'api_url': 'http://127.0.0.1:%d' % server.server_address[1]})
+        run_game(1.0)
+
+        # Бой: игрок, арена, расчет и предсказание
+        player = BigWorld.player()
+        player.team, player.name, player.databaseID = 1, 'me', 1
+        player.vehicleTypeDescriptor, player.vehicleID = VehicleDescr(), 10
+        arena = Arena()
+        avatar_getter._arena[0] = arena
+        display = mod_winchance._get_display()
+        check(wait_for(lambda: display.data_ready, 30.0), 'win chance calculated')
+
+        pending = display.result_logger.get_pending_battle(ARENA_ID)
+        check(pending is not None, 'prediction kept as a pending battle')
+        check(pending['battle_info']['MapName'] == 'karelia' and pending['battle_info']['Tank']['TankId'] == TANK_CD,
+              'pending battle has its battle fields')
+
+        # Конец боя по арене
+        arena.period, arena.winnerTeam = 3, 1
+        uploads = lambda: [r for r in received if r[0] == 'POST' and r[2].get('Result') == 'win']
+        check(wait_for(lambda: uploads()), 'arena result uploaded')
+        upload = uploads()[0][2]
+        check((upload['ArenaUniqueId'], upload['MapName'], upload['BattleType'], upload['Team']) ==
+              (ARENA_ID, 'karelia', 'ctf', 1), 'arena upload has real battle fields')
+        check(display.result_logger.get_pending_battle(ARENA_ID) is not None, 'battle still waits for hangar results')
+        check(display.tank_stats.get(TANK_CD) is None, 'arena result not counted in tank stats')
+
+        # Выход в ангар и результаты боя
+        avatar_getter._arena[0] = None
+        run_game(2.0)
+        Account.Account().onBattleResultsReceived(1, 0, hangar_result(
+            {'damageDealt': 1500, 'kills': 2, 'xp': 900, 'credits': 30000, 'shots': 8, 'directHits': 7,
+             'piercings': 6, 'spotted': 3, 'damageAssistedRadio': 400, 'damageBlockedByArmor': 250}))
+        updates = lambda: [r for r in received if r[0] == 'PUT']
+        check(wait_for(lambda: updates()), 'hangar result sent as an update')
+        method, path, changes = updates()[0]
+        check(path == '/api/battles/%d' % ARENA_ID, 'update path %s' % path)
+        check(changes == {'DamageDealt': 1500, 'Kills': 2, 'Experience': 900, 'Credits': 30000, 'Shots': 8,
+                          'Hits': 7, 'Penetrations': 6, 'Spotted': 3, 'DamageAssisted': 400,
+                          'DamageBlocked': 250}, 'update carries only personal fields: %s' % sorted(changes))
+        check(display.result_logger.get_pending_battle(ARENA_ID) is None, 'pending battle cleared')
+        check(len([r for r in received if r[0] == 'POST' and r[2].get('Result') != 'undone']) == 1,
+              'battle uploaded once')
+        tank = display.tank_stats.get(TANK_CD)
+        check(tank is not None and (tank['battles'], tank['wins']) == (1, 1), 'battle counted once in tank stats')
+        check(tank['avg']['DamageDealt'] == 1500 and tank['avg']['Kills'] == 2 and tank['avg']['Hits'] == 7,
+              'tank averages from hangar result: %s' % tank['avg'])
+
+        mod_winchance.fini()
+        print('OK')
+        return 0
+    finally:
+        if server is not None:
+            server.shutdown()
+        os.chdir(ROOT_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(run())
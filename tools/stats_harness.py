@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end check of RemoteStatsProvider against fake_stats_server.py.
+
+Serves the fake rating service in-process and drives the provider the
+way _get_players_data does (XVM first, then the rating service) against
+stand-ins for the game modules and XVM. Checks:
+  - unknown players are fetched in batches of batch_size, each id once
+  - players XVM already knows are never sent to the service
+  - results are dropped at the next battle, late answers are ignored
+  - a service slower than the timeout leaves nothing in flight and the
+    battle falls back to XVM data
+
+Usage:
+  python2.7 stats_harness.py   (the mod code needs Python 2.7)
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+try:
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from urllib.parse import urlparse, parse_qs
+
+import fake_stats_server
+from bench_startup import write_stubs
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Игроки, которых знает XVM (accountDBID=vehCD -> данные cacheBattle)
+XVM_CACHE = {'1001=0': {'wgr': 7000, 'b': 20000, 'w': 11000},
+             '1002=0': {'wgr': 3000, 'b': 5000, 'w': 2300}}
+
+
+def start_service(delay):
+    """Fake rating service; records the ids of every request"""
+    requests = []
+    base = fake_stats_server.make_handler({}, delay)
+
+    class Handler(base):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            requests.append([int(value) for value in query['ids'][0].split(',')])
+            base.do_GET(self)
+
+        def log_message(self, *args):
+            pass
+
+    server = fake_stats_server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, requests
+
+
+def install_xvm():
+    """Stand-in for xvm_main.stats with a filled cacheBattle"""
+    package = types.ModuleType('xvm_main')
+    stats = types.ModuleType('xvm_main.stats')
+    stats._stat = type('Stat', (object,), {'cacheBattle': dict(XVM_CACHE)})()
+    package.stats = stats
+    sys.modules['xvm_main'] = package
+    sys.modules['xvm_main.stats'] = stats
+
+
+def resolve(providers, account_ids):
+    """Ask providers in order like _get_players_data; returns id -> source and unresolved ids"""
+    for provider in providers:
+        provider.prepare()
+    sources = {}
+    unresolved = []
+    for account_id in account_ids:
+        for provider in providers:
+            if provider.get_stats(account_id):
+                sources[account_id] = provider.name
+                break
+        else:
+            unresolved.append(account_id)
+    return sources, unresolved
+
+
+def wait_idle(provider, timeout=5.0):
+    deadline = time.time() + timeout
+    while provider.in_flight() and time.time() < deadline:
+        time.sleep(0.01)
+    return not provider.in_flight()
+
+
+def check(condition, message):
+    print('%s %s' % ('ok  ' if condition else 'FAIL', message))
+    if not condition:
+        raise SystemExit(1)
+
+
+def run():
+    work_dir = tempfile.mkdtemp(prefix='winchance_stats_')
+    try:
+        write_stubs(os.path.join(work_dir, 'stubs'))
+        sys.path[:0] = [os.path.join(work_dir, 'stubs'), os.path.join(ROOT_DIR, 'src')]
+        os.chdir(work_dir)
+        install_xvm()
+        from winchance.remote import RemoteStatsProvider
+        from winchance.stats import XvmStatsProvider
+
+        server, requests = start_service(0.0)
+        url = 'http://127.0.0.1:%d/api/stats' % server.server_address[1]
+        xvm = XvmStatsProvider()
+        remote = RemoteStatsProvider({'url': url, 'batch_size': 10, 'workers': 3, 'timeout': 2})
+        providers = [xvm, remote]
+        account_ids = [1001, 1002] + list(range(2000, 2025))
+
+        _, unresolved = resolve(providers, account_ids)
+        check(unresolved == list(range(2000, 2025)), 'XVM players resolved locally')
+        remote.request(unresolved)
+        remote.request(unresolved)
+        check(wait_idle(remote), 'batches answered')
+        check(sorted(len(ids) for ids in requests) == [5, 10, 10], 'batching: %s' % requests)
+        check(sorted(sum(requests, [])) == unresolved, 'each unknown player requested once')
+
+        sources, unresolved = resolve(providers, account_ids)
+        check(not unresolved and sources[1001] == 'xvm' and sources[2000] == 'remote', 'service fills the rest')
+
+        # Следующий бой: результаты прошлого боя не накапливаются
+        remote.on_battle_start()
+        check(remote.results == {}, 'results dropped at battle start')
+        server.shutdown()
+
+        # Медленный сервис: запросы отваливаются по таймауту, бой идет на данных XVM
+        slow_server, slow_requests = start_service(1.0)
+        slow = RemoteStatsProvider({'url': 'http://127.0.0.1:%d/api/stats' % slow_server.server_address[1],
+                                    'batch_size': 10, 'workers': 3, 'timeout': 0.2})
+        started = time.time()
+        slow.request(range(2000, 2025))
+        check(wait_idle(slow, 3.0) and time.time() - started < 1.0, 'timed out requests are not in flight')
+        sources, unresolved = resolve([xvm, slow], account_ids)
+        check(sources == {1001: 'xvm', 1002: 'xvm'} and len(unresolved) == 25, 'fallback to XVM data')
+
+        # Поздний ответ прошлого боя не попадает в новый
+        slow.timeout = 5
+        slow.request([3000])
+        slow.on_battle_start()
+        check(wait_idle(slow, 3.0) and slow.results == {}, 'late answer of previous battle ignored')
+        check(len(slow_requests) == 4, 'slow service saw every batch')
+
+        remote.close()
+        slow.close()
+        slow_server.shutdown()
+        print('OK')
+        return 0
+    finally:
+        os.chdir(ROOT_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(run())